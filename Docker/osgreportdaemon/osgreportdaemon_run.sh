@@ -0,0 +1,34 @@
+#!/bin/sh
+
+# Wrapper script to start the OSG report daemon inside a Docker container.
+# Unlike the other wrapper scripts, this is run once (not from cron):  the
+# daemon schedules the reports itself, based on the [daemon] section of osg.toml
+# Example:  ./osgreportdaemon_run.sh
+
+
+export TOPDIR=/opt/gracc-osg-reports
+export LOCALLOGDIR=${TOPDIR}/log
+export SCRIPTLOGFILE=${LOCALLOGDIR}/osgreportdaemon_run.log
+export REPORTLOGFILE=${LOCALLOGDIR}/osgreportdaemon.log
+export CONFIGDIR=${TOPDIR}/config
+
+# Check to see if logdir exists.  Create it if it doesn't
+if [ ! -d "$LOCALLOGDIR" ]; then
+        mkdir -p $LOCALLOGDIR
+fi
+
+touch ${REPORTLOGFILE}
+chmod a+w ${REPORTLOGFILE}
+
+# Run the docker command
+docker run -d --restart=unless-stopped --net=host \
+        --name osgreportdaemon \
+        -v ${CONFIGDIR}:/tmp/gracc-osg-reports-config \
+        -v ${LOCALLOGDIR}:/tmp/log \
+        opensciencegrid/gracc-osg-reports:latest osgreportdaemon \
+        -c /tmp/gracc-osg-reports-config/osg.toml \
+        -L /tmp/log/osgreportdaemon.log \
+        --status-file /tmp/log/osgreportdaemon.status.json
+
+echo "STARTED" `date` >> $SCRIPTLOGFILE
+exit 0
@@ -0,0 +1,2 @@
+"""Benchmarks for gracc-osg-reports.  Run them from the top of the repository
+with python -m, e.g. python -m benchmarks.importtime"""
@@ -0,0 +1,338 @@
+"""Recorded Elasticsearch responses, for running the reports offline.
+
+FixtureClient stands in for elasticsearch.Elasticsearch.  Each search the
+reports send is looked up by its index and request body (the Search's
+to_dict()), and the recorded response is returned.  install() makes
+ReportUtils.Reporter build a FixtureClient instead of a real client, nulls
+out SMTP, and answers the Topology/sites/XD lookups (see Cache) from the
+recorded values too, so that a report runs end to end with no network.
+
+In record mode, the searches and lookups go to the real services, and what
+comes back is saved:
+
+    store = FixtureStore('fixtures/')
+    install(store, record=True)
+    ... run reports against the real cluster ...
+    store.save()
+
+Fixture directory layout:
+
+    searches/<sha1 of index and body>.json   {"index", "body", "response"}
+    lookups.json                             {cache name: [[key, value]...]}
+
+Lookup values that JSON can't hold (bytes, tuples) are tagged, e.g.
+{"__bytes__": "<base64>"}.
+
+Fixtures hold whole responses.  A search sent with filter_path gets the
+recorded response trimmed by filter_response(), the way Elasticsearch would
+have trimmed it.
+"""
+
+import base64
+import glob
+import hashlib
+import json
+import os
+import smtplib
+
+from gracc_reporting import ReportUtils
+
+from gracc_osg_reports import Cache
+
+
+class FixtureMissing(KeyError):
+    """A search or lookup that has no recorded response"""
+
+
+def fixture_key(index, body):
+    """Key of a search: sha1 of its index list and request body
+
+    :param index: Index name, list of index names or None
+    :param dict body: Request body
+    :return str: Hex digest
+    """
+    if isinstance(index, str):
+        index = index.split(',')
+    text = json.dumps({'index': index, 'body': body}, sort_keys=True,
+                      default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _advance(states, name):
+    """Where each (path, position) state of filter_response goes on
+    entering field name"""
+    found = []
+    for path, i in states:
+        if path[i] == '**':
+            found.append((path, i))     # ** takes this field too
+            if i + 1 < len(path) and path[i + 1] in (name, '*'):
+                found.append((path, i + 2))
+        elif path[i] in (name, '*'):
+            found.append((path, i + 1))
+    return found
+
+
+def _filter(value, states):
+    """The part of value matched by states, or None"""
+    if isinstance(value, dict):
+        kept = {}
+        for name, item in value.items():
+            found = _advance(states, name)
+            if any(i == len(path) for path, i in found):
+                kept[name] = item
+            elif found:
+                item = _filter(item, found)
+                if item is not None:
+                    kept[name] = item
+        return kept or None
+    if isinstance(value, list):
+        kept = [item for item in (_filter(v, states) for v in value)
+                if item is not None]
+        return kept or None
+    return None
+
+
+def filter_response(body, filter_path):
+    """A response as Elasticsearch returns it for a search sent with
+    filter_path: only the fields matched by one of its comma-separated
+    paths, where * matches one field name and ** any number of them.
+    Objects and lists left empty are dropped.
+
+    :param dict body: Whole response
+    :param str filter_path: filter_path parameter of the search
+    :return dict: Trimmed response
+    """
+    states = [(path.split('.'), 0) for path in filter_path.split(',')]
+    return _filter(body, states) or {}
+
+
+def _encode(value):
+    """Tag the values JSON can't hold"""
+    if isinstance(value, bytes):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    return value
+
+
+def _decode(value):
+    """Undo _encode"""
+    if isinstance(value, dict):
+        if '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        if '__tuple__' in value:
+            return tuple(_decode(v) for v in value['__tuple__'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+class FixtureStore(object):
+    """Recorded search responses and lookups in a directory
+
+    Responses are kept as JSON text, so that replaying one costs a JSON
+    decode, like a real response does.
+
+    :param str directory: Fixture directory
+    """
+    def __init__(self, directory):
+        # Absolute, since the reports may change the working directory
+        self.directory = os.path.abspath(directory)
+        self.searches = {}
+        self.lookups = {}
+        self.load()
+
+    def load(self):
+        """Read every fixture in the directory"""
+        for path in glob.glob(os.path.join(self.directory, 'searches',
+                                           '*.json')):
+            with open(path) as f:
+                self.searches[os.path.basename(path)[:-5]] = f.read()
+        try:
+            with open(os.path.join(self.directory, 'lookups.json')) as f:
+                lookups = json.load(f)
+        except FileNotFoundError:
+            lookups = {}
+        self.lookups = {name: {key: _decode(value) for key, value in items}
+                        for name, items in lookups.items()}
+
+    def save(self):
+        """Write the recorded lookups.  Searches are written as they are
+        added."""
+        os.makedirs(self.directory, exist_ok=True)
+        lookups = {name: [[key, _encode(value)]
+                          for key, value in sorted(items.items())]
+                   for name, items in sorted(self.lookups.items())}
+        with open(os.path.join(self.directory, 'lookups.json'), 'w') as f:
+            json.dump(lookups, f, indent=1, sort_keys=True)
+
+    def add_search(self, index, body, response):
+        """Record the response to a search"""
+        key = fixture_key(index, body)
+        text = json.dumps({'index': index, 'body': body, 'response': response},
+                          sort_keys=True, default=str)
+        self.searches[key] = text
+        searchdir = os.path.join(self.directory, 'searches')
+        os.makedirs(searchdir, exist_ok=True)
+        with open(os.path.join(searchdir, key + '.json'), 'w') as f:
+            f.write(text)
+
+    def get_search(self, index, body):
+        """:return dict: Recorded response to a search"""
+        try:
+            text = self.searches[fixture_key(index, body)]
+        except KeyError:
+            raise FixtureMissing("No recorded response for a search on {0} "
+                                 "in {1}: {2}".format(
+                                     index, self.directory,
+                                     json.dumps(body, sort_keys=True,
+                                                default=str)[:500]))
+        return json.loads(text)['response']
+
+    def add_lookup(self, name, key, value):
+        """Record a value of a Cache lookup"""
+        self.lookups.setdefault(name, {})[key] = value
+
+    def get_lookup(self, name, key):
+        """:return: Recorded value of a Cache lookup"""
+        try:
+            return self.lookups[name][key]
+        except KeyError:
+            raise FixtureMissing("No recorded '{0}' lookup of {1} in "
+                                 "{2}".format(name, key, self.directory))
+
+
+class FixtureResponse(dict):
+    """Response dict with the .body of elasticsearch.ObjectApiResponse"""
+    @property
+    def body(self):
+        return self
+
+
+class FixtureClient(object):
+    """Stand-in for elasticsearch.Elasticsearch that answers searches from a
+    FixtureStore.  With a real client, searches go to it, and the responses
+    are recorded.
+
+    :param FixtureStore store: Recorded responses
+    :param elasticsearch.Elasticsearch real: Client to record from
+    """
+    transport = None
+
+    def __init__(self, store, real=None):
+        self.store = store
+        self.real = real
+
+    def perform_request(self, method, path, *args, **kwargs):
+        """Only the cluster health check goes through here"""
+        if self.real is not None:
+            return self.real.perform_request(method, path, *args, **kwargs)
+        return 'green\n'
+
+    def search(self, index=None, body=None, **params):
+        # The whole response is recorded, and trimmed here
+        filter_path = params.pop('filter_path', None)
+        if self.real is not None:
+            response = self.real.search(index=index, body=body, **params)
+            self.store.add_search(index, body, response.body)
+            if filter_path is None:
+                return response
+            response = response.body
+        else:
+            response = self.store.get_search(index, body)
+        if filter_path is not None:
+            response = filter_response(response, filter_path)
+        return FixtureResponse(response)
+
+    def msearch(self, body, **params):
+        pairs = list(zip(body[0::2], body[1::2]))
+        if self.real is not None:
+            response = self.real.msearch(body=body, **params)
+            for (header, search), r in zip(pairs, response['responses']):
+                if 'error' not in r:
+                    self.store.add_search(header.get('index'), search, r)
+            return response
+        return {'responses': [self.store.get_search(header.get('index'),
+                                                    search)
+                              for header, search in pairs]}
+
+    def close(self):
+        if self.real is not None:
+            self.real.close()
+
+
+class NullSMTP(object):
+    """Stand-in for smtplib.SMTP that drops every message"""
+    sent = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def sendmail(self, *args, **kwargs):
+        NullSMTP.sent += 1
+        return {}
+
+    def send_message(self, *args, **kwargs):
+        NullSMTP.sent += 1
+        return {}
+
+    def quit(self):
+        return
+
+    close = quit
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return
+
+
+_originals = {}
+
+
+def install(store, record=False):
+    """Route Elasticsearch clients, SMTP and Cache lookups through store
+
+    :param FixtureStore store: Where responses are read from or recorded to
+    :param bool record: Send searches and lookups to the real services, and
+        record the results
+    """
+    if _originals:
+        uninstall()
+    _originals['Elasticsearch'] = ReportUtils.Elasticsearch
+    _originals['SMTP'] = smtplib.SMTP
+    _originals['get'] = Cache.TTLCache.get
+    real_es = ReportUtils.Elasticsearch
+    real_get = Cache.TTLCache.get
+
+    def elasticsearch(*args, **kwargs):
+        return FixtureClient(store, real_es(*args, **kwargs) if record
+                             else None)
+
+    def recording_get(cache, key, loader):
+        value = real_get(cache, key, loader)
+        if value is not None:
+            store.add_lookup(cache.name, key, value)
+        return value
+
+    def replaying_get(cache, key, loader):
+        return store.get_lookup(cache.name, key)
+
+    ReportUtils.Elasticsearch = elasticsearch
+    smtplib.SMTP = NullSMTP
+    Cache.TTLCache.get = recording_get if record else replaying_get
+
+
+def uninstall():
+    """Put back what install() replaced"""
+    if not _originals:
+        return
+    ReportUtils.Elasticsearch = _originals.pop('Elasticsearch')
+    smtplib.SMTP = _originals.pop('SMTP')
+    Cache.TTLCache.get = _originals.pop('get')
@@ -0,0 +1,511 @@
+"""Answer Elasticsearch searches from documents held in memory.
+
+InMemoryElasticsearch evaluates the request bodies the reports send (the
+Search.to_dict() of each report) against a list of documents, and builds
+the response Elasticsearch would send.  It only knows the parts of the
+query DSL and the aggregations the reports use:
+
+    queries       bool, match_all, term, terms, match, range (with "now"
+                  date math), prefix, wildcard, exists
+    buckets       terms (field or the "a ?: b" painless script of the per
+                  site report), missing, filters, date_histogram,
+                  date_range, composite
+    metrics       sum, min, max, avg, value_count, cardinality
+
+Anything else raises NotImplementedError.  Date fields are kept in the
+documents as epoch milliseconds.  It is meant as the "real" cluster of an
+esfixtures recording (see synthetic.py), not as a fast search engine.
+"""
+
+import calendar
+import datetime
+import fnmatch
+import re
+
+from dateutil import parser as dateparser, tz
+from dateutil.relativedelta import relativedelta
+
+DATE_FIELDS = ('EndTime', 'StartTime', '@received')
+DEFAULT_ORDER = [{'_count': 'desc'}, {'_key': 'asc'}]
+
+_datemath_re = re.compile(r'^now(?:([+-])(\d+)([smhdwMy]))?(?:/([smhdwMy]))?$')
+_interval_re = re.compile(r'^(\d*)([smhdwMqy]|ms)$')
+_script_re = re.compile(r"doc\['([^']+)'\]\.value")
+_named_intervals = {'second': '1s', 'minute': '1m', 'hour': '1h', 'day': '1d',
+                    'week': '1w', 'month': '1M', 'quarter': '1q',
+                    'year': '1y'}
+_fixed_ms = {'ms': 1, 's': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000,
+             'w': 7 * 86400000}
+_calendar = {'M': relativedelta(months=1), 'q': relativedelta(months=3),
+             'y': relativedelta(years=1)}
+
+
+def to_millis(value):
+    """Epoch milliseconds of a datetime (naive means UTC)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz.tzutc())
+    return int(calendar.timegm(value.utctimetuple()) * 1000 +
+               value.microsecond // 1000)
+
+
+def from_millis(ms):
+    """UTC datetime of epoch milliseconds"""
+    return datetime.datetime(1970, 1, 1, tzinfo=tz.tzutc()) + \
+        datetime.timedelta(milliseconds=ms)
+
+
+def format_millis(ms):
+    """Epoch milliseconds in Elasticsearch's default date format"""
+    return from_millis(ms).strftime('%Y-%m-%dT%H:%M:%S.') + \
+        '{0:03d}Z'.format(int(ms) % 1000)
+
+
+def _shift(when, sign, n, unit):
+    if unit in _fixed_ms:
+        delta = datetime.timedelta(milliseconds=n * _fixed_ms[unit])
+    else:
+        delta = n * _calendar[unit]
+    return when + delta if sign == '+' else when - delta
+
+
+def _round_down(when, unit):
+    when = when.replace(microsecond=0)
+    for name, u in (('second', 's'), ('minute', 'm'), ('hour', 'h')):
+        if unit == u:
+            return when
+        when = when.replace(**{name: 0})
+    if unit in ('d', 'w'):
+        return when - datetime.timedelta(days=when.weekday()) \
+            if unit == 'w' else when
+    return when.replace(day=1, month=1 if unit == 'y' else when.month)
+
+
+def parse_time(value, now):
+    """Epoch milliseconds of a range bound: a number, a datetime, an ISO
+    date string or "now" date math
+
+    :param datetime.datetime now: What "now" means
+    """
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return to_millis(value)
+    m = _datemath_re.match(value)
+    if m:
+        sign, n, unit, rounding = m.groups()
+        when = now if now.tzinfo else now.replace(tzinfo=tz.tzutc())
+        if sign:
+            when = _shift(when, sign, int(n), unit)
+        if rounding:
+            when = _round_down(when.astimezone(tz.tzutc()), rounding)
+        return to_millis(when)
+    return to_millis(dateparser.isoparse(value))
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _single(spec):
+    """The one (key, value) pair of a query or field clause"""
+    (key, value), = spec.items()
+    return key, value
+
+
+def _getter(params):
+    """Function that gets a terms/composite source value from a document"""
+    if 'field' in params:
+        field = params['field']
+        return lambda doc: doc.get(field)
+    script = params.get('script')
+    source = script.get('source', script.get('inline')) \
+        if isinstance(script, dict) else script
+    if source is None:
+        raise NotImplementedError("Source without field or script: "
+                                  "{0}".format(params))
+    fields = [f.strip() for f in source.split('?:')]
+    names = [_script_re.fullmatch(f) for f in fields]
+    if not all(names):
+        raise NotImplementedError("Unsupported script: {0}".format(source))
+    names = [n.group(1) for n in names]
+
+    def get(doc):
+        for name in names:
+            value = doc.get(name)
+            if value is not None:
+                return value
+        return None
+    return get
+
+
+class _Histogram(object):
+    """Key function of a date_histogram: rounds epoch milliseconds down to
+    the start of their interval"""
+    def __init__(self, params):
+        interval = params.get('fixed_interval') or \
+            params.get('calendar_interval') or params.get('interval')
+        interval = _named_intervals.get(interval, interval)
+        m = _interval_re.match(interval)
+        if not m:
+            raise NotImplementedError("Unsupported interval: {0}".format(
+                interval))
+        self.n, self.unit = int(m.group(1) or 1), m.group(2)
+        offset = params.get('offset', '+0s')
+        om = re.match(r'^([+-]?)(\d+)(ms|[smhd])$', offset)
+        if not om:
+            raise NotImplementedError("Unsupported offset: {0}".format(offset))
+        self.offset = int(om.group(2)) * _fixed_ms[om.group(3)] * \
+            (-1 if om.group(1) == '-' else 1)
+        self.calendar = self.unit in _calendar or \
+            (self.unit == 'w' and 'fixed_interval' not in params)
+
+    def key(self, ms):
+        if ms is None:
+            return None
+        if not self.calendar:
+            width = self.n * _fixed_ms[self.unit]
+            return (ms - self.offset) // width * width + self.offset
+        unit = {'w': 'w', 'M': 'M', 'q': 'M', 'y': 'y'}[self.unit]
+        start = _round_down(from_millis(ms - self.offset), unit)
+        if self.unit == 'q':
+            start = start.replace(month=(start.month - 1) // 3 * 3 + 1)
+        return to_millis(start) + self.offset
+
+    def next(self, key):
+        if not self.calendar:
+            return key + self.n * _fixed_ms[self.unit]
+        step = datetime.timedelta(weeks=1) if self.unit == 'w' \
+            else self.n * _calendar[self.unit]
+        return to_millis(from_millis(key - self.offset) + step) + self.offset
+
+
+class InMemoryElasticsearch(object):
+    """Stand-in for elasticsearch.Elasticsearch over in-memory documents
+
+    :param dict indices: Index pattern (fnmatch style, e.g. 'gracc.osg.raw*')
+        -> list of documents
+    :param datetime.datetime now: What "now" means in date math
+    """
+    transport = None
+
+    def __init__(self, indices, now=None):
+        self.indices = indices
+        self.now = now if now is not None else datetime.datetime.utcnow()
+        self.searches = 0
+
+    # Client methods
+
+    def perform_request(self, method, path, *args, **kwargs):
+        """Only the cluster health check goes through here"""
+        return 'green\n'
+
+    def search(self, index=None, body=None, **params):
+        from .esfixtures import FixtureResponse
+        self.searches += 1
+        return FixtureResponse(self.evaluate(index, body or {}))
+
+    def msearch(self, body, **params):
+        return {'responses': [self.search(index=header.get('index'),
+                                          body=search).body
+                              for header, search in zip(body[0::2],
+                                                        body[1::2])]}
+
+    def close(self):
+        return
+
+    # Evaluation
+
+    def documents(self, index):
+        """Documents of every index that matches index"""
+        names = index.split(',') if isinstance(index, str) \
+            else _as_list(index) or ['*']
+        docs = []
+        for pattern, indexdocs in self.indices.items():
+            if any(fnmatch.fnmatchcase(pattern, name) or
+                   fnmatch.fnmatchcase(name, pattern) for name in names):
+                docs.extend(indexdocs)
+        return docs
+
+    def evaluate(self, index, body):
+        """:return dict: Response body to a search"""
+        match = self.compile(body.get('query', {'match_all': {}}))
+        docs = [doc for doc in self.documents(index) if match(doc)]
+        size = body.get('size', 10)
+        hits = [{'_index': index, '_id': str(i), '_score': None,
+                 '_source': self.source(doc)}
+                for i, doc in enumerate(docs[:size])]
+        response = {'took': 1, 'timed_out': False,
+                    '_shards': {'total': 1, 'successful': 1, 'skipped': 0,
+                                'failed': 0},
+                    'hits': {'total': {'value': len(docs), 'relation': 'eq'},
+                             'max_score': None, 'hits': hits}}
+        aggs = body.get('aggs', body.get('aggregations'))
+        if aggs:
+            response['aggregations'] = self.aggregate(aggs, docs)
+        return response
+
+    @staticmethod
+    def source(doc):
+        """Document as Elasticsearch would return it, dates as strings"""
+        return {k: format_millis(v) if k in DATE_FIELDS and v is not None
+                else v for k, v in doc.items()}
+
+    def compile(self, query):
+        """Turn a query clause into a predicate on documents"""
+        kind, spec = _single(query)
+        if kind == 'match_all':
+            return lambda doc: True
+        if kind == 'bool':
+            must = [self.compile(q) for q in _as_list(spec.get('filter')) +
+                    _as_list(spec.get('must'))]
+            must_not = [self.compile(q) for q in _as_list(spec.get('must_not'))]
+            should = [self.compile(q) for q in _as_list(spec.get('should'))]
+            minimum = spec.get('minimum_should_match',
+                               0 if must or must_not else 1 if should else 0)
+            return lambda doc: (all(f(doc) for f in must) and
+                                not any(f(doc) for f in must_not) and
+                                sum(1 for f in should if f(doc)) >= minimum)
+        if kind == 'exists':
+            field = spec['field']
+            return lambda doc: doc.get(field) is not None
+
+        field, value = _single(spec)
+        if kind in ('term', 'match', 'prefix', 'wildcard') and \
+                isinstance(value, dict):
+            value = value.get('value', value.get('query'))
+        if kind in ('term', 'match'):
+            return lambda doc: doc.get(field) == value
+        if kind == 'terms':
+            values = set(value)
+            return lambda doc: doc.get(field) in values
+        if kind == 'prefix':
+            return lambda doc: isinstance(doc.get(field), str) and \
+                doc[field].startswith(value)
+        if kind == 'wildcard':
+            return lambda doc: isinstance(doc.get(field), str) and \
+                fnmatch.fnmatchcase(doc[field], value)
+        if kind == 'range':
+            return self._range(field, value)
+        raise NotImplementedError("Unsupported query: {0}".format(kind))
+
+    def _range(self, field, bounds):
+        convert = (lambda v: parse_time(v, self.now)) \
+            if field in DATE_FIELDS else (lambda v: v)
+        checks = []
+        for op, value in bounds.items():
+            if op == 'from' and value is not None:
+                op = 'gte' if bounds.get('include_lower', True) else 'gt'
+            elif op == 'to' and value is not None:
+                op = 'lte' if bounds.get('include_upper', True) else 'lt'
+            if op not in ('gte', 'gt', 'lte', 'lt'):
+                continue
+            checks.append((op, convert(value)))
+
+        def check(doc):
+            v = doc.get(field)
+            if v is None:
+                return False
+            for op, bound in checks:
+                if op == 'gte' and not v >= bound or \
+                        op == 'gt' and not v > bound or \
+                        op == 'lte' and not v <= bound or \
+                        op == 'lt' and not v < bound:
+                    return False
+            return True
+        return check
+
+    def aggregate(self, aggs, docs):
+        """:return dict: Results of the aggregations aggs over docs"""
+        result = {}
+        for name, spec in aggs.items():
+            sub = spec.get('aggs', spec.get('aggregations', {}))
+            kind, params = [(k, v) for k, v in spec.items()
+                            if k not in ('aggs', 'aggregations', 'meta')][0]
+            try:
+                method = getattr(self, '_agg_' + kind)
+            except AttributeError:
+                raise NotImplementedError("Unsupported aggregation: "
+                                          "{0}".format(kind))
+            result[name] = method(params, docs, sub)
+        return result
+
+    def _bucket(self, docs, sub, **fields):
+        bucket = dict(fields, doc_count=len(docs))
+        bucket.update(self.aggregate(sub, docs))
+        return bucket
+
+    # Bucket aggregations
+
+    def _agg_terms(self, params, docs, sub):
+        get = _getter(params)
+        missing = params.get('missing')
+        groups = {}
+        for doc in docs:
+            value = get(doc)
+            if value is None:
+                value = missing
+            if value is not None:
+                groups.setdefault(value, []).append(doc)
+        buckets = [self._bucket(group, sub, key=key)
+                   for key, group in groups.items()]
+
+        order = params.get('order', DEFAULT_ORDER)
+        order = [order] if isinstance(order, dict) else list(order)
+        for clause in reversed(order + [{'_key': 'asc'}]):
+            (what, direction), = clause.items()
+            if what in ('_key', '_term'):
+                sortkey = lambda b: b['key']
+            elif what == '_count':
+                sortkey = lambda b: b['doc_count']
+            else:
+                sortkey = lambda b, what=what: b[what]['value'] or 0
+            buckets.sort(key=sortkey, reverse=(direction == 'desc'))
+
+        size = params.get('size', 10)
+        return {'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(b['doc_count']
+                                           for b in buckets[size:]),
+                'buckets': buckets[:size]}
+
+    def _agg_missing(self, params, docs, sub):
+        field = params['field']
+        return self._bucket([doc for doc in docs if doc.get(field) is None],
+                            sub)
+
+    def _agg_filters(self, params, docs, sub):
+        filters = params['filters']
+        if isinstance(filters, dict):
+            return {'buckets': {
+                name: self._bucket(list(filter(self.compile(q), docs)), sub)
+                for name, q in filters.items()}}
+        return {'buckets': [self._bucket(list(filter(self.compile(q), docs)),
+                                         sub) for q in filters]}
+
+    def _agg_date_histogram(self, params, docs, sub):
+        histogram = _Histogram(params)
+        field = params['field']
+        groups = {}
+        for doc in docs:
+            key = histogram.key(doc.get(field))
+            if key is not None:
+                groups.setdefault(key, []).append(doc)
+        buckets = []
+        if groups:
+            # Like Elasticsearch (min_doc_count 0), empty intervals between
+            # the first and last bucket are filled in
+            key, last = min(groups), max(groups)
+            while key <= last:
+                buckets.append(self._bucket(groups.get(key, []), sub,
+                                            key_as_string=format_millis(key),
+                                            key=key))
+                key = histogram.next(key)
+        return {'buckets': buckets}
+
+    def _agg_date_range(self, params, docs, sub):
+        field = params['field']
+        buckets = []
+        for r in params['ranges']:
+            start = parse_time(r['from'], self.now) \
+                if r.get('from') is not None else None
+            end = parse_time(r['to'], self.now) \
+                if r.get('to') is not None else None
+            inrange = [doc for doc in docs if doc.get(field) is not None and
+                       (start is None or doc[field] >= start) and
+                       (end is None or doc[field] < end)]
+            fields = {'key': r.get('key', '{0}-{1}'.format(
+                format_millis(start) if start is not None else '*',
+                format_millis(end) if end is not None else '*'))}
+            if start is not None:
+                fields.update({'from': start,
+                               'from_as_string': format_millis(start)})
+            if end is not None:
+                fields.update({'to': end, 'to_as_string': format_millis(end)})
+            buckets.append(self._bucket(inrange, sub, **fields))
+        if params.get('keyed'):
+            return {'buckets': {b.pop('key'): b for b in buckets}}
+        return {'buckets': buckets}
+
+    def _agg_composite(self, params, docs, sub):
+        names, getters, nullable = [], [], []
+        for source in params['sources']:
+            name, spec = _single(source)
+            kind, sparams = _single(spec)
+            if kind == 'terms':
+                get = _getter(sparams)
+            elif kind == 'date_histogram':
+                field = sparams['field']
+                get = (lambda h, f: lambda doc: h.key(doc.get(f)))(
+                    _Histogram(sparams), field)
+            else:
+                raise NotImplementedError("Unsupported composite source: "
+                                          "{0}".format(kind))
+            names.append(name)
+            getters.append(get)
+            nullable.append(sparams.get('missing_bucket', False))
+
+        groups = {}
+        for doc in docs:
+            key = tuple(get(doc) for get in getters)
+            if all(v is not None or ok for v, ok in zip(key, nullable)):
+                groups.setdefault(key, []).append(doc)
+
+        # Ascending, with null keys first
+        def order(key):
+            return tuple((v is not None, v) for v in key)
+        keys = sorted(groups, key=order)
+        after = params.get('after')
+        if after:
+            after = order(tuple(after.get(name) for name in names))
+            keys = [key for key in keys if order(key) > after]
+        keys = keys[:params.get('size', 10)]
+
+        buckets = [self._bucket(groups[key], sub, key=dict(zip(names, key)))
+                   for key in keys]
+        result = {'buckets': buckets}
+        if buckets:
+            result['after_key'] = dict(buckets[-1]['key'])
+        return result
+
+    # Metric aggregations
+
+    @staticmethod
+    def _values(params, docs):
+        field = params['field']
+        missing = params.get('missing')
+        for doc in docs:
+            value = doc.get(field, missing)
+            if value is None:
+                value = missing
+            if value is not None:
+                yield value
+
+    def _agg_sum(self, params, docs, sub):
+        return {'value': float(sum(self._values(params, docs)))}
+
+    def _agg_avg(self, params, docs, sub):
+        values = list(self._values(params, docs))
+        return {'value': sum(values) / len(values) if values else None}
+
+    def _agg_value_count(self, params, docs, sub):
+        return {'value': sum(1 for _ in self._values(params, docs))}
+
+    def _agg_cardinality(self, params, docs, sub):
+        return {'value': len(set(self._values(params, docs)))}
+
+    def _extreme(self, func, params, docs):
+        values = list(self._values(params, docs))
+        if not values:
+            return {'value': None}
+        value = func(values)
+        result = {'value': float(value)}
+        if params['field'] in DATE_FIELDS:
+            result['value_as_string'] = format_millis(value)
+        return result
+
+    def _agg_max(self, params, docs, sub):
+        return self._extreme(max, params, docs)
+
+    def _agg_min(self, params, docs, sub):
+        return self._extreme(min, params, docs)
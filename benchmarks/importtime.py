@@ -0,0 +1,132 @@
+"""Cold-start import benchmark for the gracc-osg-reports console scripts.
+
+For each console script, start a fresh interpreter with -X importtime, import
+the module behind it, and record the wall-clock startup time and the
+cumulative import time of the module and of its heaviest dependencies.
+
+    python -m benchmarks.importtime                  # Table on stdout
+    python -m benchmarks.importtime -r 5 -o importtime.json
+    python -m benchmarks.importtime --compare importtime.json
+"""
+
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from gracc_osg_reports import ReportRegistry
+
+SCRIPTS = dict(((name, spec.module) for name, spec in
+                ReportRegistry.REPORTS.items()),
+               osgreportdaemon='ReportDaemon')
+
+# Dependencies whose share of the import time we report separately
+HEAVY = ['gracc_reporting.ReportUtils', 'elasticsearch_dsl', 'elasticsearch',
+         'pandas', 'numpy', 'requests', 'yaml', 'dateutil', 'psycopg2']
+
+_line_re = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$')
+
+
+def parse_importtime(stderr):
+    """Parse -X importtime output
+
+    :param str stderr: stderr of the interpreter
+    :return dict: Cumulative import time in microseconds, keyed by module,
+        keeping the first (i.e. actual) import of each module
+    """
+    cumulative = {}
+    for line in stderr.splitlines():
+        m = _line_re.match(line)
+        if m:
+            cumulative.setdefault(m.group(4), int(m.group(2)))
+    return cumulative
+
+
+def measure(module):
+    """Import gracc_osg_reports.<module> in a fresh interpreter
+
+    :return dict: wall-clock seconds, and cumulative import seconds of the
+        module and of each heavy dependency it pulled in
+    """
+    fullname = 'gracc_osg_reports.' + module
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           'import ' + fullname],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError("Importing {0} failed:\n{1}".format(
+            fullname, proc.stderr.splitlines()[-1]))
+    cumulative = parse_importtime(proc.stderr)
+    result = {'wall': wall, 'module': cumulative.get(fullname, 0) / 1e6}
+    result['deps'] = {dep: cumulative[dep] / 1e6 for dep in HEAVY
+                      if dep in cumulative}
+    return result
+
+
+def run(scripts, repeat):
+    """Measure each script repeat times and keep the median of each number
+
+    :return dict: Results keyed by script name
+    """
+    results = {}
+    for name in scripts:
+        runs = [measure(SCRIPTS[name]) for _ in range(repeat)]
+        deps = set().union(*(r['deps'] for r in runs))
+        results[name] = {
+            'wall': statistics.median(r['wall'] for r in runs),
+            'module': statistics.median(r['module'] for r in runs),
+            'deps': {dep: statistics.median(r['deps'].get(dep, 0.)
+                                            for r in runs)
+                     for dep in sorted(deps)}}
+    return results
+
+
+def print_table(results, baseline=None):
+    """Print results, with the change against baseline if given"""
+    fmt = "{0:<22} {1:>9} {2:>9} {3:>8}  {4}"
+    print(fmt.format('script', 'wall (s)', 'import', 'vs base',
+                     'heaviest dependencies (cumulative s)'))
+    for name, r in sorted(results.items()):
+        change = ''
+        if baseline and name in baseline:
+            change = '{0:+.0%}'.format(r['wall'] / baseline[name]['wall'] - 1)
+        deps = sorted(r['deps'].items(), key=lambda kv: -kv[1])[:4]
+        print(fmt.format(name, '{0:.3f}'.format(r['wall']),
+                         '{0:.3f}'.format(r['module']), change,
+                         ', '.join('{0} {1:.3f}'.format(*d) for d in deps)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scripts', nargs='*', default=sorted(SCRIPTS),
+                        help='Console scripts to measure (default: all)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Interpreter starts per script; the median is kept')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from a previous run to '
+                                          'compare against')
+    args = parser.parse_args()
+
+    for name in args.scripts:
+        if name not in SCRIPTS:
+            parser.error("Unknown script {0}".format(name))
+
+    results = run(args.scripts, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Peak memory of each report, by phase, with per-report budgets.
+
+Each report runs end to end against fixtures (see esfixtures), in a fresh
+process so that its resident set size isn't inflated by the reports run
+before it.  Memory is followed two ways:
+
+    traced   Peak of the Python allocations seen by tracemalloc
+    rss      Resident set size, sampled every few milliseconds
+
+and each peak is charged to the phase that was running at the time:
+
+    setup    Report construction
+    decode   Decoding the Elasticsearch responses
+    flatten  Turning responses into rows (generate, generate_report_file...)
+    frame    format_report(): report columns, DataFrames and pivots
+    render   Text/CSV/HTML tables and the email message
+    other    Everything else in run_report()
+
+By default the fixtures are synthetic (see synthetic.py) at --scale; -f uses
+an existing fixture directory instead.
+
+    python -m benchmarks.memory -o memory.json
+    python -m benchmarks.memory --budgets benchmarks/memory_budgets.json
+
+With --budgets, the exit status is 1 if the traced or RSS peak of any report
+is over its budget.  A budget file also sets the default --scale, since the
+budgets only hold for the fixtures they were measured on:
+
+    {"scale": 10, "budgets": {"persite": {"traced_mb": 50, "rss_mb": 250}}}
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import tracemalloc
+
+from gracc_reporting import TextUtils
+
+from gracc_osg_reports import StreamingTable
+from gracc_osg_reports.ReportDaemon import (_current_handlers,
+                                            _release_new_handlers)
+from gracc_osg_reports.Timing import PhaseTimer
+
+from . import esfixtures, reports, synthetic
+
+PHASES = ['setup', 'decode', 'flatten', 'frame', 'render', 'other']
+PARSERS = ['generate', 'generate_report_file', 'generate_report',
+           'generate_comparison']
+DEFAULT_SCALE = 10
+SAMPLE_INTERVAL = 0.005     # seconds
+MB = 2.**20
+
+
+def current_rss():
+    """:return int: Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # Peak rather than current, but still an upper bound
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class MemoryTracker(PhaseTimer):
+    """PhaseTimer that also charges the traced and RSS peaks to the
+    innermost phase running when they were reached.  Start tracemalloc
+    before using it."""
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super(MemoryTracker, self).__init__()
+        self.interval = interval
+        self.traced = {}
+        self.rss = {}
+        self._names = []
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def _current(self):
+        return self._names[-1] if self._names else 'other'
+
+    def _charge(self):
+        """Charge the traced peak since the last phase change to the
+        current phase"""
+        name = self._current()
+        peak = tracemalloc.get_traced_memory()[1]
+        self.traced[name] = max(self.traced.get(name, 0), peak)
+        tracemalloc.reset_peak()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            name = self._current()
+            self.rss[name] = max(self.rss.get(name, 0), current_rss())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._charge()
+        self._names.append(name)
+        try:
+            with super(MemoryTracker, self).phase(name):
+                yield
+        finally:
+            self._charge()
+            self._names.pop()
+
+    def start(self):
+        tracemalloc.reset_peak()
+        self._sampler.start()
+
+    def stop(self):
+        self._charge()
+        self._stop.set()
+        self._sampler.join()
+
+
+def measure_case(name, config_file, fixtures, now):
+    """Run one report and follow its memory.  Meant to run in a fresh
+    process.
+
+    :return dict: Peak traced and RSS MB per phase, and overall
+    """
+    esfixtures.install(esfixtures.FixtureStore(fixtures))
+    tracemalloc.start()
+    tracker = MemoryTracker()
+    handlers = _current_handlers()
+    with reports.frozen_clock(now), reports.benchmark_config(), \
+            tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        tracker.wrap(esfixtures.FixtureClient, 'search', 'decode')
+        tracker.wrap(esfixtures.FixtureClient, 'msearch', 'decode')
+        tracker.wrap(TextUtils.TextUtils, 'printAsTextTable', 'render')
+        tracker.wrap(TextUtils, 'sendEmail', 'render')
+        tracker.wrap(StreamingTable, 'render_html', 'render')
+        tracker.start()
+        try:
+            with tracker.phase('setup'):
+                spec, report = reports.create_case(name, config_file, workdir)
+            cls = type(report)
+            for method in PARSERS:
+                if hasattr(cls, method):
+                    tracker.wrap(cls, method, 'flatten')
+            tracker.wrap(cls, 'format_report', 'frame')
+            spec.run(report)
+        finally:
+            tracker.stop()
+            tracker.unwrap_all()
+            tracemalloc.stop()
+            _release_new_handlers(handlers)
+    return {'traced_mb': {phase: v / MB for phase, v in tracker.traced.items()},
+            'rss_mb': {phase: v / MB for phase, v in tracker.rss.items()},
+            'peak_traced_mb': max(tracker.traced.values()) / MB,
+            'peak_rss_mb': max(tracker.rss.values() or [current_rss()]) / MB}
+
+
+def run(cases, config_file, fixtures, now):
+    """Measure each case in its own process
+
+    :return dict: Results keyed by case name
+    """
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in cases:
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(measure_case,
+                                       (name, config_file, fixtures, now))
+    return results
+
+
+def over_budget(results, budgets):
+    """:return list: (case, measure, peak MB, budget MB) of every peak that
+    is over its budget"""
+    found = []
+    for name, budget in sorted(budgets.items()):
+        if name not in results:
+            continue
+        for measure in ('traced_mb', 'rss_mb'):
+            peak = results[name]['peak_' + measure]
+            if measure in budget and peak > budget[measure]:
+                found.append((name, measure, peak, budget[measure]))
+    return found
+
+
+def print_table(results, budgets=None):
+    """Print the traced peak of each phase and the overall peaks, with the
+    budgets if given"""
+    fmt = "{:<16}" + " {:>8}" * len(PHASES) + " {:>9} {:>9} {:>11}"
+    print(fmt.format('report (MB)', *(PHASES + ['traced', 'rss',
+                                                'budget'])))
+    for name, r in sorted(results.items()):
+        budget = (budgets or {}).get(name, {})
+        print(fmt.format(name, *(
+            ['{0:.1f}'.format(r['traced_mb'][phase])
+             if phase in r['traced_mb'] else '' for phase in PHASES] +
+            ['{0:.1f}'.format(r['peak_traced_mb']),
+             '{0:.1f}'.format(r['peak_rss_mb']),
+             '{0}/{1}'.format(budget.get('traced_mb', '-'),
+                              budget.get('rss_mb', '-')) if budget else ''])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', default=sorted(reports.CASES),
+                        help='Reports to run (default: all)')
+    parser.add_argument('-f', '--fixtures',
+                        help='Fixture directory (default: synthetic fixtures '
+                             'at --scale)')
+    parser.add_argument('-s', '--scale', type=float,
+                        help='Scale of the synthetic fixtures (default: the '
+                             'budget file\'s, or {0})'.format(DEFAULT_SCALE))
+    parser.add_argument('-c', '--config', default='osg.toml',
+                        help='Report config file')
+    parser.add_argument('--now', default=reports.NOW,
+                        help='Frozen current time (default {0})'.format(
+                            reports.NOW))
+    parser.add_argument('--budgets', help='JSON file of per-report budgets')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    for name in args.cases:
+        if name not in reports.CASES:
+            parser.error("Unknown report {0}".format(name))
+
+    budgets, scale = None, args.scale
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgetfile = json.load(f)
+        budgets = budgetfile['budgets']
+        if scale is None:
+            scale = budgetfile.get('scale')
+    if scale is None:
+        scale = DEFAULT_SCALE
+
+    config_file = os.path.abspath(args.config)
+    now = datetime.datetime.strptime(args.now, '%Y-%m-%dT%H:%M')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fixtures = args.fixtures
+        if fixtures is None:
+            fixtures = os.path.join(tmpdir, 'fixtures')
+            synthetic.default_fixtures(fixtures, config_file, now, scale,
+                                       args.cases)
+        results = run(args.cases, config_file, os.path.abspath(fixtures), now)
+
+    print_table(results, budgets)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if budgets is not None:
+        over = over_budget(results, budgets)
+        for name, measure, peak, budget in over:
+            print("{0}: {1} peak {2:.1f} MB is over its budget of {3} "
+                  "MB".format(name, measure[:-3], peak, budget))
+        if over:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Report table rendering benchmark.
+
+Render synthetic flocking-style tables of increasing size two ways: the way
+ReportUtils.Reporter.send_report does (dict of columns -> DataFrame ->
+tabulate text, CSV and HTML), and row by row with StreamingTable (HTML with
+a row cap, plus the full table as a gzipped CSV).  Record the time and the
+peak traced memory of each.
+
+    python -m benchmarks.render                      # Table on stdout
+    python -m benchmarks.render -n 1000 10000 -o render.json
+    python -m benchmarks.render --compare render.json
+"""
+
+import argparse
+import io
+import json
+import random
+import time
+import tracemalloc
+
+from gracc_reporting import TextUtils
+
+from gracc_osg_reports import StreamingTable
+
+HEADER = ["SiteName", "VOName", "ProbeName", "ProjectName", "Wall Hours"]
+ROW_CAP = 1000
+
+
+def make_rows(n, seed=0):
+    """Generate n synthetic report rows
+
+    :return generator: Row lists
+    """
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield ['Site_{0}'.format(i // 1000), 'vo{0}'.format(i % 37),
+               'condor:submit{0}.example.edu'.format(i % 13),
+               'Project_{0}'.format(i), rnd.random() * 1e6]
+
+
+def render_materialized(n):
+    """Render like ReportUtils.Reporter.send_report"""
+    report = {col: [] for col in HEADER}
+    for row in make_rows(n):
+        for col, value in zip(HEADER, row):
+            report[col].append(value)
+    emailReport = TextUtils.TextUtils(HEADER)
+    text = emailReport.printAsTextTable("text", report)
+    csvtext = emailReport.printAsTextTable("csv", report)
+    htmltext = emailReport.printAsTextTable("html", report)
+    return len(text) + len(csvtext) + len(htmltext)
+
+
+def render_streaming(n):
+    """Render with StreamingTable"""
+    body = io.StringIO()
+    attachment = StreamingTable.CSVGzipWriter(HEADER)
+    StreamingTable.render_html(make_rows(n), HEADER, body, title='bench',
+                               row_cap=ROW_CAP, overflow=attachment)
+    return len(body.getvalue()) + len(attachment.close())
+
+
+METHODS = {'materialized': render_materialized,
+           'streaming': render_streaming}
+
+
+def measure(func, n):
+    """:return dict: seconds, peak traced MB and output size of func(n)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = func(n)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_mb': peak / 2.**20,
+            'output_mb': size / 2.**20}
+
+
+def run(sizes):
+    """:return dict: Results keyed by method, then by number of rows"""
+    return {name: {str(n): measure(func, n) for n in sizes}
+            for name, func in METHODS.items()}
+
+
+def print_table(results, baseline=None):
+    """Print results, with the time change against baseline if given"""
+    fmt = "{0:<14} {1:>8} {2:>10} {3:>10} {4:>10} {5:>8}"
+    print(fmt.format('method', 'rows', 'time (s)', 'peak (MB)', 'out (MB)',
+                     'vs base'))
+    for name, byrows in sorted(results.items()):
+        for n, r in sorted(byrows.items(), key=lambda kv: int(kv[0])):
+            change = ''
+            try:
+                change = '{0:+.0%}'.format(
+                    r['seconds'] / baseline[name][n]['seconds'] - 1)
+            except (KeyError, TypeError, ZeroDivisionError):
+                pass
+            print(fmt.format(name, n, '{0:.3f}'.format(r['seconds']),
+                             '{0:.1f}'.format(r['peak_mb']),
+                             '{0:.1f}'.format(r['output_mb']), change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--rows', type=int, nargs='+',
+                        default=[1000, 10000, 50000],
+                        help='Table sizes to render')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from a previous run to '
+                                          'compare against')
+    args = parser.parse_args()
+
+    results = run(args.rows)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""End-to-end benchmark of every report against recorded Elasticsearch responses.
+
+Each of the nine reports (and the per site report without its site script,
+persite-terms) is run the way its console script runs it, with its
+searches answered by esfixtures.FixtureClient and its email dropped
+(NullSMTP), and the time of each phase is recorded:
+
+    setup    Report construction: config, client, lookups done at start
+    query    Elasticsearch requests (replayed: decoding the recorded JSON)
+    parse    Building searches and turning responses into rows
+    format   format_report(): rows into report columns
+    render   Text/CSV/HTML tables and the email message
+
+The reports' notion of "now" is frozen (--now), so that the reports that
+query a range ending now (probe, monthly sites, payload) send the same
+searches on every run.  Record the fixtures once, from a cluster that holds
+the data for that date:
+
+    python -m benchmarks.reports --record -f fixtures/ -c osg.toml
+    python -m benchmarks.reports -f fixtures/ -c osg.toml -o reports.json
+    python -m benchmarks.reports -f fixtures/ -c osg.toml --compare reports.json
+
+Snapshots and daily partials are turned off, and the asyncio query path is
+not covered.
+"""
+
+import argparse
+import contextlib
+import datetime
+import importlib
+import json
+import os
+import statistics
+import tempfile
+import time
+import types
+
+from gracc_reporting import ReportUtils, TextUtils
+
+from gracc_osg_reports import ReportRegistry, StreamingTable
+from gracc_osg_reports.ReportDaemon import (_current_handlers,
+                                            _release_new_handlers)
+from gracc_osg_reports.Timing import PhaseTimer
+
+from . import esfixtures
+
+PHASES = ['setup', 'query', 'parse', 'format', 'render']
+NOW = '2023-04-03T06:00'
+
+# name: (console script, start, end, report options)
+CASES = {
+    'flocking': ('osgflockingreport', '2023-03-27', '2023-04-03', {}),
+    'project': ('osgprojectreport', '2023-03-01', '2023-04-01',
+                {'report_type': 'OSG'}),
+    'persite': ('osgpersitereport', '2023-03-01', None, {}),
+    'persite-terms': ('osgpersitereport', '2023-03-01', None,
+                      {'site_script': False}),
+    'probe': ('osgprobereport', None, None, {}),
+    'topopp': ('osgtopoppusagereport', '2023-03-01', '2023-04-01',
+               {'numrank': 20}),
+    'missingprojects': ('osgmissingprojects', '2023-03-27', '2023-04-03',
+                        {'report_type': 'OSG'}),
+    'missingvo': ('osgmissingvo', '2023-03-27', '2023-04-03', {}),
+    'monthlysites': ('monthlysites', '2023-03-01', '2023-04-01', {}),
+    'payloadbatch': ('payloadbatchreport', '2023-03-20', '2023-04-03', {}),
+}
+
+# Modules that call datetime.datetime.now() to set their query range
+CLOCK_MODULES = ['ReportRegistry', 'ProbeReport', 'MonthlySitesViewReporter',
+                 'PayloadAndPilotHours']
+
+
+@contextlib.contextmanager
+def frozen_clock(now):
+    """Make datetime.datetime.now() return now in the CLOCK_MODULES"""
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now if tz is None else now.astimezone(tz)
+
+    frozen = types.ModuleType('datetime')
+    frozen.__dict__.update(datetime.__dict__)
+    frozen.datetime = FrozenDatetime
+
+    modules = [importlib.import_module('gracc_osg_reports.' + name)
+               for name in CLOCK_MODULES]
+    saved = [(m, m.datetime) for m in modules]
+    for m in modules:
+        m.datetime = frozen
+    try:
+        yield
+    finally:
+        for m, original in saved:
+            m.datetime = original
+
+
+@contextlib.contextmanager
+def benchmark_config():
+    """Leave out the config sections that would make a run depend on the
+    runs before it (snapshots, daily partials)"""
+    original = ReportUtils.Reporter.__dict__['_parse_config']
+
+    def parse_config(configfile):
+        config = original.__func__(configfile)
+        for section in ('snapshots', 'partials'):
+            config.pop(section, None)
+        return config
+
+    ReportUtils.Reporter._parse_config = staticmethod(parse_config)
+    try:
+        yield
+    finally:
+        ReportUtils.Reporter._parse_config = original
+
+
+def create_case(name, config_file, workdir, options=None):
+    """Build the report of a case the way its console script does
+
+    :param dict options: Report options to add to those of the case
+    :return tuple: (ReportRegistry.ReportSpec, report object)
+    """
+    script, start, end, case_options = CASES[name]
+    spec = ReportRegistry.get_spec(script)
+    options = dict(case_options, **(options or {}))
+    if script == 'osgprobereport':
+        options['statefile'] = os.path.join(workdir, 'probereport.state')
+    return spec, spec.create(config_file, start, end, options=options,
+                             is_test=True, no_email=False,
+                             logfile=os.path.join(workdir, spec.logfile))
+
+
+def run_case(name, config_file, workdir, timer):
+    """Run one report once, timing its phases with timer"""
+    handlers = _current_handlers()
+    try:
+        with timer.phase('setup'):
+            spec, report = create_case(name, config_file, workdir)
+        cls = type(report)
+        timer.wrap(cls, 'format_report', 'format')
+        timer.wrap(cls, 'generate_report_file', 'parse')
+        with timer.phase('parse'):
+            spec.run(report)
+    finally:
+        _release_new_handlers(handlers)
+
+
+def measure(name, config_file, repeat):
+    """Run a report repeat times and keep the median time of each phase
+
+    :return dict: Seconds per phase, and in total
+    """
+    runs = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # Some reports write their attachments to the working directory
+        os.chdir(workdir)
+        try:
+            for _ in range(repeat):
+                timer = PhaseTimer()
+                timer.wrap(esfixtures.FixtureClient, 'search', 'query')
+                timer.wrap(esfixtures.FixtureClient, 'msearch', 'query')
+                timer.wrap(TextUtils.TextUtils, 'printAsTextTable', 'render')
+                timer.wrap(TextUtils, 'sendEmail', 'render')
+                timer.wrap(StreamingTable, 'render_html', 'render')
+                start = time.perf_counter()
+                try:
+                    run_case(name, config_file, workdir, timer)
+                finally:
+                    timer.unwrap_all()
+                result = {phase: timer.times.get(phase, 0.)
+                          for phase in PHASES}
+                result['total'] = time.perf_counter() - start
+                runs.append(result)
+        finally:
+            os.chdir(cwd)
+    return {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+
+
+def run(cases, config_file, store, now, repeat=3, record=False):
+    """:return dict: Results keyed by case name"""
+    results = {}
+    esfixtures.install(store, record=record)
+    try:
+        with frozen_clock(now), benchmark_config():
+            for name in cases:
+                results[name] = measure(name, config_file,
+                                        1 if record else repeat)
+    finally:
+        esfixtures.uninstall()
+        if record:
+            store.save()
+    return results
+
+
+def print_table(results, baseline=None):
+    """Print results, with the total time change against baseline if given"""
+    fmt = "{:<16}" + " {:>8}" * (len(PHASES) + 1) + " {:>8}"
+    print(fmt.format('report', *(PHASES + ['total', 'vs base'])))
+    for name, r in sorted(results.items()):
+        change = ''
+        try:
+            change = '{0:+.0%}'.format(r['total'] / baseline[name]['total'] - 1)
+        except (KeyError, TypeError, ZeroDivisionError):
+            pass
+        print(fmt.format(name, *(['{0:.3f}'.format(r[key])
+                                  for key in PHASES + ['total']] + [change])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', default=sorted(CASES),
+                        help='Reports to run (default: all)')
+    parser.add_argument('-f', '--fixtures', required=True,
+                        help='Fixture directory')
+    parser.add_argument('-c', '--config', default='osg.toml',
+                        help='Report config file')
+    parser.add_argument('--record', action='store_true',
+                        help='Query the real cluster and lookups, and record '
+                             'the responses into the fixture directory')
+    parser.add_argument('--now', default=NOW,
+                        help='Frozen current time (default {0})'.format(NOW))
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs per report; the median is kept')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from a previous run to '
+                                          'compare against')
+    args = parser.parse_args()
+
+    for name in args.cases:
+        if name not in CASES:
+            parser.error("Unknown report {0}".format(name))
+
+    store = esfixtures.FixtureStore(args.fixtures)
+    results = run(args.cases, os.path.abspath(args.config), store,
+                  datetime.datetime.strptime(args.now, '%Y-%m-%dT%H:%M'),
+                  repeat=args.repeat, record=args.record)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
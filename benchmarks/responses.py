@@ -0,0 +1,213 @@
+"""Bytes on the wire and parse time of whole and trimmed search responses.
+
+With trim_responses, the reports that support it send their searches with
+filter_path, and parse the aggregations as plain dicts instead of through
+elasticsearch_dsl's AttrDict (see gracc_osg_reports.ResponseFilter).  For
+each of those reports, this measures against the same fixtures:
+
+    bytes       Size of the responses to the report's searches, whole and
+                as filter_path trims them
+    decode      Time to decode them: whole and trimmed with json, and
+                trimmed with orjson if it is installed
+    parse       Parse stage (see stages.py) from elasticsearch_dsl responses
+                and from trimmed plain dicts
+
+and checks that both ways build the same table.
+
+    python -m benchmarks.responses                 # Synthetic fixtures
+    python -m benchmarks.responses -f fixtures/    # Recorded fixtures
+
+The exit status is 1 if a table differs.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+from gracc_osg_reports.ReportDaemon import (_current_handlers,
+                                            _release_new_handlers)
+
+from . import esfixtures, reports, stages, synthetic
+from .sitescript import differences
+
+CASES = ['flocking', 'missingvo', 'monthlysites', 'payloadbatch', 'persite',
+         'persite-terms', 'project']
+DEFAULT_SCALE = 10
+DECODE_REPEAT = 5       # The fastest decode of this many is kept
+WHOLE = {'trim_responses': False}
+TRIMMED = {'trim_responses': True}
+
+
+def report_table(name, config_file, workdir, options):
+    """:return dict: The format_report() table of a case"""
+    handlers = _current_handlers()
+    try:
+        spec, report = reports.create_case(name, config_file, workdir,
+                                           options)
+        for method in stages.CASES[name][1]:
+            getattr(report, method)()
+        return report.format_report()
+    finally:
+        _release_new_handlers(handlers)
+
+
+def compare_case(name, config_file, store, workdir):
+    """Build a case's table with whole and with trimmed responses
+
+    :return tuple: (differences between the tables, list of (whole,
+        trimmed) responses to the searches sent with filter_path)
+    """
+    sent = []
+    original = esfixtures.FixtureClient.search
+
+    def search(client, index=None, body=None, **params):
+        if params.get('filter_path'):
+            whole = store.get_search(index, body)
+            sent.append((whole, esfixtures.filter_response(
+                whole, params['filter_path'])))
+        return original(client, index=index, body=body, **params)
+
+    table = report_table(name, config_file, workdir, WHOLE)
+    esfixtures.FixtureClient.search = search
+    try:
+        trimmed = report_table(name, config_file, workdir, TRIMMED)
+    finally:
+        esfixtures.FixtureClient.search = original
+    return differences(table, trimmed), sent
+
+
+def decode_seconds(loads, texts, repeat=DECODE_REPEAT):
+    """:return float: Fastest time to decode every text"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            loads(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_sizes(sent):
+    """:return dict: Bytes and decode times of the responses of a case"""
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+
+    whole = [json.dumps(w, separators=(',', ':')) for w, t in sent]
+    trimmed = [json.dumps(t, separators=(',', ':')) for w, t in sent]
+    return {'searches': len(sent),
+            'bytes': sum(len(text.encode('utf-8')) for text in whole),
+            'trimmed_bytes': sum(len(text.encode('utf-8'))
+                                 for text in trimmed),
+            'decode': decode_seconds(json.loads, whole),
+            'trimmed_decode': decode_seconds(json.loads, trimmed),
+            'trimmed_orjson': decode_seconds(orjson.loads, trimmed)
+                              if orjson is not None else None}
+
+
+def run(cases, config_file, store, now, repeat=5):
+    """:return tuple: (results keyed by case name, differences keyed by case
+    name)"""
+    results, diffs = {}, {}
+    cwd = os.getcwd()
+    esfixtures.install(store)
+    try:
+        with reports.frozen_clock(now), reports.benchmark_config(), \
+                tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            for name in cases:
+                diffs[name], sent = compare_case(name, config_file, store,
+                                                 workdir)
+                results[name] = measure_sizes(sent)
+    finally:
+        os.chdir(cwd)
+        esfixtures.uninstall()
+
+    for options, key in ((WHOLE, 'parse'), (TRIMMED, 'trimmed_parse')):
+        parsed = stages.run(cases, config_file, store, now, repeat=repeat,
+                            options=options)
+        for name in cases:
+            results[name][key] = parsed[name]['parse']
+    return results, diffs
+
+
+def print_table(results):
+    fmt = "{0:<14} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>9}"
+    print(fmt.format('', 'whole', 'trimmed', 'decode', 'trimmed', 'orjson',
+                     'parse', 'dict'))
+    print(fmt.format('report', '(KB)', '(KB)', '(s)', '(s)', '(s)', '(s)',
+                     'parse (s)'))
+    for name, r in sorted(results.items()):
+        orjson = '-' if r['trimmed_orjson'] is None \
+            else '{0:.3f}'.format(r['trimmed_orjson'])
+        print(fmt.format(name, '{0:.0f}'.format(r['bytes'] / 1024.),
+                         '{0:.0f}'.format(r['trimmed_bytes'] / 1024.),
+                         '{0:.3f}'.format(r['decode']),
+                         '{0:.3f}'.format(r['trimmed_decode']), orjson,
+                         '{0:.3f}'.format(r['parse']),
+                         '{0:.3f}'.format(r['trimmed_parse'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', default=CASES,
+                        help='Reports to run (default: all that trim their '
+                             'responses)')
+    parser.add_argument('-f', '--fixtures',
+                        help='Fixture directory (default: synthetic fixtures '
+                             'at --scale)')
+    parser.add_argument('-s', '--scale', type=float, default=DEFAULT_SCALE,
+                        help='Scale of the synthetic fixtures (default '
+                             '{0})'.format(DEFAULT_SCALE))
+    parser.add_argument('-c', '--config', default='osg.toml',
+                        help='Report config file')
+    parser.add_argument('--now', default=reports.NOW,
+                        help='Frozen current time (default {0})'.format(
+                            reports.NOW))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per case; the median is kept')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    for name in args.cases:
+        if name not in CASES:
+            parser.error("Unknown report {0}".format(name))
+
+    config_file = os.path.abspath(args.config)
+    now = datetime.datetime.strptime(args.now, '%Y-%m-%dT%H:%M')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = args.fixtures
+        if directory is None:
+            directory = os.path.join(tmpdir, 'fixtures')
+            synthetic.default_fixtures(directory, config_file, now,
+                                       args.scale, args.cases)
+        results, diffs = run(args.cases, config_file,
+                             esfixtures.FixtureStore(directory), now,
+                             repeat=args.repeat)
+
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    failed = False
+    for name in sorted(diffs):
+        for col, row, a, b in diffs[name][:20]:
+            print("{0}: {1} row {2}: {3!r} whole, {4!r} trimmed".format(
+                name, col, row, a, b))
+        if diffs[name]:
+            print("{0}: {1} cells differ".format(name, len(diffs[name])))
+            failed = True
+    if failed:
+        sys.exit(1)
+    print("Same tables from whole and trimmed responses")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Per site report with and without its painless site script.
+
+The per site report groups records by OIM_Site, or SiteName when there is no
+OIM_Site.  By default it has Elasticsearch do that with a script run for
+every record (persite); with site_script = false it asks for two plain terms
+aggregations and merges them itself (persite-terms).  This runs both
+against the same fixtures, checks that they build the same table, and
+times their parse and format stages (see stages.py).
+
+    python -m benchmarks.sitescript                 # Synthetic fixtures
+    python -m benchmarks.sitescript -f fixtures/    # Recorded fixtures
+
+Replayed fixtures only show the cost on this side.  The script's cost on
+the cluster shows in the "took" times of the two queries on a real cluster;
+see --explain.
+
+The exit status is 1 if the tables differ.
+"""
+
+import argparse
+import datetime
+import math
+import os
+import sys
+import tempfile
+
+from gracc_osg_reports.ReportDaemon import (_current_handlers,
+                                            _release_new_handlers)
+
+from . import esfixtures, reports, stages, synthetic
+
+CASES = ['persite', 'persite-terms']
+DEFAULT_SCALE = 10
+REL_TOL = 1e-9      # The two forms sum CoreHours in a different order
+
+
+def report_table(name, config_file, workdir):
+    """:return dict: The format_report() table of a case"""
+    handlers = _current_handlers()
+    try:
+        spec, report = reports.create_case(name, config_file, workdir)
+        report.generate()
+        return report.format_report()
+    finally:
+        _release_new_handlers(handlers)
+
+
+def differences(table, other, rel_tol=REL_TOL):
+    """:return list: (column, row, value, other value) of the cells that
+    differ between two tables"""
+    found = []
+    for col in sorted(set(table) | set(other)):
+        values, others = table.get(col, []), other.get(col, [])
+        for row in range(max(len(values), len(others))):
+            a = values[row] if row < len(values) else None
+            b = others[row] if row < len(others) else None
+            if isinstance(a, float) and isinstance(b, float):
+                if math.isclose(a, b, rel_tol=rel_tol, abs_tol=rel_tol) or \
+                        (math.isnan(a) and math.isnan(b)):
+                    continue
+            elif a == b:
+                continue
+            found.append((col, row, a, b))
+    return found
+
+
+def compare(config_file, store, now):
+    """:return list: Differences between the tables of the two cases"""
+    cwd = os.getcwd()
+    esfixtures.install(store)
+    try:
+        with reports.frozen_clock(now), reports.benchmark_config(), \
+                tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            tables = [report_table(name, config_file, workdir)
+                      for name in CASES]
+    finally:
+        os.chdir(cwd)
+        esfixtures.uninstall()
+    return differences(*tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-f', '--fixtures',
+                        help='Fixture directory (default: synthetic fixtures '
+                             'at --scale)')
+    parser.add_argument('-s', '--scale', type=float, default=DEFAULT_SCALE,
+                        help='Scale of the synthetic fixtures (default '
+                             '{0})'.format(DEFAULT_SCALE))
+    parser.add_argument('-c', '--config', default='osg.toml',
+                        help='Report config file')
+    parser.add_argument('--now', default=reports.NOW,
+                        help='Frozen current time (default {0})'.format(
+                            reports.NOW))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per case; the median is kept')
+    args = parser.parse_args()
+
+    config_file = os.path.abspath(args.config)
+    now = datetime.datetime.strptime(args.now, '%Y-%m-%dT%H:%M')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = args.fixtures
+        if directory is None:
+            directory = os.path.join(tmpdir, 'fixtures')
+            synthetic.default_fixtures(directory, config_file, now,
+                                       args.scale, CASES)
+        store = esfixtures.FixtureStore(directory)
+        diffs = compare(config_file, store, now)
+        results = stages.run(CASES, config_file, store, now,
+                             repeat=args.repeat)
+
+    stages.print_table(results)
+    for col, row, a, b in diffs[:20]:
+        print("{0} row {1}: {2!r} with the script, {3!r} without".format(
+            col, row, a, b))
+    if diffs:
+        print("{0} cells differ".format(len(diffs)))
+        sys.exit(1)
+    print("Same table with and without the site script")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Parse and format benchmark of each report, with a regression check.
+
+Each case builds a report from fixtures (see esfixtures), then times its
+parse stage (turning the aggregation response into rows: generate,
+generate_report_file, ...) and its format stage (format_report), without
+the time spent getting the response.  Nothing is rendered or sent.
+
+By default the fixtures are synthetic (see synthetic.py), generated with a
+fixed seed at --scale, so that every run gets the same large responses.
+-f uses an existing fixture directory instead, e.g. one recorded from
+production with benchmarks.reports --record.
+
+    python -m benchmarks.stages -o stages.json
+    python -m benchmarks.stages --compare stages.json --threshold 0.2
+
+With --compare, the exit status is 1 if the parse + format time of any
+case grew by more than --threshold (a fraction) over the baseline, and by
+more than NOISE seconds.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+
+from gracc_osg_reports.ReportDaemon import (_current_handlers,
+                                            _release_new_handlers)
+from gracc_osg_reports.Timing import PhaseTimer
+
+from . import esfixtures, reports, synthetic
+
+STAGES = ['parse', 'format']
+DEFAULT_SCALE = 10
+DEFAULT_THRESHOLD = 0.2
+NOISE = 0.005           # Slowdowns of less than this many seconds are ignored
+
+# name: (methods that turn responses into rows, methods to call before
+# format_report).  Each name is also a benchmarks.reports case.
+CASES = {
+    'flocking': (['generate'], []),
+    'missingvo': (['generate_report_file'], []),
+    'monthlysites': (['generate_report_file'], []),
+    'payloadbatch': (['generate_report_file'], []),
+    'persite': (['generate'], ['generate']),
+    'persite-terms': (['generate'], ['generate']),
+    'project': (['generate_report_file'], []),
+    'topopp': (['generate_report', 'generate_comparison'], []),
+}
+
+
+def run_case(name, config_file, workdir, options=None):
+    """Parse and format one report once
+
+    :param dict options: Report options to add to those of the case
+    :return dict: Seconds per stage
+    """
+    parsers, before = CASES[name]
+    timer = PhaseTimer()
+    handlers = _current_handlers()
+    try:
+        spec, report = reports.create_case(name, config_file, workdir,
+                                           options)
+        cls = type(report)
+        timer.wrap(esfixtures.FixtureClient, 'search', 'query')
+        timer.wrap(esfixtures.FixtureClient, 'msearch', 'query')
+        for method in parsers:
+            if hasattr(cls, method):
+                timer.wrap(cls, method, 'parse')
+        timer.wrap(cls, 'format_report', 'format')
+        for method in before:
+            getattr(report, method)()
+        report.format_report()
+    finally:
+        timer.unwrap_all()
+        _release_new_handlers(handlers)
+    return {stage: timer.times.get(stage, 0.) for stage in STAGES}
+
+
+def run(cases, config_file, store, now, repeat=5, options=None):
+    """Run each case repeat times and keep the median of each stage
+
+    :param dict options: Report options to add to those of each case
+    :return dict: Results keyed by case name
+    """
+    results = {}
+    cwd = os.getcwd()
+    esfixtures.install(store)
+    try:
+        with reports.frozen_clock(now), reports.benchmark_config(), \
+                tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            for name in cases:
+                runs = [run_case(name, config_file, workdir, options)
+                        for _ in range(repeat)]
+                result = {stage: statistics.median(r[stage] for r in runs)
+                          for stage in STAGES}
+                result['total'] = statistics.median(
+                    sum(r.values()) for r in runs)
+                results[name] = result
+    finally:
+        os.chdir(cwd)
+        esfixtures.uninstall()
+    return results
+
+
+def regressions(results, baseline, threshold, noise=NOISE):
+    """:return list: (case, change) of the cases whose total grew by more
+    than threshold, and by more than noise seconds"""
+    found = []
+    for name, r in sorted(results.items()):
+        try:
+            base = baseline[name]['total']
+            change = r['total'] / base - 1
+        except (KeyError, ZeroDivisionError):
+            continue
+        if change > threshold and r['total'] - base > noise:
+            found.append((name, change))
+    return found
+
+
+def print_table(results, baseline=None):
+    """Print results, with the total time change against baseline if given"""
+    fmt = "{0:<14} {1:>9} {2:>9} {3:>9} {4:>8}"
+    print(fmt.format('report', 'parse (s)', 'format', 'total', 'vs base'))
+    for name, r in sorted(results.items()):
+        change = ''
+        try:
+            change = '{0:+.0%}'.format(r['total'] / baseline[name]['total'] - 1)
+        except (KeyError, TypeError, ZeroDivisionError):
+            pass
+        print(fmt.format(name, '{0:.3f}'.format(r['parse']),
+                         '{0:.3f}'.format(r['format']),
+                         '{0:.3f}'.format(r['total']), change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', default=sorted(CASES),
+                        help='Reports to run (default: all)')
+    parser.add_argument('-f', '--fixtures',
+                        help='Fixture directory (default: synthetic fixtures '
+                             'at --scale)')
+    parser.add_argument('-s', '--scale', type=float, default=DEFAULT_SCALE,
+                        help='Scale of the synthetic fixtures (default '
+                             '{0})'.format(DEFAULT_SCALE))
+    parser.add_argument('-c', '--config', default='osg.toml',
+                        help='Report config file')
+    parser.add_argument('--now', default=reports.NOW,
+                        help='Frozen current time (default {0})'.format(
+                            reports.NOW))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per report; the median is kept')
+    parser.add_argument('-o', '--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='JSON file from a previous run to '
+                                          'compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Largest allowed slowdown against --compare, as '
+                             'a fraction (default {0})'.format(
+                                 DEFAULT_THRESHOLD))
+    args = parser.parse_args()
+
+    for name in args.cases:
+        if name not in CASES:
+            parser.error("Unknown report {0}".format(name))
+
+    config_file = os.path.abspath(args.config)
+    now = datetime.datetime.strptime(args.now, '%Y-%m-%dT%H:%M')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = args.fixtures
+        if directory is None:
+            directory = os.path.join(tmpdir, 'fixtures')
+            synthetic.default_fixtures(directory, config_file, now,
+                                       args.scale, args.cases)
+        results = run(args.cases, config_file,
+                      esfixtures.FixtureStore(directory), now,
+                      repeat=args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        slower = regressions(results, baseline, args.threshold)
+        for name, change in slower:
+            print("{0} regressed by {1:.0%} (threshold {2:.0%})".format(
+                name, change, args.threshold))
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+"""Synthetic GRACC records, for running the reports at many times today's size.
+
+World holds the entities the reports group by (sites, facilities, VOs,
+probes, projects with their PIs, users) and draws records from them.  Each
+field picks its entity from a Zipf-like distribution, so a few VOs, sites
+and projects carry most of the hours, as in the real data.  The number of
+entities is CARDINALITY times --scale, and each entity type can be set with
+--cardinality.  The probe names in the config file's probe lists come first,
+so that the reports' probe filters match.
+
+Two kinds of records are generated, like the GRACC indices:
+
+    summary   Per-day sums (Njobs >= 1) in gracc.osg.summary, over the last
+              --days days
+    raw       Single jobs in gracc.osg.raw-*, over the last RAW_DAYS days
+
+Fixtures: the reports are run against the records in memory (see esquery)
+with esfixtures in record mode, and the Topology, sites and XD lookups are
+answered with matching synthetic data.  The result is a fixture directory
+for benchmarks.reports:
+
+    python -m benchmarks.synthetic -f fixtures/x10 --scale 10
+    python -m benchmarks.reports -f fixtures/x10 -o x10.json
+
+Records as JSON Lines (e.g. to bulk-load a test cluster):
+
+    python -m benchmarks.synthetic --dump summary.jsonl --kind summary
+
+Records are held in memory: budget about 1 kB per record.
+"""
+
+import argparse
+import bisect
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import random
+import sys
+from xml.sax.saxutils import escape
+
+from gracc_reporting import ReportUtils
+
+from gracc_osg_reports import Cache
+
+from . import esfixtures, esquery, reports
+
+# Number of each entity at scale 1, about the size of today's data
+CARDINALITY = {'sites': 150, 'facilities': 90, 'vos': 60, 'probes': 80,
+               'projects': 600, 'pis': 400, 'organizations': 200,
+               'users': 2000}
+RECORDS_PER_SCALE = 10000
+RAW_RECORDS_PER_SCALE = 2000
+RAW_DAYS = 35
+DEFAULT_DAYS = 400
+DEFAULT_SKEW = 1.1
+DAY_MS = 86400000
+
+SUMMARY_INDEX = 'gracc.osg.summary'
+RAW_INDEX = 'gracc.osg.raw-*'
+
+# Big VOs first, so that they get the most hours
+KNOWN_VOS = ['osg', 'cms', 'atlas', 'ligo', 'fermilab', 'icecube', 'gluex',
+             'dune']
+FIELDS_OF_SCIENCE = ['Physics', 'Biological Sciences', 'Chemistry',
+                     'Computer Science', 'Astronomy', 'Engineering',
+                     'Mathematical Sciences', 'Economics',
+                     'Earth Sciences', 'Medical Sciences']
+XD_SHARE = 10           # Every XD_SHARE-th project is an XSEDE "TG-" project
+UNREGISTERED_SHARE = 10  # Every n-th VO is missing from Topology
+SILENT_SHARE = 20       # Every n-th Topology resource never reports
+
+
+def cardinalities(scale=1, overrides=None):
+    """Number of each entity
+
+    :param float scale: Multiplier for CARDINALITY
+    :param dict overrides: Entity name -> number, taking precedence
+    :return dict:
+    """
+    result = {name: max(1, int(round(n * scale)))
+              for name, n in CARDINALITY.items()}
+    for name, n in (overrides or {}).items():
+        if name not in CARDINALITY:
+            raise ValueError("Unknown entity {0}.  Known entities are "
+                             "{1}".format(name, ', '.join(sorted(CARDINALITY))))
+        result[name] = int(n)
+    return result
+
+
+def config_probes(config):
+    """Probe names from every probe list in the config file, in order"""
+    probes = []
+
+    def walk(section):
+        for key, value in section.items():
+            if isinstance(value, dict):
+                walk(value)
+            elif key.endswith('probe_list') and isinstance(value, list):
+                probes.extend(p for p in value if p not in probes)
+    walk(config)
+    return probes
+
+
+class Zipf(object):
+    """Draws items with weight 1 / rank**skew
+
+    :param list items: Items, most likely first
+    :param float skew: Zipf exponent; 0 draws uniformly
+    """
+    def __init__(self, items, skew):
+        self.items = items
+        self.cumulative = list(itertools.accumulate(
+            1. / (rank ** skew) for rank in range(1, len(items) + 1)))
+
+    def draw(self, rnd):
+        x = rnd.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_left(self.cumulative, x)]
+
+
+class World(object):
+    """The entities of a synthetic GRACC, and records drawn from them
+
+    :param dict counts: Number of each entity (see cardinalities())
+    :param list probes: Probe names that must exist (see config_probes())
+    :param float skew: Zipf exponent of every field
+    :param int seed: Random seed
+    """
+    def __init__(self, counts, probes=(), skew=DEFAULT_SKEW, seed=0):
+        self.counts = counts
+        self.skew = skew
+        self.seed = seed
+        rnd = random.Random(seed)
+
+        self.facilities = ['SYN_Facility{0:05d}'.format(i)
+                           for i in range(counts['facilities'])]
+        self.sites = ['SYN_Site{0:05d}'.format(i)
+                      for i in range(counts['sites'])]
+        self.site_facility = {site: self.facilities[i % len(self.facilities)]
+                              for i, site in enumerate(self.sites)}
+        self.vos = (KNOWN_VOS + ['vo{0:04d}'.format(i) for i in range(
+            max(0, counts['vos'] - len(KNOWN_VOS)))])[:counts['vos']]
+        self.registered_vos = [vo for i, vo in enumerate(self.vos)
+                               if i % UNREGISTERED_SHARE !=
+                               UNREGISTERED_SHARE - 1]
+        extra = max(0, counts['probes'] - len(probes))
+        self.probes = list(probes) + [
+            'condor:submit{0:05d}.synthetic.example.org'.format(i)
+            for i in range(extra)]
+        self.organizations = ['University {0:04d}'.format(i)
+                              for i in range(counts['organizations'])]
+        self.pis = ['PI Person{0:05d}'.format(i) for i in range(counts['pis'])]
+        self.projects = [('TG-SYN{0:06d}' if i % XD_SHARE == XD_SHARE - 1
+                          else 'SynProject{0:06d}').format(i)
+                         for i in range(counts['projects'])]
+        self.project_info = {
+            project: (rnd.choice(self.pis), rnd.choice(self.organizations),
+                      rnd.choice(FIELDS_OF_SCIENCE))
+            for project in self.projects}
+        self.users = ['/DC=org/DC=synthetic/CN=User {0:06d}'.format(i)
+                      for i in range(counts['users'])]
+
+        self._draw = {name: Zipf(items, skew) for name, items in (
+            ('site', self.sites), ('vo', self.vos), ('probe', self.probes),
+            ('project', self.projects), ('user', self.users))}
+
+    @classmethod
+    def from_config(cls, config, scale=1, overrides=None, **kwargs):
+        """World whose probes include the config file's probe lists"""
+        return cls(cardinalities(scale, overrides), config_probes(config),
+                   **kwargs)
+
+    def _record(self, rnd, endtime, njobs):
+        site = self._draw['site'].draw(rnd)
+        project = self._draw['project'].draw(rnd)
+        pi, organization, fos = self.project_info[project]
+        processors = rnd.choice((1, 1, 1, 4, 8))
+        corehours = rnd.lognormvariate(0.5, 1.5) * njobs * processors
+        record = {
+            'VOName': self._draw['vo'].draw(rnd),
+            'SiteName': site + '_CE',
+            'OIM_Site': site,
+            'OIM_Facility': self.site_facility[site],
+            'ProbeName': self._draw['probe'].draw(rnd),
+            'ProjectName': project,
+            'OIM_PIName': pi,
+            'OIM_Organization': organization,
+            'OIM_FieldOfScience': fos,
+            'CommonName': self._draw['user'].draw(rnd),
+            'ResourceType': 'Payload' if rnd.random() < 0.4 else 'Batch',
+            'Grid': 'Local' if rnd.random() < 0.1 else 'OSG',
+            'Processors': processors,
+            'Njobs': njobs,
+            'CoreHours': corehours,
+            'WallDuration': corehours * 3600. / processors,
+            'EndTime': endtime,
+            '@received': endtime + rnd.randrange(60000, 6 * 3600000),
+        }
+        # Records that the reports have to treat specially
+        x = rnd.random()
+        if x < 0.05:
+            record['OIM_Site'] = record['OIM_Facility'] = None
+        elif x < 0.08:
+            record['ProjectName'] = None
+        elif x < 0.11:
+            record['OIM_PIName'] = record['OIM_Organization'] = \
+                record['OIM_FieldOfScience'] = None
+            record['RawProjectName'] = project.lower()
+        return {k: v for k, v in record.items() if v is not None}
+
+    def records(self, kind, n, now, days):
+        """Draw n records
+
+        :param str kind: 'summary' (per-day sums) or 'raw' (single jobs)
+        :param datetime.datetime now: End of the time range
+        :param int days: Length of the time range
+        :return generator: Record dicts, with dates as epoch milliseconds
+        """
+        rnd = random.Random('{0}-{1}'.format(self.seed, kind))
+        end = esquery.to_millis(now)
+        start = end - days * DAY_MS
+        for _ in range(n):
+            endtime = rnd.randrange(start, end)
+            if kind == 'summary':
+                endtime -= endtime % DAY_MS
+                njobs = 1 + int(rnd.expovariate(0.05))
+            else:
+                njobs = 1
+            yield self._record(rnd, endtime, njobs)
+
+    # Lookups: what Topology, the sites file and the XD database would say
+
+    def vo_xml(self):
+        """Topology VO summary"""
+        return ('<VOSummary>' + ''.join(
+            '<VO><Name>{0}</Name></VO>'.format(escape(vo))
+            for vo in self.registered_vos) + '</VOSummary>').encode('utf-8')
+
+    def resource_group_xml(self):
+        """Topology resource group summary, one resource per probe host,
+        plus some resources that never report"""
+        hosts = [probe.split(':', 1)[-1] for probe in self.probes]
+        hosts += ['silent{0:05d}.synthetic.example.org'.format(i)
+                  for i in range(len(hosts) // SILENT_SHARE)]
+        groups = []
+        for i, host in enumerate(hosts):
+            site = self.sites[i % len(self.sites)]
+            groups.append(
+                '<ResourceGroup><GroupName>{site}_RG{i}</GroupName>'
+                '<Facility><Name>{facility}</Name></Facility>'
+                '<Site><Name>{site}</Name></Site><Resources><Resource>'
+                '<ID>{i}</ID><Name>{site}_R{i}</Name><Active>True</Active>'
+                '<Disable>False</Disable><FQDN>{host}</FQDN>'
+                '<WLCGInformation><InteropAccounting>{interop}'
+                '</InteropAccounting></WLCGInformation>'
+                '</Resource></Resources></ResourceGroup>'.format(
+                    i=i, site=escape(site), host=escape(host),
+                    facility=escape(self.site_facility[site]),
+                    interop='True' if i % 3 else 'False'))
+        return ('<ResourceSummary>' + ''.join(groups) +
+                '</ResourceSummary>').encode('utf-8')
+
+    @staticmethod
+    def downtime_xml():
+        """Topology downtimes: none"""
+        return b'<Downtimes><CurrentDowntimes></CurrentDowntimes></Downtimes>'
+
+    def sites_list(self):
+        """Payload/pilot sites file: most sites, a few with a name
+        override"""
+        sites = self.sites[:max(1, len(self.sites) * 4 // 5)]
+        overrides = {site: site.replace('SYN_', 'Synthetic ')
+                     for site in sites[::25]}
+        return sites, overrides
+
+    def xd_row(self, name):
+        """XD database row of a project, or () if it isn't an XD project"""
+        if name not in self.project_info or not name.startswith('TG-'):
+            return ()
+        pi, organization, fos = self.project_info[name]
+        first, last = pi.split(' ', 1)
+        return (self.projects.index(name), first, last,
+                '{0}@synthetic.example.org'.format(last.lower()),
+                organization, 'Department of {0}'.format(fos), fos,
+                'Synthetic project {0}'.format(name))
+
+    def lookup(self, cache, key):
+        """Value of a Cache lookup"""
+        if cache == 'topology':
+            if 'vosummary' in key:
+                return self.vo_xml()
+            if 'downtime' in key:
+                return self.downtime_xml()
+            return self.resource_group_xml()
+        if cache == 'sites':
+            return self.sites_list()
+        if cache == 'xd_projects':
+            return self.xd_row(key)
+        raise KeyError("No synthetic data for '{0}' lookups".format(cache))
+
+
+def make_client(world, now, records, raw_records, days):
+    """In-memory cluster holding the world's records
+
+    :return esquery.InMemoryElasticsearch:
+    """
+    return esquery.InMemoryElasticsearch({
+        SUMMARY_INDEX: list(world.records('summary', records, now, days)),
+        RAW_INDEX: list(world.records('raw', raw_records, now, RAW_DAYS)),
+    }, now=now)
+
+
+def generate_fixtures(directory, config_file, world, now, cases=None,
+                      records=RECORDS_PER_SCALE,
+                      raw_records=RAW_RECORDS_PER_SCALE, days=DEFAULT_DAYS):
+    """Run the reports against the world's records, recording fixtures
+
+    :param str directory: Fixture directory
+    :param str config_file: Report config file
+    :param World world: Synthetic entities
+    :param datetime.datetime now: Frozen "now" of the reports and the records
+    :param list cases: benchmarks.reports case names (default: all)
+    :param int records: Number of summary records
+    :param int raw_records: Number of raw records
+    :param int days: Days of summary records
+    :return dict: Results of the recording run (see reports.run)
+    """
+    client = make_client(world, now, records, raw_records, days)
+
+    original_es = ReportUtils.Elasticsearch
+    original_get = Cache.TTLCache.get
+
+    def synthetic_get(cache, key, loader):
+        return original_get(cache, key, lambda: world.lookup(cache.name, key))
+
+    ReportUtils.Elasticsearch = lambda *args, **kwargs: client
+    Cache.TTLCache.get = synthetic_get
+    try:
+        return reports.run(cases or sorted(reports.CASES), config_file,
+                           esfixtures.FixtureStore(directory), now,
+                           record=True)
+    finally:
+        ReportUtils.Elasticsearch = original_es
+        Cache.TTLCache.get = original_get
+        for cache in ('topology', 'sites', 'xd_projects'):
+            Cache.get_cache(cache).clear()
+
+
+def default_fixtures(directory, config_file, now, scale, cases=None):
+    """Fixtures from a world of the given scale with the default seed,
+    skew and number of records, as the other benchmarks use them
+
+    :return dict: Results of the recording run (see reports.run)
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        config = ReportUtils.Reporter._parse_config(config_file)
+    world = World.from_config(config, scale=scale)
+    return generate_fixtures(
+        directory, config_file, world, now, cases,
+        records=int(RECORDS_PER_SCALE * scale),
+        raw_records=int(RAW_RECORDS_PER_SCALE * scale))
+
+
+def dump(out, world, kind, n, now, days):
+    """Write n records as JSON Lines, dates as strings"""
+    for record in world.records(kind, n, now, days):
+        out.write(json.dumps(esquery.InMemoryElasticsearch.source(record)))
+        out.write('\n')
+
+
+def _parse_cardinality(text):
+    try:
+        return {name.strip(): int(n) for name, n in
+                (item.split('=') for item in text.split(',') if item)}
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Use NAME=N[,NAME=N...], e.g. sites=1500,vos=200")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cases', nargs='*', default=sorted(reports.CASES),
+                        help='Reports to record fixtures for (default: all)')
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('-f', '--fixtures',
+                        help='Record fixtures into this directory')
+    output.add_argument('--dump', help='Write records to this JSON Lines '
+                                       'file, - for stdout')
+    parser.add_argument('-c', '--config', default='osg.toml',
+                        help='Report config file')
+    parser.add_argument('-s', '--scale', type=float, default=1,
+                        help='Multiplier for the number of entities and '
+                             'records (default 1)')
+    parser.add_argument('--cardinality', type=_parse_cardinality,
+                        help='Number of some entities, e.g. sites=1500,vos=200. '
+                             'Entities: ' + ', '.join(sorted(CARDINALITY)))
+    parser.add_argument('--skew', type=float, default=DEFAULT_SKEW,
+                        help='Zipf exponent of every field; 0 is uniform '
+                             '(default {0})'.format(DEFAULT_SKEW))
+    parser.add_argument('-n', '--records', type=int,
+                        help='Summary records (default {0} x scale)'.format(
+                            RECORDS_PER_SCALE))
+    parser.add_argument('--raw-records', type=int,
+                        help='Raw records (default {0} x scale)'.format(
+                            RAW_RECORDS_PER_SCALE))
+    parser.add_argument('--kind', choices=('summary', 'raw'),
+                        default='summary', help='Records to --dump')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS,
+                        help='Days of summary records before --now')
+    parser.add_argument('--now', default=reports.NOW,
+                        help='End of the records, and frozen current time of '
+                             'the reports (default {0})'.format(reports.NOW))
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    for name in args.cases:
+        if name not in reports.CASES:
+            parser.error("Unknown report {0}".format(name))
+
+    now = datetime.datetime.strptime(args.now, '%Y-%m-%dT%H:%M')
+    config_file = os.path.abspath(args.config)
+    # The config parser prints to stdout, where --dump - writes the records
+    with contextlib.redirect_stdout(sys.stderr):
+        config = ReportUtils.Reporter._parse_config(config_file)
+    world = World.from_config(config,
+                              scale=args.scale, overrides=args.cardinality,
+                              skew=args.skew, seed=args.seed)
+
+    records = args.records if args.records is not None \
+        else int(args.scale * RECORDS_PER_SCALE)
+    raw_records = args.raw_records if args.raw_records is not None \
+        else int(args.scale * RAW_RECORDS_PER_SCALE)
+
+    if args.dump:
+        if args.kind == 'summary':
+            n, days = records, args.days
+        else:
+            n, days = raw_records, RAW_DAYS
+        if args.dump == '-':
+            dump(sys.stdout, world, args.kind, n, now, days)
+        else:
+            with open(args.dump, 'w') as f:
+                dump(f, world, args.kind, n, now, days)
+        return
+
+    generate_fixtures(args.fixtures, config_file, world, now, args.cases,
+                      records=records, raw_records=raw_records, days=args.days)
+    print("Recorded fixtures for {0} reports in {1}".format(len(args.cases),
+                                                            args.fixtures))
+
+
+if __name__ == '__main__':
+    main()
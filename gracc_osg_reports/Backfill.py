@@ -0,0 +1,223 @@
+"""Regenerate a report over a long history, one period at a time.
+
+Every report with a time range takes --backfill START:END:STEP, except the
+missing project report, whose checks share temporary files in the working
+directory and so can't run several periods at once.  The range is split
+into periods of STEP (e.g. 1d, 1w, 1mo), and the report is run for each
+period in a pool of worker processes.  Nothing is emailed; each period's
+table is written to the --sink files, with {start} and {end} in a
+sink path replaced by the period's dates (or the dates added before the
+extension if the path has neither):
+
+    osgflockingreport --backfill 2016-01-01:2017-01-01:1w \\
+        --sink 'flocking_{start}.parquet'
+
+The number of worker processes, and so of periods queried at once, is capped
+by max_workers in the [backfill] section of the config file (default 4), or
+by --backfill-workers.  Each worker keeps its Elasticsearch connection, the
+parsed config and the Topology/sites/XD lookups (see Connections and Cache)
+from one period to the next.
+"""
+
+import concurrent.futures
+import datetime
+import logging
+import os
+import re
+import traceback
+
+from dateutil.relativedelta import relativedelta
+
+from gracc_reporting import ReportUtils
+
+from . import Connections, OSGReporter, ReportRegistry
+from .ReportDaemon import _current_handlers, _release_new_handlers
+
+DEFAULT_MAX_WORKERS = 4
+DATE_FMT = '%Y-%m-%d'
+
+_step_re = re.compile(r'^(\d*)(h|d|w|mo|y)$')
+_step_units = {'h': lambda n: relativedelta(hours=n),
+               'd': lambda n: relativedelta(days=n),
+               'w': lambda n: relativedelta(weeks=n),
+               'mo': lambda n: relativedelta(months=n),
+               'y': lambda n: relativedelta(years=n)}
+
+
+def parse_step(step):
+    """Convert a step like '1d', '2w', '1mo' or 'y' to a relativedelta
+
+    :param str step: Number (default 1) followed by h, d, w, mo or y
+    :return dateutil.relativedelta.relativedelta: Step
+    """
+    m = _step_re.match(step.strip())
+    if not m:
+        raise ValueError("Invalid backfill step {0}.  Use a number followed "
+                         "by h, d, w, mo or y, e.g. 1d or 1mo".format(step))
+    return _step_units[m.group(2)](int(m.group(1) or 1))
+
+
+def parse_backfill(spec):
+    """Parse a --backfill argument
+
+    :param str spec: START:END:STEP, with START and END as YYYY-MM-DD
+    :return tuple: (start datetime, end datetime, relativedelta step)
+    """
+    parts = spec.split(':')
+    if len(parts) != 3:
+        raise ValueError("Invalid backfill range {0}.  Use START:END:STEP, "
+                         "e.g. 2016-01-01:2017-01-01:1w".format(spec))
+    start, end = (datetime.datetime.strptime(p.strip(), DATE_FMT)
+                  for p in parts[:2])
+    if end <= start:
+        raise ValueError("Backfill end {0} is not after start {1}".format(
+            parts[1], parts[0]))
+    return start, end, parse_step(parts[2])
+
+
+def periods(start, end, step):
+    """Split [start, end) into consecutive periods of length step.  The last
+    period is cut short at end.
+
+    :return list: (start, end) datetime tuples
+    """
+    result = []
+    i = 0
+    pstart = start
+    while pstart < end:
+        i += 1
+        pend = min(start + step * i, end)
+        result.append((pstart, pend))
+        pstart = pend
+    return result
+
+
+def period_sink(spec, start, end):
+    """Sink spec for one period: {start} and {end} are replaced by the
+    period's dates.  If spec has neither, the dates go before the file
+    extension.
+
+    :param str spec: [FORMAT:]PATH from --sink
+    :return str: Sink spec
+    """
+    fields = {'start': start.strftime(DATE_FMT), 'end': end.strftime(DATE_FMT)}
+    if '{start}' in spec or '{end}' in spec:
+        return spec.replace('{start}', fields['start']) \
+            .replace('{end}', fields['end'])
+    root, ext = os.path.splitext(spec)
+    return '{0}_{start}_{end}{1}'.format(root, ext, **fields)
+
+
+def max_workers(config, requested=None):
+    """Number of worker processes
+
+    :param dict config: Parsed report config
+    :param int requested: --backfill-workers, overrides config
+    :return int:
+    """
+    if requested is not None:
+        return max(1, requested)
+    return max(1, config.get('backfill', {}).get('max_workers',
+                                                 DEFAULT_MAX_WORKERS))
+
+
+def _init_worker():
+    """Share connections and cached lookups between a worker's periods"""
+    Connections.install()
+
+
+def _run_period(script, config_file, start, end, sinks, kwargs):
+    """Run one period of a backfill in a worker process
+
+    :return tuple: (start, end, error string or None)
+    """
+    handlers = _current_handlers()
+    try:
+        spec = ReportRegistry.get_spec(script)
+        kwargs = dict(kwargs, no_email=True,
+                      sinks=[period_sink(s, start, end) for s in sinks])
+        report = spec.create(config_file, start, end, **kwargs)
+        spec.run(report)
+    except (Exception, SystemExit):
+        return start, end, traceback.format_exc()
+    finally:
+        _release_new_handlers(handlers)
+    return start, end, None
+
+
+def check_args(parser, args, monthly=False):
+    """Check the backfill options of parsed command-line arguments.  Exits
+    through parser.error if they can't be used.
+
+    :param argparse.ArgumentParser parser: Parser that parsed args
+    :param argparse.Namespace args: Parsed arguments
+    :param bool monthly: The report always covers one calendar month (the
+        per site report), so the periods have to be calendar months
+    """
+    if not getattr(args, 'backfill', None):
+        return
+    if not args.sinks:
+        parser.error("--backfill doesn't send email.  Give at least one "
+                     "--sink to write the results to.")
+    try:
+        start, end, step = parse_backfill(args.backfill)
+    except ValueError as e:
+        parser.error(str(e))
+    if monthly and (step != relativedelta(months=1) or start.day != 1 or
+                    end.day != 1):
+        parser.error("This report covers one calendar month at a time.  "
+                     "Backfill it with a STEP of 1mo, from and to the first "
+                     "of a month, e.g. 2016-01-01:2017-01-01:1mo")
+
+
+def run(script, args, logfile, options=None):
+    """Run a backfill of a report from its parsed command-line arguments
+
+    :param str script: Console script name of the report (see ReportRegistry)
+    :param argparse.Namespace args: Parsed arguments, with backfill set,
+        checked with check_args
+    :param str logfile: Log file for the reports
+    :param dict options: Report-specific constructor arguments, e.g.
+        report_type
+    :return int: Exit status: 0 if every period ran, 1 otherwise
+    """
+    logger = logging.getLogger('Backfill')
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+
+    start, end, step = parse_backfill(args.backfill)
+    todo = periods(start, end, step)
+    config = ReportUtils.Reporter._parse_config(args.config)
+    nworkers = min(max_workers(config, args.backfill_workers), len(todo))
+    logger.info("Backfilling {0} for {1} periods from {2} to {3} with {4} "
+                "workers".format(script, len(todo), start.date(), end.date(),
+                                 nworkers))
+
+    kwargs = OSGReporter.report_kwargs(args)
+    # The periods run at once, so they can't share a profile, the printed
+    # --explain output or the snapshot --changes-only compares against, and
+    # the row cap only matters for email.  Each period gets its own sinks.
+    for name in ('row_cap', 'sinks', 'changes_only', 'profile',
+                 'profile_interval', 'explain'):
+        kwargs.pop(name, None)
+    kwargs.update(template=args.template, options=options, logfile=logfile)
+
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=nworkers, initializer=_init_worker) as pool:
+        futures = [pool.submit(_run_period, script, args.config, pstart,
+                               pend, args.sinks, kwargs)
+                   for pstart, pend in todo]
+        for future in concurrent.futures.as_completed(futures):
+            pstart, pend, error = future.result()
+            if error is None:
+                logger.info("Finished {0} - {1}".format(pstart, pend))
+            else:
+                failures += 1
+                logger.error("Failed {0} - {1}:\n{2}".format(pstart, pend,
+                                                             error))
+
+    logger.info("Backfill done: {0} of {1} periods succeeded".format(
+        len(todo) - failures, len(todo)))
+    return 1 if failures else 0
@@ -0,0 +1,153 @@
+"""In-process caches with time-to-live eviction.
+
+These hold data that the reports fetch from outside of GRACC (Topology XML,
+the payload/pilot sites list, XD database lookups), and GRACC's index list,
+so that a long-running process such as the report daemon only goes back to
+the source once the cached copy has expired.  In a one-shot report run the caches simply live
+for the lifetime of the process.
+"""
+
+import copy
+import os
+import time
+
+from gracc_reporting import ReportUtils
+
+DEFAULT_TTL = 3600      # seconds
+
+_caches = {}
+_configs = {}
+_read_config = ReportUtils.Reporter._parse_config   # Unpatched TOML reader
+
+
+class TTLCache(object):
+    """Dictionary-like cache whose entries expire after a fixed time
+
+    :param str name: Name of the cache (used in log messages and status)
+    :param int ttl: Number of seconds an entry stays valid
+    """
+    def __init__(self, name, ttl=DEFAULT_TTL):
+        self.name = name
+        self.ttl = ttl
+        self._store = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() to (re)fill the
+        entry if it is missing or expired.  A loader that returns None is
+        treated as a failed lookup, and nothing is cached.
+
+        :param key: Hashable key for the entry
+        :param function loader: Zero-argument callable that produces the value
+        :return: Cached or freshly loaded value
+        """
+        now = time.time()
+        try:
+            expires, value = self._store[key]
+            if expires > now:
+                self.hits += 1
+                return value
+        except KeyError:
+            pass
+
+        self.misses += 1
+        value = loader()
+        if value is not None:
+            self._store[key] = (now + self.ttl, value)
+        return value
+
+    def evict_expired(self):
+        """Drop all entries whose time-to-live has passed
+
+        :return int: Number of evicted entries
+        """
+        now = time.time()
+        expired = [key for key, (expires, _) in self._store.items()
+                   if expires <= now]
+        for key in expired:
+            del self._store[key]
+        return len(expired)
+
+    def clear(self):
+        """Drop every entry in the cache"""
+        self._store.clear()
+
+    def __len__(self):
+        return len(self._store)
+
+    def __contains__(self, key):
+        try:
+            return self._store[key][0] > time.time()
+        except KeyError:
+            return False
+
+
+def get_cache(name, ttl=None):
+    """Get the named cache, creating it if necessary
+
+    :param str name: Name of the cache, e.g. 'topology', 'sites', 'xd_projects',
+        'indices'
+    :param int ttl: If given, (re)set the time-to-live of the cache
+    :return TTLCache: The cache
+    """
+    try:
+        cache = _caches[name]
+    except KeyError:
+        cache = _caches[name] = TTLCache(name)
+    if ttl is not None:
+        cache.ttl = ttl
+    return cache
+
+
+def configure(ttls):
+    """Set the time-to-live of several caches at once
+
+    :param dict ttls: Mapping of cache name to TTL in seconds, as found in the
+        [daemon.cache_ttl] section of the config file
+    """
+    for name, ttl in ttls.items():
+        get_cache(name, ttl=int(ttl))
+
+
+def evict_expired():
+    """Evict expired entries from every cache
+
+    :return dict: Number of evicted entries per cache name
+    """
+    return {name: cache.evict_expired() for name, cache in _caches.items()}
+
+
+def stats():
+    """Summary of every cache, suitable for a status file
+
+    :return dict: Per-cache size, TTL, hit and miss counts
+    """
+    return {name: {'entries': len(cache), 'ttl': cache.ttl,
+                   'hits': cache.hits, 'misses': cache.misses}
+            for name, cache in _caches.items()}
+
+
+def parse_config(configfile):
+    """Drop-in replacement for ReportUtils.Reporter._parse_config that only
+    re-reads the TOML file when its modification time changes.  Each caller
+    gets its own copy of the parsed config.
+
+    :param str configfile: Path to TOML config file to be parsed
+    :return dict: Parsed config
+    """
+    try:
+        mtime = os.path.getmtime(configfile)
+    except (OSError, TypeError):
+        return _read_config(configfile)
+
+    try:
+        cached_mtime, config = _configs[configfile]
+        if cached_mtime == mtime:
+            return copy.deepcopy(config)
+    except KeyError:
+        pass
+
+    config = _read_config(configfile)
+    _configs[configfile] = (mtime, config)
+    return copy.deepcopy(config)
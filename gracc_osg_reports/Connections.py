@@ -0,0 +1,185 @@
+"""Long-lived Elasticsearch and SMTP connections.
+
+Every report builds its own Elasticsearch client in ReportUtils.Reporter and
+opens a fresh SMTP connection for each email.  That is fine for a one-shot
+run, but a process that runs many reports (the report daemon) should keep
+those connections warm instead.  install() swaps in factories that hand out
+one shared client per Elasticsearch host and one pooled connection per SMTP
+host; uninstall() puts the originals back.
+
+smtplib itself is left alone.  The reports in this package open their SMTP
+connections with SMTP() below, and TextUtils.sendEmail is given a stand-in
+for the smtplib module whose SMTP is PooledSMTP.
+"""
+
+import logging
+import smtplib
+
+from gracc_reporting import ReportUtils
+
+from . import Cache
+
+_es_clients = {}
+_smtp_connections = {}
+
+_originals = {}
+
+logger = logging.getLogger('gracc_osg_reports.Connections')
+
+
+def shared_elasticsearch(hosts, **kwargs):
+    """Return an Elasticsearch client for hosts, reusing the client (and so
+    its connection pool) if one was already created with the same arguments
+
+    :param hosts: Elasticsearch host(s), as passed to elasticsearch.Elasticsearch
+    :return elasticsearch.Elasticsearch: Shared client
+    """
+    key = (repr(hosts), tuple(sorted((k, repr(v)) for k, v in kwargs.items())))
+    try:
+        return _es_clients[key]
+    except KeyError:
+        es_class = _originals.get('Elasticsearch', ReportUtils.Elasticsearch)
+        client = _es_clients[key] = es_class(hosts, **kwargs)
+        logger.info("Opened shared Elasticsearch client for {0}".format(hosts))
+        return client
+
+
+class PooledSMTP(object):
+    """Stand-in for smtplib.SMTP that sends through one pooled connection per
+    SMTP host.  quit() leaves the connection open for the next caller; a
+    connection that the server has dropped is reopened on the next send.
+
+    :param str host: SMTP host
+    :param int port: SMTP port
+    """
+    def __init__(self, host='', port=0, *args, **kwargs):
+        self.key = (host, port)
+        self._args = args
+        self._kwargs = kwargs
+
+    def _connection(self, reconnect=False):
+        conn = _smtp_connections.get(self.key)
+        if conn is None or reconnect:
+            if conn is not None:
+                _close_quietly(conn)
+            conn = smtplib.SMTP(self.key[0], self.key[1], *self._args,
+                                **self._kwargs)
+            _smtp_connections[self.key] = conn
+            logger.info("Opened pooled SMTP connection to {0}".format(
+                self.key[0]))
+        return conn
+
+    def sendmail(self, *args, **kwargs):
+        try:
+            return self._connection().sendmail(*args, **kwargs)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            return self._connection(reconnect=True).sendmail(*args, **kwargs)
+
+    def send_message(self, *args, **kwargs):
+        try:
+            return self._connection().send_message(*args, **kwargs)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            return self._connection(reconnect=True).send_message(*args,
+                                                                 **kwargs)
+
+    def quit(self):
+        """Keep the pooled connection open"""
+        return
+
+    close = quit
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
+
+    def __getattr__(self, name):
+        return getattr(self._connection(), name)
+
+
+class _PooledSMTPLib(object):
+    """Stand-in for the smtplib module, with PooledSMTP as its SMTP"""
+    SMTP = PooledSMTP
+
+    def __getattr__(self, name):
+        return getattr(smtplib, name)
+
+
+def SMTP(host='', port=0, *args, **kwargs):
+    """Open an SMTP connection: a PooledSMTP while install() is in effect,
+    else a plain smtplib.SMTP
+
+    :param str host: SMTP host
+    :param int port: SMTP port
+    """
+    if _originals:
+        return PooledSMTP(host, port, *args, **kwargs)
+    return smtplib.SMTP(host, port, *args, **kwargs)
+
+
+def _close_quietly(conn):
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+
+def keepalive():
+    """Check every pooled SMTP connection with NOOP and drop the dead ones,
+    so that they are reopened the next time they are needed
+
+    :return int: Number of connections dropped
+    """
+    dropped = 0
+    for key, conn in list(_smtp_connections.items()):
+        try:
+            status = conn.noop()[0]
+        except (smtplib.SMTPException, OSError):
+            status = None
+        if status != 250:
+            _close_quietly(conn)
+            del _smtp_connections[key]
+            dropped += 1
+    return dropped
+
+
+def install():
+    """Route new Elasticsearch clients and SMTP connections through the shared
+    pools above, and cache parsed config files"""
+    if _originals:
+        return
+    from gracc_reporting import TextUtils
+
+    _originals['Elasticsearch'] = ReportUtils.Elasticsearch
+    _originals['TextUtils.smtplib'] = TextUtils.smtplib
+    _originals['_parse_config'] = ReportUtils.Reporter.__dict__['_parse_config']
+
+    ReportUtils.Elasticsearch = shared_elasticsearch
+    TextUtils.smtplib = _PooledSMTPLib()
+    ReportUtils.Reporter._parse_config = staticmethod(Cache.parse_config)
+
+
+def uninstall():
+    """Restore the original factories and close all pooled connections"""
+    if not _originals:
+        return
+    from gracc_reporting import TextUtils
+
+    ReportUtils.Elasticsearch = _originals.pop('Elasticsearch')
+    TextUtils.smtplib = _originals.pop('TextUtils.smtplib')
+    ReportUtils.Reporter._parse_config = _originals.pop('_parse_config')
+
+    for conn in _smtp_connections.values():
+        _close_quietly(conn)
+    _smtp_connections.clear()
+
+    for client in _es_clients.values():
+        try:
+            client.close()
+        except Exception:
+            pass
+    _es_clients.clear()
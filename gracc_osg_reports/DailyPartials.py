@@ -0,0 +1,239 @@
+"""Per-day partial sums, so that a report over a long range only asks
+Elasticsearch about the days it hasn't seen yet.
+
+The per site, project, flocking and missing VO reports are all sums of
+CoreHours over some set of keys (site, VO, project, ...) and a time range.
+With a [partials] section in the config file, these reports get their sums
+from totals() below instead of one aggregation over the whole range:
+
+  - The range is cut into days.  A day starts at the time of day of the
+    report's start time (local midnight for most reports), so the days of
+    a month-to-date run line up with the days of the previous run.
+  - Days whose sums are already stored are read from disk.  The other days
+    are fetched with one composite aggregation per run of consecutive
+    missing days, with a date_histogram source in front of the report's key
+    sources.
+  - Complete days that ended more than settle_days ago are stored.  The
+    last, partial day, and days that may still get late records, are
+    fetched every time.
+  - The day sums are added up locally.
+
+So the month-end run of a month-to-date report queries one day, and adds it
+to the stored sums of the rest of the month.
+
+Stored sums are kept per report and per query: the directory name includes
+a hash of the search filters, key sources, metrics and day boundary, so a
+change to any of those starts a fresh set of partials.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from dateutil import tz
+
+DEFAULT_DIRNAME = 'gracc-osg-reports-partials'
+DEFAULT_SETTLE_DAYS = 2
+PAGE_SIZE = 1000
+DAY = datetime.timedelta(days=1)
+DAY_FMT = '%Y%m%dT%H%M%S'
+_SIGNATURE_TIME = datetime.datetime(2000, 1, 1, tzinfo=tz.tzutc())
+
+
+def enabled(config):
+    """:return bool: Whether the config file turns on partial sums"""
+    return 'partials' in config
+
+
+class DailyPartials(object):
+    """Store of per-day partial sums
+
+    :param str directory: Where to keep the day files
+    :param int settle_days: Days after which a day's records are assumed
+        complete, and its sums can be stored
+    :param int page_size: Composite aggregation page size
+    :param logging.Logger logger: Logger
+    """
+    def __init__(self, directory, settle_days=DEFAULT_SETTLE_DAYS,
+                 page_size=PAGE_SIZE, logger=None):
+        self.directory = directory
+        self.settle = datetime.timedelta(days=settle_days)
+        self.page_size = page_size
+        self.logger = logger if logger is not None \
+            else logging.getLogger(__name__)
+        self.queried_days = 0
+        self.stored_days = 0
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        """Store configured by the [partials] section of config.  The
+        directory defaults to one under default_logdir.
+
+        :param dict config: Parsed report config
+        :return DailyPartials:
+        """
+        section = config.get('partials', {})
+        directory = section.get('directory', os.path.join(
+            config.get('default_logdir', '/var/log'), DEFAULT_DIRNAME))
+        return cls(directory,
+                   settle_days=section.get('settle_days', DEFAULT_SETTLE_DAYS),
+                   page_size=section.get('page_size', PAGE_SIZE),
+                   logger=logger)
+
+    @staticmethod
+    def days(start, end):
+        """Cut [start, end) into days that start at start's time of day
+
+        :return list: (day start, day end) tuples.  The last one may be
+            shorter than a day.
+        """
+        result = []
+        day = start
+        while day < end:
+            result.append((day, min(day + DAY, end)))
+            day += DAY
+        return result
+
+    def _cachedir(self, name, base, sources, metrics, start):
+        """Directory for one report's query and day boundary"""
+        offset = int((start - start.replace(hour=0, minute=0, second=0,
+                                            microsecond=0)).total_seconds())
+        signature = json.dumps([base(_SIGNATURE_TIME, _SIGNATURE_TIME).to_dict(),
+                                sources, list(metrics), offset],
+                               sort_keys=True, default=str)
+        digest = hashlib.sha1(signature.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.directory, '{0}-{1}'.format(name, digest))
+
+    @staticmethod
+    def _dayfile(cachedir, day):
+        return os.path.join(cachedir, day.astimezone(tz.tzutc()).strftime(
+            DAY_FMT) + '.json.gz')
+
+    def _load(self, path):
+        try:
+            with gzip.open(path, 'rt') as f:
+                return [(tuple(r[0]), r[1]) for r in json.load(f)['rows']]
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.warning("Ignoring unreadable partials file {0}: "
+                                "{1}".format(path, e))
+            return None
+
+    def _save(self, path, rows):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpname = path + '.tmp'
+        with gzip.open(tmpname, 'wt') as f:
+            json.dump({'rows': [[list(key), values] for key, values in rows]},
+                      f)
+        os.replace(tmpname, path)
+
+    def _query(self, run_query, base, sources, metrics, start, end):
+        """Fetch per-day sums for [start, end) with a composite aggregation
+        over the day and the key sources, one page at a time
+
+        :return dict: day start (UTC datetime) -> list of (key, values)
+        """
+        offset = int((start - start.replace(hour=0, minute=0, second=0,
+                                            microsecond=0)).total_seconds())
+        daysource = {'day': {'date_histogram': {
+            'field': 'EndTime', 'fixed_interval': '1d',
+            'offset': '+{0}s'.format(offset)}}}
+        names = [list(source)[0] for source in sources]
+
+        result = {}
+        after = None
+        while True:
+            s = base(start, end)
+            params = {'sources': [daysource] + list(sources),
+                      'size': self.page_size}
+            if after is not None:
+                params['after'] = after
+            bucket = s.aggs.bucket('partial_rows', 'composite', **params)
+            for metric in metrics:
+                bucket.metric(metric, 'sum', field=metric)
+
+            # Item access only, for plain dict responses too
+            page = run_query(lambda: s)['partial_rows']
+            for b in page['buckets']:
+                day = datetime.datetime.fromtimestamp(b['key']['day'] / 1000.,
+                                                      tz.tzutc())
+                key = tuple(b['key'][name] for name in names)
+                values = [b[metric]['value'] for metric in metrics] + \
+                         [b['doc_count']]
+                result.setdefault(day, []).append((key, values))
+
+            if 'after_key' not in page or not page['buckets']:
+                break
+            after = dict(page['after_key'])
+        return result
+
+    def totals(self, name, run_query, base, sources, start, end,
+               metrics=('CoreHours',), now=None):
+        """Sums of metrics (and the record count) per key over [start, end)
+
+        :param str name: Report name, for the cache directory
+        :param function run_query: Called with a zero-argument function that
+            returns a Search; returns its aggregations (OSGReporter.run_query)
+        :param function base: Called with (start, end); returns the report's
+            Search for that range, with filters but no aggregations
+        :param list sources: Composite aggregation key sources, e.g.
+            [{'VOName': {'terms': {'field': 'VOName'}}}]
+        :param datetime.datetime start: Start of range (timezone-aware)
+        :param datetime.datetime end: End of range (timezone-aware)
+        :param tuple metrics: Fields to sum
+        :param datetime.datetime now: Current time, for testing
+        :return dict: key tuple -> [metric sums..., record count]
+        """
+        now = now if now is not None else datetime.datetime.now(tz.tzutc())
+        cachedir = self._cachedir(name, base, sources, metrics, start)
+
+        stored = {}
+        missing = []
+        for day, dayend in self.days(start, end):
+            rows = None
+            if dayend - day == DAY:
+                path = self._dayfile(cachedir, day)
+                if os.path.exists(path):
+                    rows = self._load(path)
+            if rows is None:
+                missing.append((day, dayend))
+            else:
+                stored[day] = rows
+
+        # One query per run of consecutive missing days
+        runs = []
+        for day, dayend in missing:
+            if runs and runs[-1][1] == day:
+                runs[-1][1] = dayend
+            else:
+                runs.append([day, dayend])
+        self.logger.info("{0}: {1} days stored, {2} days to query in {3} "
+                         "searches".format(name, len(stored), len(missing),
+                                           len(runs)))
+
+        fetched = {}
+        for runstart, runend in runs:
+            fetched.update(self._query(run_query, base, sources, metrics,
+                                       runstart, runend))
+        self.queried_days += len(missing)
+
+        for day, dayend in missing:
+            rows = fetched.get(day.astimezone(tz.tzutc()), [])
+            stored[day] = rows
+            if dayend - day == DAY and dayend <= now - self.settle:
+                self._save(self._dayfile(cachedir, day), rows)
+                self.stored_days += 1
+
+        totals = {}
+        for rows in stored.values():
+            for key, values in rows:
+                try:
+                    current = totals[key]
+                except KeyError:
+                    totals[key] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        current[i] += value
+        return totals
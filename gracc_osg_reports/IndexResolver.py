@@ -0,0 +1,131 @@
+"""Concrete indices for a report's time range, instead of a wildcard pattern.
+
+The raw GRACC records are kept in date-suffixed indices (e.g.
+gracc.osg.raw3-2023.03), and an index pattern such as gracc.osg.raw-* fans a
+search out to the shards of every one of them, whatever the time range of the
+search.  With resolve_indices = true under [elasticsearch] in the config
+file, a report searches only the indices whose date suffix falls in its
+range:
+
+    [elasticsearch]
+        resolve_indices = true
+        index_slack_days = 1
+
+The indices that match the pattern are listed once, with the aliases that
+point to them, and kept in the 'indices' Cache.  An index is dated by its
+own name, or else by the name of one of its aliases, with a suffix of
+YYYY.MM.DD, YYYY.MM or YYYY (- also works as the separator); it covers that
+day, month or year.  Indices whose date can't be told are always searched.
+
+This assumes that a record is filed under the date of the field the report
+filters on.  index_slack_days widens the range on both sides, for records
+filed under a nearby date (time zones, late records); records filed further
+away are missed.
+
+A pattern without a wildcard (an index or alias name, such as
+gracc.osg.summary) is searched as is, and so is the whole pattern when the
+indices can't be listed or none of them is in range.
+"""
+
+import datetime
+import re
+
+from . import Cache
+
+DEFAULT_SLACK_DAYS = 1
+
+_date_suffix = re.compile(r'[-_.](\d{4})(?:[.-](\d{2})(?:[.-](\d{2}))?)?$')
+
+
+def enabled(config):
+    """:return bool: Whether the config file asks for indices to be
+    resolved"""
+    return bool(config.get('elasticsearch', {}).get('resolve_indices', False))
+
+
+def index_period(name):
+    """The time range covered by a date-suffixed index or alias
+
+    :param str name: Index or alias name
+    :return tuple: (start, end) datetime.datetime, or None if the name has no
+        date suffix
+    """
+    match = _date_suffix.search(name)
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    try:
+        if day is not None:
+            start = datetime.datetime(int(year), int(month), int(day))
+            return start, start + datetime.timedelta(days=1)
+        if month is not None:
+            start = datetime.datetime(int(year), int(month), 1)
+            if start.month == 12:
+                return start, start.replace(year=start.year + 1, month=1)
+            return start, start.replace(month=start.month + 1)
+        start = datetime.datetime(int(year), 1, 1)
+        return start, start.replace(year=start.year + 1)
+    except ValueError:
+        return None
+
+
+def list_indices(client, pattern):
+    """The indices that match a pattern, with their periods
+
+    :param client: elasticsearch.Elasticsearch client
+    :param str pattern: Index pattern
+    :return dict: Index name -> (start, end), or None if the period isn't
+        known
+    """
+    indices = {}
+    for index, info in client.indices.get_alias(index=pattern).items():
+        period = index_period(index)
+        for alias in sorted(info.get('aliases', {})):
+            if period is not None:
+                break
+            period = index_period(alias)
+        indices[index] = period
+    return indices
+
+
+def _naive_utc(when):
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return when
+
+
+def resolve(client, host, pattern, start, end, slack_days=DEFAULT_SLACK_DAYS,
+            logger=None):
+    """The indices to search for [start, end)
+
+    :param client: elasticsearch.Elasticsearch client
+    :param str host: Elasticsearch host, to key the cached index list
+    :param str pattern: Index pattern
+    :param datetime.datetime start: Start of range
+    :param datetime.datetime end: End of range
+    :param float slack_days: Days to widen the range by on each side
+    :param logging.Logger logger: Logger for lookup failures
+    :return: Sorted list of index names, or pattern
+    """
+    if '*' not in pattern:
+        return pattern
+
+    def load():
+        try:
+            return list_indices(client, pattern)
+        except Exception as e:
+            if logger is not None:
+                logger.warning("Could not list the indices of {0}, searching "
+                               "all of them: {1}".format(pattern, e))
+            return None
+
+    indices = Cache.get_cache('indices').get((host, pattern), load)
+    if not indices:
+        return pattern
+
+    slack = datetime.timedelta(days=slack_days)
+    start, end = _naive_utc(start) - slack, _naive_utc(end) + slack
+    selected = sorted(index for index, period in indices.items()
+                      if period is None or
+                      (period[0] < end and period[1] > start))
+    return selected or pattern
@@ -1,16 +1,18 @@
 import os
 import traceback
-import smtplib
 import email.utils
 from email.mime.text import MIMEText
 import sys
 import copy
 import argparse
 
-from elasticsearch_dsl import Search
+from elasticsearch_dsl import Q
 
 from gracc_reporting import ReportUtils
 from .ProjectNameCollector import ProjectNameCollector
+from . import Connections, ResponseFilter
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
+from .ProjectQueryPlanner import base_search, probe_list
 
 
 MAXINT = 2**31 - 1
@@ -22,17 +24,22 @@ def parse_report_args():
     Specific argument parser for this report.
     :return: Namespace of parsed arguments
     """
-    parser = argparse.ArgumentParser(parents=[ReportUtils.get_report_parser()])
+    parser = argparse.ArgumentParser(parents=[get_report_parser(no_row_cap=True,
+                                                              no_backfill=True)])
     parser.add_argument("-r", "--report-type", dest="report_type",
                         type=str, help="Report type (OSG, XD, or OSG-Connect")
     return parser.parse_args()
 
 
-class MissingProjectReport(ReportUtils.Reporter):
+class MissingProjectReport(OSGReporter):
     """
     Class to hold information for and to run OSG Missing Projects Report 
     :param: 
     """
+    fusion_consumer = 'missing_project'
+    snapshot_keys = ['RawProjectName', 'ProbeName', 'CommonName', 'VOName']
+    response_fields = ResponseFilter.FIELDS
+
     def __init__(self, report_type, config_file, start, end=None, **kwargs):
 
         super(MissingProjectReport, self).__init__(report_type=report_type, 
@@ -62,34 +69,48 @@ class MissingProjectReport(ReportUtils.Reporter):
 
         :return elasticsearch_dsl.Search: Search object containing ES query
         """
-
-        # Gather parameters, format them for the query
-        starttimeq = self.start_time.isoformat()
-        endtimeq = self.end_time.isoformat()
-
-        probes = self.config['project'][self.report_type.lower()]['probe_list']
+        probes = probe_list(self.config, self.report_type)
 
         if self.verbose:
             print(probes)
-        s = Search(using=self.client, index=self.indexpattern) \
-                .filter("range", EndTime={"gte": starttimeq, "lt": endtimeq}) \
-                .filter("range", WallDuration={"gt": 0}) \
-                .filter("terms", ProbeName=probes) \
-                .filter("term", ResourceType="Payload") \
-                .filter("exists", field="RawProjectName")[0:0]
+        s = base_search(self.client, self.indices(), self.start_time,
+                        self.end_time, probes) \
+            .filter(self.fusion_filter())
+
+        self.add_aggs(s.aggs)
+
+        return s
+
+    def fusion_filter(self):
+        """Extra filter for this report's part of a fused project query
+
+        :return elasticsearch_dsl.query.Query: Filter
+        """
+        return Q("exists", field="RawProjectName")
 
+    def add_aggs(self, aggs):
+        """Add this report's bucket and metric aggregations
+
+        :param aggs: Search.aggs, or the bucket to add them under
+        :return None
+        """
         self.unique_terms = ['OIM_PIName', 'RawProjectName', 'ProbeName',
                  'CommonName', 'VOName']
         self.metrics = ['CoreHours']
 
-        curBucket = s.aggs.bucket("OIM_PIName", "missing", field="OIM_PIName")
+        curBucket = aggs.bucket("OIM_PIName", "missing", field="OIM_PIName")
 
         for term in self.unique_terms[1:]:
             curBucket = curBucket.bucket(term, "terms", field=term, size=MAXINT)
 
         curBucket.metric(self.metrics[0], 'sum', field=self.metrics[0])
 
-        return s
+    def pending_searches(self):
+        """The report's only search, which can be run ahead of time
+
+        :return list: elasticsearch_dsl.Search objects
+        """
+        return [self.query()]
 
     def generate(self):
         """Higher-level method that calls the lower-level functions
@@ -127,7 +148,7 @@ class MissingProjectReport(ReportUtils.Reporter):
                     if index == (len(unique_terms) - 1):
                         # reached the end of the unique terms
                         for metric in metrics:
-                            nowData[metric] = bucket[metric].value
+                            nowData[metric] = bucket[metric]['value']
                             # Add the doc count
                         nowData["Count"] = bucket['doc_count']
                         data.append(nowData)
@@ -135,13 +156,16 @@ class MissingProjectReport(ReportUtils.Reporter):
                         recurseBucket(nowData, bucket, index + 1, data)
 
         data = []
-        recurseBucket({}, results.OIM_PIName, 1, data)
+        recurseBucket({}, results['OIM_PIName'], 1, data)
         if self.verbose:
             self.logger.info(data)
 
         if len(data) == 1 and not data[0]:  # No data.
             return
 
+        if self.changes_only or 'snapshots' in self.config or self.sinks:
+            data = self._table_data(data)
+
         # Check the missing projects
         for item in data:
             self._check_project(item)
@@ -153,6 +177,27 @@ class MissingProjectReport(ReportUtils.Reporter):
                 self.send_email(xd_admins=group[1])
                 os.unlink(group[0])
 
+    def _table_data(self, data):
+        """Keep the missing projects in the SnapshotStore, and write them to
+        the sinks.  With changes_only, drop the ones that are unchanged since
+        the previous snapshot.
+
+        :param list data: dicts of aggregated data about missing projects
+        :return list: dicts to check and report on
+        """
+        import pandas as pd
+
+        columns = self.snapshot_keys + self.metrics + ['Count']
+        frame = pd.DataFrame(data, columns=columns)
+        if self.changes_only or 'snapshots' in self.config:
+            frame = self.snapshot(frame)
+        if self.sinks:
+            self._write_sinks(self._content_rows(frame, columns), columns)
+        # Fields that a record didn't have are left out again, so that
+        # _write_noname_message still reports them as "not reported"
+        return [{k: v for k, v in item.items() if v == v and v is not None}
+                for item in frame.to_dict('records')]
+
     def _check_osg_or_osg_connect(self, data):
         """
         Checks to see if data describing project is OSG's responsibility to
@@ -269,7 +314,7 @@ class MissingProjectReport(ReportUtils.Reporter):
             return
 
         try:
-            smtpObj = smtplib.SMTP(self.email_info['smtphost'])
+            smtpObj = Connections.SMTP(self.email_info['smtphost'])
         except Exception as e:
             self.logger.error(e)
             return
@@ -292,7 +337,7 @@ class MissingProjectReport(ReportUtils.Reporter):
                                               self.email_info['from']['email']))
 
         try:
-            smtpObj = smtplib.SMTP(self.email_info["smtphost"])
+            smtpObj = Connections.SMTP(self.email_info["smtphost"])
             smtpObj.sendmail(
                 self.email_info['from']['email'],
                 self.email_info['to']['email'],
@@ -333,10 +378,8 @@ def main():
                                  config_file=args.config,
                                  start=args.start,
                                  end=args.end,
-                                 verbose=args.verbose,
-                                 is_test=args.is_test,
-                                 no_email=args.no_email,
-                                 logfile=logfile_fname)
+                                 logfile=logfile_fname,
+                                 **report_kwargs(args))
         r.run_report()
         r.logger.info("OSG Missing Project Report executed successfully")
     except Exception as e:
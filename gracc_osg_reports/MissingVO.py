@@ -4,29 +4,35 @@ import sys
 import copy
 from collections import defaultdict
 import argparse
-import requests
 import xml.etree.ElementTree as ET
 
 from elasticsearch_dsl import Search
 
 from gracc_reporting import ReportUtils
 
+from . import Backfill, Cache, ResponseFilter
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
+
 LOGFILE = 'osgprojectreporter.log'
 MAXINT = 2**31 - 1
 
 
 # Helper Functions
 def key_to_lower(bucket):
-    return bucket.key.lower()
+    return bucket['key'].lower()
 
 
-class MissingVOReporter(ReportUtils.Reporter):
+class MissingVOReporter(OSGReporter):
     """Class to hold the information for and run the OSG Project Report
 
     :param str config_file: Configuration file
     :param str start: Start time for report range
     :param str end: End time for report range
     """
+    snapshot_keys = ["VO Name", "Reporting Probe"]
+    response_fields = ResponseFilter.FIELDS
+    summary_rows = 1        # Total
+
     def __init__(self, config_file, start, end=None, **kwargs):
         report = 'missingvo'
         super(MissingVOReporter, self).__init__(report_type=report, 
@@ -36,6 +42,7 @@ class MissingVOReporter(ReportUtils.Reporter):
                                           **kwargs)
         self.header = ["VO Name", "Reporting Probe", "Core Hours"]
         self.title = "Missing VO Report"
+        self.authoritative_vos = None
 
     def run_report(self):
         """Higher level method to handle the process flow of the report
@@ -47,19 +54,11 @@ class MissingVOReporter(ReportUtils.Reporter):
 
         :return elasticsearch_dsl.Search: Search object containing ES query
         """
-        # Gather parameters, format them for the query
-        starttimeq = self.start_time.isoformat()
-        endtimeq = self.end_time.isoformat()
-
         if self.verbose:
             self.logger.info(self.indexpattern)
 
         # Elasticsearch query and aggregations
-        s = Search(using=self.client, index=self.indexpattern) \
-                .filter("range", EndTime={"gte": starttimeq, "lt": endtimeq}) \
-                .filter("range", WallDuration={"gt": 0}) #\
-                #.filter("term", ResourceType="Batch")[0:0]
-        # Size 0 to return only aggregations
+        s = self._base_search(self.start_time, self.end_time)
         # Bucket, metric aggs
         Bucket = s.aggs.bucket("VOName", "terms", field="VOName",
                                size=MAXINT, order={"_term":"asc"},
@@ -70,10 +69,43 @@ class MissingVOReporter(ReportUtils.Reporter):
 
         return s
 
+    def _base_search(self, start, end):
+        """The report's search over [start, end), without aggregations"""
+        # Registered VOs are excluded by Elasticsearch, so that the buckets
+        # (and the ProbeName sub-aggregations) are only built for the few
+        # VOs this report is about
+        if self.authoritative_vos is None:
+            self.authoritative_vos = self.getAuthortativeVOs()
+
+        s = Search(using=self.client, index=self.indices(start, end)) \
+                .filter("range", EndTime={"gte": start.isoformat(),
+                                          "lt": end.isoformat()}) \
+                .filter("range", WallDuration={"gt": 0}) \
+                .exclude("terms", VOName=sorted(self.authoritative_vos))[0:0] #\
+                #.filter("term", ResourceType="Batch")[0:0]
+        # Size 0 to return only aggregations
+        return s
+
+    def pending_searches(self):
+        """The report's only search, which can be run ahead of time
+
+        :return list: elasticsearch_dsl.Search objects
+        """
+        return [] if self.use_partials() else [self.query()]
+
     def generate_report_file(self):
         """Takes data from query response and parses it to send to other
         functions for processing"""
+        if self.use_partials():
+            for row in self._partial_rows():
+                yield row
+            return
+
         results = self.run_query()
+        # Registered VOs are left out by the query, so no buckets means
+        # every VO was registered
+        if not results['VOName']['buckets']:
+            return
 
         unique_terms = ['VOName', 'ProbeName']
         metrics = ['CoreHours']
@@ -105,7 +137,7 @@ class MissingVOReporter(ReportUtils.Reporter):
                     if index == (len(unique_terms) - 1):
                         # reached the end of the unique terms
                         for metric in metrics:
-                            nowData[metric] = bucket[metric].value
+                            nowData[metric] = bucket[metric]['value']
                             # Add the doc count
                         nowData["Count"] = bucket['doc_count']
                         data.append(nowData)
@@ -120,11 +152,40 @@ class MissingVOReporter(ReportUtils.Reporter):
         for entry in data:
             yield [entry[field] for field in allterms]
 
+    def _partial_rows(self):
+        """The rows of generate_report_file, from the daily partial sums (see
+        DailyPartials)
+
+        Yields [VO, probe, CoreHours] lists
+        """
+        sources = [{'VOName': {'terms': {'field': 'VOName',
+                                         'missing_bucket': True}}},
+                   {'ProbeName': {'terms': {'field': 'ProbeName',
+                                            'missing_bucket': True}}}]
+        rows = defaultdict(float)
+        for (vo, probe), (corehours, _) in self.partial_totals(
+                self._base_search, sources).items():
+            rows[(vo if vo is not None else 'UNKNOWN',
+                  probe if probe is not None else 'UNKNOWN')] += corehours
+
+        # Same order as the nested terms aggregations, sorted by
+        # sorted_buckets(key=key_to_lower) at each level
+        for vo, probe in sorted(rows, key=lambda k: (k[0].lower(), k[0],
+                                                      k[1].lower(), k[1])):
+            yield [vo, probe, rows[(vo, probe)]]
+
     def getAuthortativeVOs(self):
+        """Get the registered VOs from Topology.  The XML is kept in the
+        'topology' cache.
+
+        :return dict: Lowercased VO names
+        """
+        import requests
 
         oim_url = self.config['missingvo']['vo_oim_url']
-        full_xml = requests.get(oim_url)
-        tree = ET.fromstring(full_xml.text.encode('utf-8'))
+        xml_text = Cache.get_cache('topology').get(
+            oim_url, lambda: requests.get(oim_url).text.encode('utf-8'))
+        tree = ET.fromstring(xml_text)
         vos = {}
         #root = tree.getroot()
         for vo_elt in tree.findall('./VO/Name'):
@@ -141,7 +202,9 @@ class MissingVOReporter(ReportUtils.Reporter):
         :return dict: Constructed dict of report information for
         Reporter.send_report to send report from"""
         report = defaultdict(list)
-        authortative_vos = self.getAuthortativeVOs()
+        if self.authoritative_vos is None:
+            self.authoritative_vos = self.getAuthortativeVOs()
+        authortative_vos = self.authoritative_vos
 
         for result_list in self.generate_report_file():
 
@@ -155,7 +218,8 @@ class MissingVOReporter(ReportUtils.Reporter):
             for key, item in mapdict.items():
                 report[key].append(item)
 
-        
+        report = self.snapshot(report)
+
         tot = sum(report['Core Hours'])
         for field in self.header:
             if field == 'VO Name':
@@ -174,18 +238,21 @@ class MissingVOReporter(ReportUtils.Reporter):
 
 
 def main():
-    args = ReportUtils.get_report_parser().parse_args()
+    parser = get_report_parser()
+    args = parser.parse_args()
+    Backfill.check_args(parser, args)
     logfile_fname = args.logfile if args.logfile is not None else LOGFILE
 
+    if args.backfill:
+        sys.exit(Backfill.run('osgmissingvo', args, logfile_fname))
+
     #try:
     r = MissingVOReporter(config_file=args.config,
                     start=args.start,
                     end=args.end,
-                    verbose=args.verbose,
-                    is_test=args.is_test,
-                    no_email=args.no_email,
                     logfile=logfile_fname,
-                    template=args.template)
+                    template=args.template,
+                    **report_kwargs(args))
     r.run_report()
     r.logger.info("OSG Missing VO Report executed successfully")
 
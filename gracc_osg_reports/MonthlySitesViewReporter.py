@@ -1,18 +1,18 @@
-import re
 import traceback
 import sys
 import copy
-from collections import defaultdict
 import argparse
-import pandas as pd
-import numpy as np
 import datetime
 import calendar
-import dateutil.parser
+
+# pandas and numpy are imported where they are used, so that importing this
+# module (e.g. for --help) stays cheap.
 
 from elasticsearch_dsl import Search
 
 from gracc_reporting import ReportUtils
+from . import Backfill, ResponseFilter
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
 
 LOGFILE = 'osgmonthlysites.log'
 MAXINT = 2**31 - 1
@@ -20,7 +20,7 @@ MAXINT = 2**31 - 1
 
 # Helper Functions
 def key_to_lower(bucket):
-    return bucket.key.lower()
+    return bucket['key'].lower()
 
 
 def parse_report_args():
@@ -28,11 +28,13 @@ def parse_report_args():
     Specific argument parser for this report.
     :return: Namespace of parsed arguments
     """
-    parser = argparse.ArgumentParser(parents=[ReportUtils.get_report_parser()])
-    return parser.parse_args()
+    parser = argparse.ArgumentParser(parents=[get_report_parser()])
+    args = parser.parse_args()
+    Backfill.check_args(parser, args)
+    return args
 
 
-class OSGMonthlySitesViewReporter(ReportUtils.Reporter):
+class OSGMonthlySitesViewReporter(OSGReporter):
     """Class to hold the information for and run the OSG Project Report
 
     :param str report_type: OSG, XD. or OSG-Connect
@@ -41,6 +43,8 @@ class OSGMonthlySitesViewReporter(ReportUtils.Reporter):
     :param str end: End time for report range
     :param bool isSum: Show a total line at bottom of report, defaults to True
     """
+    response_fields = ResponseFilter.FIELDS + ['key_as_string']
+
     def __init__(self, config_file, start, end=None,
                  **kwargs):
 
@@ -92,9 +96,10 @@ class OSGMonthlySitesViewReporter(ReportUtils.Reporter):
     def generate_report_file(self):
         """Takes data from query response and parses it to send to other
         functions for processing"""
-        
+        import numpy as np
+        import pandas as pd
 
-        response = self.query().execute()
+        results = self.run_query()
 
         unique_terms = ["EndTime", "OIM_Site", "VOName"]
         metrics = ["CoreHours"]
@@ -126,7 +131,7 @@ class OSGMonthlySitesViewReporter(ReportUtils.Reporter):
                     if index == (len(unique_terms) - 1):
                         # reached the end of the unique terms
                         for metric in metrics:
-                            nowData[metric] = bucket[metric].value
+                            nowData[metric] = bucket[metric]['value']
                             # Add the doc count
                         nowData["Count"] = bucket['doc_count']
                         data.append(nowData)
@@ -135,7 +140,7 @@ class OSGMonthlySitesViewReporter(ReportUtils.Reporter):
 
 
         df = pd.DataFrame()
-        for month in response.aggregations['EndTime']['buckets']:
+        for month in results['EndTime']['buckets']:
             data = []
             recurseBucket({"EndTime": month['key_as_string']}, month, 1, data)
             temp_df = pd.DataFrame(data)
@@ -190,15 +195,16 @@ def main():
     args = parse_report_args()
     logfile_fname = args.logfile if args.logfile is not None else LOGFILE
 
+    if args.backfill:
+        sys.exit(Backfill.run('monthlysites', args, logfile_fname))
+
     try:
         r = OSGMonthlySitesViewReporter(config_file=args.config,
                         start=args.start,
                         end=args.end,
-                        verbose=args.verbose,
-                        is_test=args.is_test,
-                        no_email=args.no_email,
                         logfile=logfile_fname,
-                        template=args.template)
+                        template=args.template,
+                        **report_kwargs(args))
         r.run_report()
         r.logger.info("OSG Project Report executed successfully")
 
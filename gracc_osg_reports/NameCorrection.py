@@ -1,8 +1,6 @@
 from xml.etree import ElementTree as ET
 import re
 
-import requests
-
 mwt2info = {}
 
 
@@ -22,6 +20,8 @@ class MWT2Correction(object):
         """
         Get the XML file from OIM
         """
+        import requests
+
         r = requests.get(self.mwt2url)
         if not r.status_code == requests.codes.ok:
             raise Exception("Unable to get MWT2 info from OIM")
@@ -1,25 +1,31 @@
 import datetime
 import traceback
 import sys
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import argparse
 
 from elasticsearch_dsl import Search
 
 from gracc_reporting import ReportUtils, TimeUtils
+from . import Backfill, ResponseFilter
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
 
 
 LOGFILE = 'osgflockingreport.log'
 MAXINT = 2**31 - 1
+PAGE_SIZE = 1000        # Rows per composite aggregation page
 
 
-class FlockingReport(ReportUtils.Reporter):
+class FlockingReport(OSGReporter):
     """Class to hold information for and to run OSG Flocking report
 
     :param str config_file: Report Configuration filename
     :param str start: Start time of report range
     :param str end: End time of report range
     """
+    response_fields = ResponseFilter.FIELDS
+    summary_rows = 1        # Total
+
     def __init__(self, config_file, start, end, **kwargs):
         report = 'Flocking'
 
@@ -39,57 +45,181 @@ class FlockingReport(ReportUtils.Reporter):
         being run"""
         self.send_report()
 
-    def query(self):
+    def query(self, after=None):
         """Method to query Elasticsearch cluster for Flocking Report
-        information
+        information.  The rows come from a composite aggregation over site,
+        VO, probe and project, one page at a time.
 
+        :param dict after: after_key of the previous page, None for the
+            first page
         :return elasticsearch_dsl.Search: Search object containing ES query
         """
-        # Gather parameters, format them for the query
-        starttimeq = self.start_time.isoformat()
-        endtimeq = self.end_time.isoformat()
-
         if self.verbose:
             self.logger.info(self.indexpattern)
 
-        probeslist = self.config[self.report_type.lower()]['probe_list']
-
         # Elasticsearch query and aggregations
-        s = Search(using=self.client, index=self.indexpattern) \
-                .filter("range", EndTime={"gte": starttimeq, "lt": endtimeq}) \
-                .filter("terms", ProbeName=probeslist)\
-                .filter("term", ResourceType="Payload")[0:0]
-        # Size 0 to return only aggregations
+        s = self._base_search(self.start_time, self.end_time)
 
-        # Bucket aggs
-        Bucket = s.aggs.bucket('group_Site', 'terms', field='SiteName', size=MAXINT) \
-            .bucket('group_VOName', 'terms', field='VOName', size=MAXINT) \
-            .bucket('group_ProbeName', 'terms', field='ProbeName', size=MAXINT) \
-            .bucket('group_ProjectName', 'terms', field='ProjectName', missing='N/A', size=MAXINT)
+        # Bucket aggs.  Records without a ProjectName get a null key, which
+        # _iter_buckets reports as N/A
+        params = {'sources': self._sources(), 'size': self.page_size()}
+        if after is not None:
+            params['after'] = after
+        Bucket = s.aggs.bucket('group_rows', 'composite', **params)
 
         # Metric aggs
         Bucket.metric("CoreHours_sum", "sum", field="CoreHours")
 
         return s
 
+    def _base_search(self, start, end):
+        """The report's search over [start, end), without aggregations"""
+        probeslist = self.config[self.report_type.lower()]['probe_list']
+
+        # Size 0 to return only aggregations
+        return Search(using=self.client, index=self.indices(start, end)) \
+                .filter("range", EndTime={"gte": start.isoformat(),
+                                          "lt": end.isoformat()}) \
+                .filter("terms", ProbeName=probeslist)\
+                .filter("term", ResourceType="Payload")[0:0]
+
+    @staticmethod
+    def _sources():
+        """Composite aggregation sources for the report rows"""
+        return [{'SiteName': {'terms': {'field': 'SiteName'}}},
+                {'VOName': {'terms': {'field': 'VOName'}}},
+                {'ProbeName': {'terms': {'field': 'ProbeName'}}},
+                {'ProjectName': {'terms': {'field': 'ProjectName',
+                                           'missing_bucket': True}}}]
+
+    def page_size(self):
+        """Number of rows to fetch per query.  Can be set with page_size in
+        the [flocking] section of the config file.
+
+        :return int: Composite aggregation size
+        """
+        return self.config[self.report_type.lower()].get('page_size',
+                                                         PAGE_SIZE)
+
+    def pending_searches(self):
+        """The report's first page of results, which can be run ahead of time
+
+        :return list: elasticsearch_dsl.Search objects
+        """
+        return [] if self.use_partials() else [self.query()]
+
+    def _iter_composite(self):
+        """Run the query page by page, and yield a row for each composite
+        bucket, in key order.  Only one page is held at a time.
+
+        Yields (site, VO, probe, project or None, CoreHours, doc_count)
+        tuples
+        """
+        after = None
+        while True:
+            results = self.run_query(overridequery=lambda: self.query(after))
+            page = results['group_rows']
+            for bucket in page['buckets']:
+                key = bucket['key']
+                yield (key['SiteName'], key['VOName'], key['ProbeName'],
+                       key['ProjectName'], bucket['CoreHours_sum']['value'],
+                       bucket['doc_count'])
+
+            if 'after_key' not in page or not page['buckets']:
+                break
+            after = dict(page['after_key'])
+
+    def _iter_partials(self):
+        """The rows of _iter_composite, in the same order, from the daily
+        partial sums (see DailyPartials)
+
+        Yields (site, VO, probe, project or None, CoreHours, doc_count)
+        tuples
+        """
+        totals = self.partial_totals(self._base_search, self._sources())
+        # Composite key order: the null project sorts first
+        for key in sorted(totals, key=lambda k: (k[:3], k[3] is not None,
+                                                 k[3] or '')):
+            yield key + tuple(totals[key])
+
+    def _iter_buckets(self):
+        """Yield a row for each site, VO, probe and project, in key order
+
+        Yields (site, VO, probe, project, CoreHours, doc_count) tuples
+        """
+        source = self._iter_partials() if self.use_partials() \
+            else self._iter_composite()
+        group, rows = None, OrderedDict()
+
+        # Rows come sorted by key, so all projects of a site/VO/probe are next
+        # to each other.  Merge the null project (records without a
+        # ProjectName) into N/A, like the terms aggregation's missing='N/A'
+        # used to.
+        for site, vo, probe, project, corehours, count in source:
+            if project is None:
+                project = 'N/A'
+            if (site, vo, probe) != group:
+                for row in rows.values():
+                    yield row
+                group = (site, vo, probe)
+                rows = OrderedDict()
+            if project in rows:
+                corehours += rows[project][4]
+                count += rows[project][5]
+            rows[project] = group + (project, corehours, count)
+
+        for row in rows.values():
+            yield row
+
+    def iter_rows(self):
+        """Stream the report rows in (site, VO, probe, project) order, one
+        page of results in memory at a time
+
+        Yields (site, VO, probe, project, CoreHours) tuples
+        """
+        for row in self._iter_buckets():
+            yield row[:5]
+
     def generate(self):
         """Higher-level generator method that calls the lower-level functions
-        to generate the raw data for this report.
+        to generate the raw data for this report.  Rows come in the same order
+        as the nested terms aggregations used to return them: at each level,
+        by record count (descending), then by name.
 
         Yields rows of raw data
         """
-        results = self.run_query()
-
-        # Iterate through the buckets to get our data, yield it
-        for site in results.group_Site.buckets:
-            sitekey = site.key
-            for vo in site.group_VOName.buckets:
-                vokey = vo.key
-                for probe in vo.group_ProbeName.buckets:
-                    probekey = probe.key
-                    projects = (project for project in probe.group_ProjectName.buckets)
-                    for project in projects:
-                        yield (sitekey, vokey, probekey, project.key, project.CoreHours_sum.value)
+        rows = list(self._iter_buckets())
+
+        # Record counts of each site, site/VO and site/VO/probe
+        counts = defaultdict(int)
+        for row in rows:
+            for level in (1, 2, 3):
+                counts[row[:level]] += row[5]
+
+        rows.sort(key=lambda row: (-counts[row[:1]], row[0],
+                                   -counts[row[:2]], row[1],
+                                   -counts[row[:3]], row[2],
+                                   -row[5], row[3]))
+        for row in rows:
+            yield row[:5]
+
+    def report_rows(self):
+        """Columns and rows for the streaming renderer (see --row-cap): the
+        report rows in (site, VO, probe, project) order straight from the
+        query pages, then the total.  Memory use stays bounded by the page
+        size, so unlike generate(), the rows are not sorted by record count.
+
+        :return tuple: (list of column names, iterable of row lists)
+        """
+        return self.header, self._iter_report_rows()
+
+    def _iter_report_rows(self):
+        """Yields the row lists of report_rows()"""
+        tot = 0
+        for row in self.iter_rows():
+            tot += row[4]
+            yield list(row)
+        yield ['', 'Total', '', '', tot]
 
     def format_report(self):
         """Report formatter.  Returns a dictionary called report containing the
@@ -123,19 +253,22 @@ class FlockingReport(ReportUtils.Reporter):
 
 
 def main():
-    args = ReportUtils.get_report_parser().parse_args()
+    parser = get_report_parser()
+    args = parser.parse_args()
+    Backfill.check_args(parser, args)
     logfile_fname = args.logfile if args.logfile is not None else LOGFILE
 
+    if args.backfill:
+        sys.exit(Backfill.run('osgflockingreport', args, logfile_fname))
+
     try:
         # Create an FlockingReport object, and run the report
         f = FlockingReport(config_file = args.config,
                            start=args.start,
                            end=args.end,
                            template=args.template,
-                           is_test=args.is_test,
-                           no_email=args.no_email,
-                           verbose=args.verbose,
-                           logfile=logfile_fname)
+                           logfile=logfile_fname,
+                           **report_kwargs(args))
 
         f.run_report()
         print("OSG Flocking Report execution successful")
@@ -1,3 +1,4 @@
+import argparse
 import traceback
 import sys
 import datetime
@@ -6,12 +7,34 @@ from collections import defaultdict
 from elasticsearch_dsl import Search
 
 from gracc_reporting import ReportUtils, TimeUtils
+from . import Backfill, ResponseFilter
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
 
 LOGFILE = 'osgpersitereport.log'
 OPPORTUNISTIC_VOS = ['glow', 'gluex', 'hcc', 'osg', 'sbgrid'] # Default if not specified in config
+SITE_SCRIPT = {"inline": "doc['OIM_Site'].value ?: doc['SiteName'].value",
+               "lang": "painless"}
+MAXINT = 2**31-1
 
 
 # Helper Functions
+def parse_report_args():
+    """
+    Specific argument parser for this report.
+    :return: Namespace of parsed arguments
+    """
+    parser = argparse.ArgumentParser(parents=[get_report_parser()])
+    parser.add_argument("--no-site-script", dest="site_script",
+                        action="store_false", default=None,
+                        help="Group by OIM_Site, and by SiteName for records "
+                             "without one, with plain terms aggregations "
+                             "instead of a painless script (see site_script "
+                             "in the config file)")
+    args = parser.parse_args()
+    Backfill.check_args(parser, args, monthly=True)
+    return args
+
+
 def monthrange(date):
     """
     Takes a start date and finds out the start and end of the month that that
@@ -139,15 +162,22 @@ class VO(object):
             self.total[key] += newhrs
 
 
-class OSGPerSiteReporter(ReportUtils.Reporter):
+class OSGPerSiteReporter(OSGReporter):
     """Class to store information and perform actions for the OSG Per Site
     Report
 
     :param str config_file: Report Configuration file
     :param str start: Start time of report range
     :param str end: End time of report range
+    :param bool site_script: Coalesce OIM_Site and SiteName with a painless
+        script in Elasticsearch (True), or with two terms aggregations merged
+        here (False).  None: site_script in the config file, default True.
     """
-    def __init__(self, config_file, start, end, **kwargs):
+    response_fields = ResponseFilter.FIELDS
+    # Blank line, Total, Prev. Month Total, Percent Change over Prev. Month
+    summary_rows = 4
+
+    def __init__(self, config_file, start, end, site_script=None, **kwargs):
 
         report = 'siteusage'
 
@@ -166,6 +196,10 @@ class OSGPerSiteReporter(ReportUtils.Reporter):
         self.title = 'VOs Usage of OSG Sites: {0} - {1}'.format(
             self.start_time.strftime(fmt), self.end_time.strftime(fmt))
         self.opp_vos = self.__get_opportunistic_vos()
+        if site_script is None:
+            site_script = self.config[self.report_type].get('site_script',
+                                                            True)
+        self.site_script = site_script
         self.current = True
         self.vodict = {}
         self.sitelist = []
@@ -192,42 +226,107 @@ class OSGPerSiteReporter(ReportUtils.Reporter):
 
         :return elasticsearch_dsl.Search: Search object containing ES query
         """
-        starttimeq = self.start_time.isoformat()
-        endtimeq = self.end_time.isoformat()
-
         if self.verbose:
             self.logger.info(self.indexpattern)
 
-        s = Search(using=self.client, index=self.indexpattern) \
-            .filter("range", EndTime={"gte": starttimeq, "lt": endtimeq}) \
-            .filter('term', ResourceType="Batch") \
-            .filter('term', Grid="OSG")[0:0]  # ignore 'Local' records
+        s = self._base_search(self.start_time, self.end_time)
+        vo_bucket = s.aggs.bucket('vo_bucket', 'terms', field='VOName',
+                                  size=MAXINT)
 
-        # Note:  Using ?: operator in painless language to coalesce the
-        # 'OIM_Site' and 'SiteName' fields.
-        s.aggs.bucket('vo_bucket', 'terms', field='VOName', size=2**31-1) \
-            .bucket('site_bucket', 'terms',
-                    script={"inline": "doc['OIM_Site'].value ?: doc['SiteName'].value", "lang": "painless"},
-                    size=2**31-1) \
-            .metric('sum_core_hours', 'sum', field='CoreHours')
+        if self.site_script:
+            # Note:  Using ?: operator in painless language to coalesce the
+            # 'OIM_Site' and 'SiteName' fields.
+            vo_bucket.bucket('site_bucket', 'terms', script=SITE_SCRIPT,
+                             size=MAXINT) \
+                .metric('sum_core_hours', 'sum', field='CoreHours')
+        else:
+            # The same coalescing without running a script per record:
+            # OIM_Site, plus SiteName for the records that have no OIM_Site.
+            # _site_buckets() merges the two.
+            vo_bucket.bucket('oim_site', 'terms', field='OIM_Site',
+                             size=MAXINT) \
+                .metric('sum_core_hours', 'sum', field='CoreHours')
+            vo_bucket.bucket('no_oim_site', 'missing', field='OIM_Site') \
+                .bucket('site_name', 'terms', field='SiteName', size=MAXINT) \
+                .metric('sum_core_hours', 'sum', field='CoreHours')
 
         return s
 
+    def _base_search(self, start, end):
+        """The report's search over [start, end), without aggregations"""
+        return Search(using=self.client, index=self.indices(start, end)) \
+            .filter("range", EndTime={"gte": start.isoformat(),
+                                      "lt": end.isoformat()}) \
+            .filter('term', ResourceType="Batch") \
+            .filter('term', Grid="OSG")[0:0]  # ignore 'Local' records
+
     def generate(self):
         """Higher-level method to run other methods to
         generate the raw data for the report."""
         consumer = self._create_vo_objects()
 
-        # Run our query twice - once for this month, once for last month
+        if self.use_partials():
+            self._generate_from_partials(consumer)
+            return
+
+        # Run our query twice - once for this month, once for last month.
+        # The two searches are independent, so they are executed together.
+        searches = []
         for self.start_time, self.end_time in (
                 monthrange(self.start_time),
                 prev_month_shift(self.start_time)):
-            results = self.run_query()
+            searches.append(self.query())
+
+        for results in self.run_queries(searches):
             self._parse_results(results, consumer)
             self.current = False
 
         return
 
+    def _generate_from_partials(self, consumer):
+        """generate(), with the sums of both months taken from the daily
+        partial sums (see DailyPartials)
+
+        :param function consumer: Consumer function to pass data to
+        """
+        if self.site_script:
+            sources = [{'VOName': {'terms': {'field': 'VOName'}}},
+                       {'site': {'terms': {'script': SITE_SCRIPT}}}]
+        else:
+            sources = [{'VOName': {'terms': {'field': 'VOName'}}},
+                       {'OIM_Site': {'terms': {'field': 'OIM_Site',
+                                               'missing_bucket': True}}},
+                       {'SiteName': {'terms': {'field': 'SiteName',
+                                               'missing_bucket': True}}}]
+        for start, end in (monthrange(self.start_time),
+                           prev_month_shift(self.start_time)):
+            totals = self.partial_totals(self._base_search, sources,
+                                         start=start, end=end)
+            if not self.site_script:
+                totals = self._coalesce_totals(totals)
+            for vo, site in sorted(totals):
+                consumer.send((vo.lower(), site, totals[(vo, site)][0]))
+            self.current = False
+
+    @staticmethod
+    def _coalesce_totals(totals):
+        """Merge partial totals keyed by (VOName, OIM_Site, SiteName) into
+        totals keyed by (VOName, OIM_Site or SiteName), like SITE_SCRIPT.
+        Records with neither are left out, as the script leaves them out.
+
+        :param dict totals: key tuple -> [CoreHours, record count]
+        :return dict: (VOName, site) -> [CoreHours, record count]
+        """
+        merged = {}
+        for (vo, oim_site, site_name), (hours, count) in totals.items():
+            site = oim_site if oim_site is not None else site_name
+            if site is None:
+                continue
+            total = merged.setdefault((vo, site), [0., 0])
+            total[0] += hours
+            total[1] += count
+        return merged
+
     @ReportUtils.coroutine
     def _create_vo_objects(self):
         """Coroutine to create the VO objects and store the information
@@ -253,14 +352,35 @@ class OSGPerSiteReporter(ReportUtils.Reporter):
         :param Response.aggregations results: ES Response object from ES query
         :param function consumer: Consumer function to pass data to
         """
-        for vo_bucket in results.vo_bucket.buckets:
+        for vo_bucket in results['vo_bucket']['buckets']:
             vo = vo_bucket['key'].lower()
-            for site_bucket in vo_bucket.site_bucket.buckets:
-                site = site_bucket['key']
-                wallhrs = site_bucket['sum_core_hours']['value']
+            for site, wallhrs in OSGPerSiteReporter._site_buckets(vo_bucket):
                 consumer.send((vo, site, wallhrs))
         return
 
+    @staticmethod
+    def _site_buckets(vo_bucket):
+        """Sites and their core hours under one VO bucket, from either form
+        of the query.  Without the script, the OIM_Site and SiteName buckets
+        are merged, and put in the order the script's terms aggregation
+        would have returned them: by record count, then by name.
+
+        :param vo_bucket: VO bucket of the response
+        :return list: (site, core hours) tuples
+        """
+        if 'site_bucket' in vo_bucket:
+            return [(b['key'], b['sum_core_hours']['value'])
+                    for b in vo_bucket['site_bucket']['buckets']]
+
+        merged = {}
+        for b in list(vo_bucket['oim_site']['buckets']) + \
+                list(vo_bucket['no_oim_site']['site_name']['buckets']):
+            count, hours = merged.get(b['key'], (0, 0.))
+            merged[b['key']] = (count + b['doc_count'],
+                                hours + b['sum_core_hours']['value'])
+        return [(site, hours) for site, (count, hours)
+                in sorted(merged.items(), key=lambda i: (-i[1][0], i[0]))]
+
     def format_report(self):
         """Report formatter.  Returns a dictionary called report containing the
         columns of the report.
@@ -371,9 +491,13 @@ class OSGPerSiteReporter(ReportUtils.Reporter):
 
 
 def main():
-    args = ReportUtils.get_report_parser().parse_args()
+    args = parse_report_args()
     logfile_fname = args.logfile if args.logfile is not None else LOGFILE
 
+    if args.backfill:
+        sys.exit(Backfill.run('osgpersitereport', args, logfile_fname,
+                              options={'site_script': args.site_script}))
+
     if args.end is not None:
         try:
             assert [d.date() for d in 
@@ -394,10 +518,9 @@ def main():
                                        start=start,
                                        end=end,
                                        template=args.template,
-                                       verbose=args.verbose,
-                                       is_test=args.is_test,
-                                       no_email=args.no_email,
-                                       logfile=logfile_fname)
+                                       site_script=args.site_script,
+                                       logfile=logfile_fname,
+                                       **report_kwargs(args))
 
         osgreport.run_report()
         print('OSG Per Site Report Execution finished')
@@ -5,9 +5,13 @@ import copy
 from collections import defaultdict
 import argparse
 
-from elasticsearch_dsl import Search
+from elasticsearch_dsl import Q
 
 from gracc_reporting import ReportUtils
+from . import Backfill, ResponseFilter
+from .OSGReporter import OSGReporter, get_report_parser, prefetch, \
+    report_kwargs
+from .ProjectQueryPlanner import base_search, probe_list
 
 LOGFILE = 'osgprojectreporter.log'
 MAXINT = 2**31 - 1
@@ -15,7 +19,7 @@ MAXINT = 2**31 - 1
 
 # Helper Functions
 def key_to_lower(bucket):
-    return bucket.key.lower()
+    return bucket['key'].lower()
 
 
 def parse_report_args():
@@ -23,15 +27,21 @@ def parse_report_args():
     Specific argument parser for this report.
     :return: Namespace of parsed arguments
     """
-    parser = argparse.ArgumentParser(parents=[ReportUtils.get_report_parser()])
+    parser = argparse.ArgumentParser(parents=[get_report_parser()])
     parser.add_argument("-r", "--report-type", dest="report_type",
-                        type=str, help="Report type (OSG, XD. or OSG-Connect")
+                        type=str, help="Report type (OSG, XD. or OSG-Connect).  "
+                        "Several comma-separated types share one query")
     parser.add_argument('--nosum', dest="isSum", action='store_false',
                         help="Do not show a total line")
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.report_type:
+        parser.error("Give the report type(s) with -r (OSG, XD or "
+                     "OSG-Connect)")
+    Backfill.check_args(parser, args)
+    return args
 
 
-class OSGProjectReporter(ReportUtils.Reporter):
+class OSGProjectReporter(OSGReporter):
     """Class to hold the information for and run the OSG Project Report
 
     :param str report_type: OSG, XD. or OSG-Connect
@@ -40,6 +50,9 @@ class OSGProjectReporter(ReportUtils.Reporter):
     :param str end: End time for report range
     :param bool isSum: Show a total line at bottom of report, defaults to True
     """
+    fusion_consumer = 'project'
+    response_fields = ResponseFilter.FIELDS
+
     def __init__(self, report_type, config_file, start, end=None, isSum=True,
                  **kwargs):
 
@@ -49,11 +62,16 @@ class OSGProjectReporter(ReportUtils.Reporter):
                                           end=end, 
                                           **kwargs)
         self.isSum = isSum
+        self.summary_rows = 1 if isSum else 0
         self.report_type = self._validate_report_type(report_type)
         self.header = ["Project Name", "PI", "Institution", "Field of Science",
                      "Wall Hours"]
         self.logger.info("Report Type: {0}".format(self.report_type))
         self.tgmatch = re.compile('TG-')
+        if self.use_partials():
+            # Sums come from DailyPartials, not from a search that could be
+            # fused with others
+            self.fusion_consumer = None
 
     def run_report(self):
         """Higher level method to handle the process flow of the report
@@ -65,44 +83,70 @@ class OSGProjectReporter(ReportUtils.Reporter):
 
         :return elasticsearch_dsl.Search: Search object containing ES query
         """
-        # Gather parameters, format them for the query
-        starttimeq = self.start_time.isoformat()
-        endtimeq = self.end_time.isoformat()
-
-        probes = self.config['project'][self.report_type.lower()]['probe_list']
-
         if self.verbose:
-            self.logger.debug(probes)
+            self.logger.debug(probe_list(self.config, self.report_type))
             self.logger.info(self.indexpattern)
 
         # Elasticsearch query and aggregations
-        s = Search(using=self.client, index=self.indexpattern) \
-                .filter("range", EndTime={"gte": starttimeq, "lt": endtimeq}) \
-                .filter("range", WallDuration={"gt": 0}) \
-                .filter("terms", ProbeName=probes) \
-                .filter("term", ResourceType="Payload")[0:0]
+        s = self._base_search(self.start_time, self.end_time)
         # Size 0 to return only aggregations
-        # Bucket, metric aggs
-        Bucket = s.aggs.bucket("ProjectName", "terms", field="ProjectName",
-                               size=MAXINT, order={"_term":"asc"},
-                               missing="UNKNOWN")\
+        self.add_aggs(s.aggs)
+
+        return s
+
+    def _base_search(self, start, end):
+        """The report's search over [start, end), without aggregations"""
+        return base_search(self.client, self.indices(start, end), start, end,
+                           probe_list(self.config, self.report_type)) \
+            .filter(self.fusion_filter())
+
+    def fusion_filter(self):
+        """Only "TG-" projects for the XD report, and only non-"TG-" projects
+        for the others.  Same split as _validate_type_results, but done by
+        Elasticsearch, so that it doesn't build sub-aggregations for projects
+        that would be thrown away.
+
+        :return elasticsearch_dsl.query.Query: Filter
+        """
+        tg = Q('prefix', ProjectName=self.tgmatch.pattern)
+        return tg if self.report_type == 'XD' else ~tg
+
+    def add_aggs(self, aggs):
+        """Add this report's bucket and metric aggregations
+
+        :param aggs: Search.aggs, or the bucket to add them under
+        :return None
+        """
+        Bucket = aggs.bucket("ProjectName", "terms", field="ProjectName",
+                             size=MAXINT, order={"_term":"asc"},
+                             missing="UNKNOWN")\
                     .bucket("OIM_PIName", "terms", field="OIM_PIName", missing="UNKNOWN", size=MAXINT)\
                     .bucket("OIM_Organization", "terms", field="OIM_Organization", missing="UNKNOWN", size=MAXINT)\
                     .bucket("OIM_FieldOfScience", "terms", field="OIM_FieldOfScience", missing="UNKNOWN", size=MAXINT)
 
         Bucket.metric("CoreHours", "sum", field="CoreHours")
 
-        return s
+    def pending_searches(self):
+        """The report's only search, which can be run ahead of time
+
+        :return list: elasticsearch_dsl.Search objects
+        """
+        return [] if self.use_partials() else [self.query()]
 
     def generate_report_file(self):
         """Takes data from query response and parses it to send to other
         functions for processing"""
-        results = self.run_query()
-
         unique_terms = ['ProjectName', 'OIM_PIName', 'OIM_Organization',
                         'OIM_FieldOfScience']
         metrics = ['CoreHours']
 
+        if self.use_partials():
+            for row in self._partial_rows(unique_terms):
+                yield row
+            return
+
+        results = self.run_query()
+
         def recurseBucket(curData, curBucket, index, data):
             """
             Recursively process the buckets down the nested aggregations
@@ -130,7 +174,7 @@ class OSGProjectReporter(ReportUtils.Reporter):
                     if index == (len(unique_terms) - 1):
                         # reached the end of the unique terms
                         for metric in metrics:
-                            nowData[metric] = bucket[metric].value
+                            nowData[metric] = bucket[metric]['value']
                             # Add the doc count
                         nowData["Count"] = bucket['doc_count']
                         data.append(nowData)
@@ -146,6 +190,28 @@ class OSGProjectReporter(ReportUtils.Reporter):
         for entry in data:
             yield [entry[field] for field in allterms]
 
+    def _partial_rows(self, unique_terms):
+        """The rows of generate_report_file, from the daily partial sums (see
+        DailyPartials)
+
+        :param list unique_terms: Fields that identify a row
+        Yields [terms..., CoreHours] lists
+        """
+        sources = [{term: {'terms': {'field': term, 'missing_bucket': True}}}
+                   for term in unique_terms]
+        rows = defaultdict(float)
+        for key, (corehours, _) in self.partial_totals(
+                self._base_search, sources).items():
+            rows[tuple('UNKNOWN' if value is None else value
+                       for value in key)] += corehours
+
+        # Same order as the nested terms aggregations, sorted by
+        # sorted_buckets(key=key_to_lower) at each level
+        for key in sorted(rows, key=lambda k: [part for value in k
+                                               for part in (value.lower(),
+                                                            value)]):
+            yield list(key) + [rows[key]]
+
     def format_report(self):
         """Report formatter.  Returns a dictionary called report containing the
         columns of the report.
@@ -218,19 +284,27 @@ def main():
     args = parse_report_args()
     logfile_fname = args.logfile if args.logfile is not None else LOGFILE
 
+    if args.backfill:
+        sys.exit(max([Backfill.run('osgprojectreport', args, logfile_fname,
+                                   options={'report_type': report_type,
+                                            'isSum': args.isSum})
+                      for report_type in args.report_type.split(',')]))
+
     try:
-        r = OSGProjectReporter(report_type=args.report_type,
+        reports = [OSGProjectReporter(report_type=report_type,
                         config_file=args.config,
                         start=args.start,
                         end=args.end,
                         isSum=args.isSum,
-                        verbose=args.verbose,
-                        is_test=args.is_test,
-                        no_email=args.no_email,
                         logfile=logfile_fname,
-                        template=args.template)
-        r.run_report()
-        r.logger.info("OSG Project Report executed successfully")
+                        template=args.template,
+                        **report_kwargs(args))
+                   for report_type in args.report_type.split(',')]
+        if len(reports) > 1:
+            prefetch(reports)
+        for r in reports:
+            r.run_report()
+            r.logger.info("OSG Project Report executed successfully")
 
     except Exception as e:
         ReportUtils.runerror(args.config, e, traceback.format_exc(), args.logfile)
@@ -0,0 +1,808 @@
+"""Common base class and argument parser for the reports in this package.
+
+OSGReporter adds the query execution paths that are shared by all of the OSG
+reports on top of gracc_reporting's ReportUtils.Reporter.  Reports that have
+several independent searches should hand them to run_queries() together
+rather than calling run_query() for each one, so that the execution strategy
+(serial, one _msearch request, or concurrent through the asyncio
+Elasticsearch client) can be chosen without touching the report.
+
+Reports can also list the searches they are going to run in
+pending_searches().  prefetch() sends those for several reports in one
+_msearch request before the reports run, and each report's run_query() then
+picks up its response instead of going back to Elasticsearch.
+"""
+
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import operator
+import time
+from collections import defaultdict, deque
+from email.message import EmailMessage
+from email.utils import formataddr
+
+from gracc_reporting import ReportUtils
+
+from . import Connections, DailyPartials, IndexResolver, OutputSinks, \
+    Profiling, ProjectQueryPlanner, QueryExplain, ResponseFilter, RunMetrics, \
+    SnapshotStore, StreamingTable
+from .SearchBatcher import SearchBatcher, SearchItemError, search_key, \
+    DEFAULT_MAX_BATCH_SIZE
+
+DEFAULT_ES_HOST = 'https://gracc.opensciencegrid.org/q'
+ASYNC_MAX_CONCURRENCY = 8
+
+
+def get_report_parser(no_time_options=False, no_row_cap=False,
+                      no_sinks=False, no_backfill=False):
+    """Parser with the options shared by every report in this package.  Use
+    it as a parent parser, like ReportUtils.get_report_parser.
+
+    :param bool no_time_options: Don't add the -s/-e time range options
+    :param bool no_row_cap: Don't add --row-cap, for reports that don't
+        send their table through OSGReporter.send_report
+    :param bool no_sinks: Don't add --sink, for reports without a table
+    :param bool no_backfill: Don't add the --backfill options, for reports
+        that can't run several periods at once
+    :return argparse.ArgumentParser: Parser to be used as a parent
+    """
+    parser = argparse.ArgumentParser(
+        add_help=False,
+        parents=[ReportUtils.get_report_parser(no_time_options=no_time_options)])
+    es_options = parser.add_argument_group('Elasticsearch query options')
+    es_options.add_argument("--async", dest="use_async", action="store_true",
+                            default=False,
+                            help="Run independent Elasticsearch queries "
+                                 "concurrently with the asyncio client")
+    es_options.add_argument("--msearch", dest="use_msearch",
+                            action="store_true", default=None,
+                            help="Send independent Elasticsearch queries "
+                                 "together in _msearch requests")
+    es_options.add_argument("--explain", dest="explain", action="store_true",
+                            default=False,
+                            help="Print each Elasticsearch query, run it "
+                                 "with profiling on, and print where the "
+                                 "cluster spent its time")
+    es_options.add_argument("--trim-responses", dest="trim_responses",
+                            action="store_true", default=None,
+                            help="Ask Elasticsearch for only the keys, "
+                                 "counts and values of the aggregations, "
+                                 "and parse them as plain dicts")
+    output_options = parser.add_argument_group('Output options')
+    if not no_row_cap:
+        output_options.add_argument("--row-cap", dest="row_cap", type=int,
+                                    default=None,
+                                    help="Render the report table row by "
+                                         "row, with at most this many rows "
+                                         "in the email.  The full table is "
+                                         "attached as a gzipped CSV.")
+    if not no_sinks:
+        output_options.add_argument("--sink", dest="sinks", action="append",
+                                    default=None, metavar="[FORMAT:]PATH",
+                                    help="Also write the report table to "
+                                         "this file.  FORMAT (csv, jsonl or "
+                                         "parquet) defaults to the one given "
+                                         "by the file extension.  "
+                                         "{report_type} in PATH is replaced "
+                                         "by the report type.  Can be given "
+                                         "more than once.")
+    output_options.add_argument("--changes-only", dest="changes_only",
+                                action="store_true", default=False,
+                                help="Only report rows that are new or "
+                                     "changed since the last snapshot of "
+                                     "this report (see [snapshots] in the "
+                                     "config file)")
+    Profiling.add_profile_options(parser)
+    if not (no_time_options or no_sinks or no_backfill):
+        backfill_options = parser.add_argument_group('Backfill options')
+        backfill_options.add_argument(
+            "--backfill", dest="backfill", default=None,
+            metavar="START:END:STEP",
+            help="Run the report for every STEP (e.g. 1d, 1w, 1mo) from "
+                 "START to END (YYYY-MM-DD), in parallel, writing each "
+                 "period to the --sink files instead of sending email")
+        backfill_options.add_argument(
+            "--backfill-workers", dest="backfill_workers", type=int,
+            default=None,
+            help="Number of periods to run at once (default: max_workers "
+                 "under [backfill] in the config file, or 4)")
+    return parser
+
+
+# Reporter arguments named after the options of get_report_parser()
+REPORT_OPTIONS = ('use_async', 'use_msearch', 'explain', 'trim_responses',
+                  'row_cap', 'sinks', 'changes_only', 'profile',
+                  'profile_interval')
+
+
+def report_kwargs(args):
+    """Reporter keyword arguments for the shared options in parsed
+    command-line arguments.  Options left out of a report's parser (e.g.
+    --row-cap with no_row_cap) are left out of the arguments too.  The
+    config file, time range, template and log file aren't included, since
+    reports handle them differently.
+
+    :param argparse.Namespace args: Arguments parsed with a parser that has
+        get_report_parser() as a parent
+    :return dict: Keyword arguments for an OSGReporter subclass
+    """
+    kwargs = {'verbose': args.verbose,
+              'is_test': args.is_test,
+              'no_email': args.no_email}
+    for name in REPORT_OPTIONS:
+        if hasattr(args, name):
+            kwargs[name] = getattr(args, name)
+    return kwargs
+
+
+def _count_rows(content):
+    """:return int: Number of rows in a format_report() result"""
+    if content is None:
+        return 0
+    if hasattr(content, 'itertuples'):      # pandas.DataFrame
+        return len(content)
+    return max((len(col) for col in content.values()), default=0)
+
+
+def prefetch(reports):
+    """Run the pending_searches() of several reports together, in as few
+    _msearch requests as possible, and hand each report its responses.
+    Project-family reports that cover the same time window share one fused
+    search (see ProjectQueryPlanner).  Reports that query different
+    Elasticsearch hosts are batched separately.  A search that fails here is
+    simply run again by its report.
+
+    :param list reports: OSGReporter objects
+    :return int: Number of report searches answered ahead of time
+    """
+    fused, rest = ProjectQueryPlanner.plan(reports)
+
+    byhost = defaultdict(list)
+    for fq in fused:
+        byhost[fq.reports[0].es_hostname()].append((fq, fq.search))
+    for report in rest:
+        for s in report.pending_searches():
+            byhost[report.es_hostname()].append((report, s))
+
+    count = 0
+    for host, items in byhost.items():
+        first = items[0][0]
+        if isinstance(first, ProjectQueryPlanner.FusedQuery):
+            first = first.reports[0]
+        batcher = SearchBatcher(first.client,
+                                max_batch_size=first.msearch_max_batch_size(),
+                                logger=first.logger)
+        pendings = [(owner, batcher.add(s)) for owner, s in items]
+        try:
+            batcher.flush()
+        except Exception as e:
+            first.logger.warning("Prefetching searches from {0} failed: "
+                                 "{1}".format(host, e))
+        for owner, p in pendings:
+            if p.response is None:
+                continue
+            if isinstance(owner, ProjectQueryPlanner.FusedQuery):
+                if p.response.success():
+                    owner.fan_out(p.response)
+                    count += len(owner.reports)
+            else:
+                owner.add_prefetched(p.search, p.response)
+                count += 1
+    return count
+
+
+class OSGReporter(ReportUtils.Reporter):
+    """Base class for the OSG reports
+
+    :param str report_type: Which report is getting run
+    :param str config_file: Filename of toml configuration file
+    :param str start: Start time of report range
+    :param str end: End time of report range
+    :param bool use_async: Run the searches given to run_queries concurrently
+        with the asyncio Elasticsearch client
+    :param bool use_msearch: Send the searches given to run_queries in
+        _msearch requests.  If None, use the msearch setting in the
+        [elasticsearch] section of the config file (default False).
+    :param int row_cap: If set, send the report through the streaming
+        renderer, with at most this many rows in the email
+    :param list sinks: [FORMAT:]PATH specs of files to write the report
+        table to, besides sending it (see OutputSinks).  {report_type} in a
+        path is replaced by report_type.
+    :param bool changes_only: Report only the rows that are new or changed
+        since the previous snapshot (reports that set snapshot_keys)
+    :param bool trim_responses: Trim the search responses with filter_path,
+        and parse them as plain dicts (reports that set response_fields).  If
+        None, use the trim_responses setting in the [elasticsearch] section
+        of the config file (default False).
+    """
+    # Reports whose search can be fused with others by ProjectQueryPlanner
+    # set this to a name for their part of the fused search, and implement
+    # fusion_filter() and add_aggs()
+    fusion_consumer = None
+
+    # Reports whose table can be kept in the SnapshotStore set this to the
+    # columns that identify a row, and pass the table through snapshot()
+    snapshot_keys = None
+
+    # Reports whose parsers read the aggregations with item access only
+    # (bucket['key'], not bucket.key) set this to the fields they read, and
+    # can get trimmed responses as plain dicts (see ResponseFilter)
+    response_fields = None
+
+    # Number of rows (totals and the like) that format_report() adds after
+    # the data.  They go in the email, but not to the sinks.
+    summary_rows = 0
+
+    def __init__(self, report_type, config_file, start, end, use_async=False,
+                 use_msearch=None, row_cap=None, sinks=None,
+                 changes_only=False, profile=None,
+                 profile_interval=Profiling.DEFAULT_INTERVAL, explain=False,
+                 trim_responses=None, **kwargs):
+        self.use_async = use_async
+        self.row_cap = row_cap
+        self.sinks = [OutputSinks.get_sink(
+                          spec.replace('{report_type}', report_type))
+                      for spec in sinks or []]
+        self.changes_only = changes_only
+        self.explain = explain
+        self.unchanged = False
+        self._prefetched = {}
+        super(OSGReporter, self).__init__(report_type=report_type,
+                                          config_file=config_file,
+                                          start=start,
+                                          end=end,
+                                          **kwargs)
+        if use_msearch is None:
+            use_msearch = self.config.get('elasticsearch', {}).get(
+                'msearch', False)
+        self.use_msearch = use_msearch
+        if trim_responses is None:
+            trim_responses = ResponseFilter.enabled(self.config)
+        self.trim_responses = trim_responses and \
+            self.response_fields is not None
+        if self.trim_responses:
+            ResponseFilter.use_fast_decoder(self.client)
+        if changes_only and self.snapshot_keys is None:
+            self.logger.warning("{0} does not keep snapshots.  Reporting all "
+                                "rows.".format(self.__class__.__name__))
+        self.run_metrics = RunMetrics.RunMetrics(report_type)
+        if RunMetrics.enabled(self.config):
+            # measured() wraps shared classes while the report runs, so only
+            # when there is somewhere to write the metrics to
+            self.run_report = self.run_metrics.measured(self)
+        if profile:
+            self.run_report = Profiling.profiled(
+                self.run_report, report_type, self.logfile, profile,
+                profile_interval, self.logger)
+
+    def es_hostname(self):
+        """The Elasticsearch host this report queries, looked up the same
+        way as ReportUtils.Reporter does for its synchronous client
+
+        :return str: Elasticsearch URL
+        """
+        es_config = self.config.get('elasticsearch', {})
+        if self.althost_key is not None:
+            return es_config[self.althost_key]
+        return es_config.get('hostname', DEFAULT_ES_HOST)
+
+    def indices(self, start=None, end=None):
+        """The indices to search for a time range: the concrete indices in
+        range if resolve_indices is set under [elasticsearch] (see
+        IndexResolver), the report's index pattern otherwise
+
+        :param datetime.datetime start: Start of range, default start_time
+        :param datetime.datetime end: End of range, default end_time
+        :return: Index pattern, or list of index names
+        """
+        if not IndexResolver.enabled(self.config):
+            return self.indexpattern
+        return IndexResolver.resolve(
+            self.client, self.es_hostname(), self.indexpattern,
+            start if start is not None else self.start_time,
+            end if end is not None else self.end_time,
+            self.config['elasticsearch'].get(
+                'index_slack_days', IndexResolver.DEFAULT_SLACK_DAYS),
+            self.logger)
+
+    @staticmethod
+    def sorted_buckets(agg, key=operator.itemgetter('key')):
+        """ReportUtils.Reporter.sorted_buckets(), for plain dict responses
+        too
+
+        :param agg: Aggregation containing buckets
+        :param key: Key to sort buckets on
+        :return: sorted buckets
+        """
+        return sorted(agg['buckets'], key=key)
+
+    def search_params(self, s):
+        """:return dict: Parameters to send a search with: its own, and
+        filter_path if the response is to be trimmed"""
+        # --explain needs the profile, which filter_path would leave out
+        if not self.trim_responses or self.explain:
+            return s._params
+        return dict(s._params,
+                    filter_path=ResponseFilter.filter_path(
+                        self.response_fields))
+
+    def msearch_max_batch_size(self):
+        """:return int: Most searches to send in one _msearch request"""
+        return self.config.get('elasticsearch', {}).get(
+            'msearch_max_batch_size', DEFAULT_MAX_BATCH_SIZE)
+
+    def pending_searches(self):
+        """Searches that this report will run through run_query(), and that
+        can be sent ahead of time by prefetch().  Only reports whose searches
+        don't depend on earlier query results should list them here.
+
+        :return list: elasticsearch_dsl.Search objects
+        """
+        return []
+
+    def add_prefetched(self, search, response):
+        """Store the response for a search that was run ahead of time.  The
+        next run_query() for an identical search uses it.
+
+        :param search: elasticsearch_dsl.Search
+        :param response: elasticsearch_dsl.response.Response for search
+        """
+        self._prefetched[search_key(search)] = response
+
+    def run_query(self, overridequery=None):
+        """ReportUtils.Reporter.run_query(), but if the search was already
+        run by prefetch() or run_queries(), use that response
+
+        :param function overridequery: Called instead of self.query() to get
+            the search to run
+        :return Response.aggregations OR ES Search object: See
+            ReportUtils.Reporter.run_query()
+        """
+        s = overridequery() if overridequery is not None else self.query()
+        response = self._prefetched.pop(search_key(s), None) \
+            if self._prefetched else None
+        if response is None or self.explain:
+            return self._check_response(s, self._execute(s))
+
+        self.logger.debug(json.dumps(s.to_dict(), sort_keys=True))
+        return self._check_response(s, response)
+
+    def _execute(self, s):
+        """Run a search the way Search.execute() does, and record it in
+        self.run_metrics
+
+        :param s: elasticsearch_dsl.Search
+        :return: elasticsearch_dsl.response.Response for s
+        """
+        from elasticsearch_dsl.connections import get_connection
+
+        t = s.to_dict()
+        # default=str: some reports put datetimes in their range filters
+        if self.verbose:
+            print(json.dumps(t, sort_keys=True, indent=4, default=str))
+        self.logger.debug(json.dumps(t, sort_keys=True, default=str))
+        if self.explain:
+            print(QueryExplain.format_request(s._index, t))
+            t = dict(t, profile=True)
+
+        start = time.perf_counter()
+        try:
+            with self.run_metrics.phase('query'):
+                raw = get_connection(s._using).search(
+                    index=s._index, body=t, **self.search_params(s))
+        except Exception as e:
+            self.logger.exception(e)
+            raise
+        body = getattr(raw, 'body', raw)
+        self.run_metrics.record_search(s._index, body,
+                                       seconds=time.perf_counter() - start,
+                                       nbytes=RunMetrics.content_length(raw))
+        if self.explain:
+            print(QueryExplain.format_summary(body) + '\n')
+        s._response = s._response_class(s, body)
+        return s._response
+
+    def run_queries(self, searches):
+        """Execute several independent searches and return their results in
+        the same order.  Each result is what run_query() would have returned
+        for that search.
+
+        :param list searches: elasticsearch_dsl.Search objects
+        :return list: Response.aggregations (or Search) for each search
+        """
+        searches = list(searches)
+        # --explain profiles each search on its own
+        if len(searches) > 1 and not self.explain:
+            if self.use_msearch:
+                self._msearch(searches)
+            elif self.use_async:
+                # One phase for all of them: the searches overlap
+                with self.run_metrics.phase('query'):
+                    return asyncio.run(self.run_queries_async(searches))
+        return [self.run_query(overridequery=lambda s=s: s) for s in searches]
+
+    def _msearch(self, searches):
+        """Send searches in _msearch requests and keep their responses for
+        run_query().  Searches that fail are left for run_query() to run
+        again on their own, so that their errors are raised and logged the
+        usual way."""
+        batcher = SearchBatcher(self.client,
+                                max_batch_size=self.msearch_max_batch_size(),
+                                logger=self.logger)
+        try:
+            with self.run_metrics.phase('query'):
+                pendings = batcher.execute(searches)
+        except Exception as e:
+            self.logger.warning("_msearch failed, running searches one at a "
+                                "time: {0}".format(e))
+            return
+        for p in pendings:
+            try:
+                response = p.result()
+                self.run_metrics.record_search(p.search._index,
+                                               response.to_dict())
+                self.add_prefetched(p.search, response)
+            except SearchItemError as e:
+                self.logger.warning("Retrying search on its own after "
+                                    "_msearch error: {0}".format(e))
+
+    def _check_response(self, s, response):
+        """Check a search response and pick out the results, the same way
+        ReportUtils.Reporter.run_query() does
+
+        :param s: elasticsearch_dsl.Search that was run
+        :param response: elasticsearch_dsl.response.Response for s
+        :return Response.aggregations OR ES Search object: Results.  With
+            trim_responses, the aggregations are a plain dict.
+        """
+        try:
+            if not response.success():
+                raise Exception("Error accessing Elasticsearch")
+
+            if self.verbose:
+                print(json.dumps(response.to_dict(), sort_keys=True, indent=4))
+
+            request = s.aggs.to_dict().get('aggs') if self.trim_responses \
+                else None
+            if request:
+                results = ResponseFilter.restore(
+                    response.to_dict().setdefault('aggregations', {}),
+                    request)
+            elif hasattr(response, 'aggregations') and response.aggregations:
+                results = response.aggregations
+            else:
+                results = s
+
+            self.logger.info('Ran elasticsearch query successfully')
+            return results
+        except Exception as e:
+            self.logger.exception(e)
+            raise
+
+    async def run_queries_async(self, searches, client=None):
+        """Asynchronous counterpart of run_queries().  All searches are sent
+        at once (up to the configured concurrency limit) and awaited
+        together.
+
+        :param list searches: elasticsearch_dsl.Search objects
+        :param client: elasticsearch.AsyncElasticsearch to use.  If None, a
+            client is opened for the duration of the call.
+        :return list: Response.aggregations (or Search) for each search
+        """
+        if client is None:
+            async with self.async_client() as client:
+                return await self.run_queries_async(searches, client=client)
+
+        limit = asyncio.Semaphore(self.config.get('elasticsearch', {}).get(
+            'async_max_concurrency', ASYNC_MAX_CONCURRENCY))
+
+        async def _run(s):
+            async with limit:
+                return await self.run_query_async(overridequery=lambda: s,
+                                                  client=client)
+
+        return await asyncio.gather(*(_run(s) for s in searches))
+
+    async def run_query_async(self, overridequery=None, client=None):
+        """Asynchronous counterpart of ReportUtils.Reporter.run_query()
+
+        :param function overridequery: Called instead of self.query() to get
+            the search to run
+        :param client: elasticsearch.AsyncElasticsearch to use.  If None, a
+            client is opened for the duration of the call.
+        :return Response.aggregations OR ES Search object: Same as run_query()
+        """
+        if client is None:
+            async with self.async_client() as client:
+                return await self.run_query_async(overridequery, client=client)
+
+        s = overridequery() if overridequery is not None else self.query()
+
+        t = s.to_dict()
+        # default=str: some reports put datetimes in their range filters
+        if self.verbose:
+            print(json.dumps(t, sort_keys=True, indent=4, default=str))
+        self.logger.debug(json.dumps(t, sort_keys=True, default=str))
+
+        start = time.perf_counter()
+        try:
+            raw = await client.search(index=s._index, body=t,
+                                      **self.search_params(s))
+        except Exception as e:
+            self.logger.exception(e)
+            raise
+        body = getattr(raw, 'body', raw)
+        self.run_metrics.record_search(s._index, body,
+                                       seconds=time.perf_counter() - start,
+                                       nbytes=RunMetrics.content_length(raw))
+        return self._check_response(s, s._response_class(s, body))
+
+    def async_client(self):
+        """Open an asyncio Elasticsearch client for this report's host.  Use it
+        as an async context manager so that it gets closed.
+
+        :return elasticsearch.AsyncElasticsearch: Client
+        """
+        try:
+            import aiohttp
+            from elasticsearch import AsyncElasticsearch
+        except ImportError as e:
+            raise ImportError("The asyncio query path needs the async extra "
+                              "of elasticsearch (pip install "
+                              "gracc-osg-reports[async]): {0}".format(e))
+
+        # Same options as the synchronous client in ReportUtils.Reporter
+        return AsyncElasticsearch(self.es_hostname(), verify_certs=False,
+                                  timeout=60)
+
+    def report_rows(self):
+        """Columns and rows of the report table.  By default these come from
+        format_report(); reports with very large tables override this to
+        stream their rows instead.
+
+        :return tuple: (list of column names, iterable of row lists)
+        """
+        content = self.format_report()
+        columns = self.report_columns(content)
+        return columns, self._content_rows(content, columns)
+
+    def report_columns(self, content):
+        """Columns of a format_report() result: self.header, or, for reports
+        whose columns depend on the data and so leave self.header empty, the
+        result's own columns
+
+        :param content: format_report() result (dict of columns or
+            DataFrame), or None
+        :return list: Column names
+        """
+        if self.header or content is None:
+            return list(self.header)
+        if hasattr(content, 'columns'):         # pandas.DataFrame
+            return list(content.columns)
+        return list(content.keys())
+
+    def _content_rows(self, content, columns=None):
+        """Rows of a format_report() result (dict of columns or DataFrame).
+        Nothing for None.
+
+        :param list columns: Columns to take, in order.  Default:
+            report_columns(content)
+        Yields row lists
+        """
+        if content is None:
+            return
+        if columns is None:
+            columns = self.report_columns(content)
+        if hasattr(content, 'itertuples'):      # pandas.DataFrame
+            for row in content[columns].itertuples(index=False):
+                yield list(row)
+            return
+        columns = [content.get(col, []) for col in columns]
+        for row in zip(*columns):
+            yield list(row)
+
+    def use_partials(self):
+        """:return bool: Whether sums come from DailyPartials ([partials] in
+        the config file)"""
+        return DailyPartials.enabled(self.config)
+
+    def partial_totals(self, base, sources, start=None, end=None):
+        """Sums of CoreHours (and record counts) per key, from stored daily
+        partial sums plus queries for the days that aren't stored (see
+        DailyPartials)
+
+        :param function base: Called with (start, end); returns the report's
+            Search for that range, with filters but no aggregations
+        :param list sources: Composite aggregation key sources
+        :param datetime.datetime start: Start of range, default start_time
+        :param datetime.datetime end: End of range, default end_time
+        :return dict: key tuple -> [CoreHours, record count]
+        """
+        store = DailyPartials.DailyPartials.from_config(self.config,
+                                                        self.logger)
+        return store.totals(
+            self.snapshot_name(),
+            lambda query: self.run_query(overridequery=query), base, sources,
+            start if start is not None else self.start_time,
+            end if end is not None else self.end_time)
+
+    def snapshot_name(self):
+        """Name of this report in the SnapshotStore and DailyPartials"""
+        return '{0}_{1}'.format(self.__class__.__name__, self.report_type)
+
+    def snapshot(self, table):
+        """Keep this run's table in the SnapshotStore, if snapshots are
+        configured or changes_only is set.  With changes_only, return just
+        the rows that are new or changed since the previous snapshot, and set
+        self.unchanged if there are none.
+
+        :param table: dict of columns or pandas.DataFrame, without any total
+            row
+        :return: The table to report, of the same type as table
+        """
+        if self.snapshot_keys is None or \
+                not (self.changes_only or 'snapshots' in self.config):
+            return table
+
+        import pandas as pd
+
+        isdict = not isinstance(table, pd.DataFrame)
+        frame = pd.DataFrame(dict(table),
+                             columns=list(table.keys()) or self.header) \
+            if isdict else table
+        store = SnapshotStore.SnapshotStore.from_config(self.config,
+                                                        self.logger)
+        name = self.snapshot_name()
+        period = SnapshotStore.period_key(self.start_time, self.end_time)
+
+        result = frame
+        if self.changes_only:
+            previous = store.previous(name, period)
+            result = SnapshotStore.changed_rows(
+                frame, previous, self.snapshot_keys,
+                rtol=self.config.get('snapshots', {}).get('rtol'))
+            self.logger.info("{0} of {1} rows are new or changed".format(
+                len(result), len(frame)))
+            self.unchanged = result.empty
+            if previous is not None and not self.unchanged:
+                self.title = "{0} (new or changed rows only)".format(
+                    self.title)
+        try:
+            store.save(name, period, frame)
+        except OSError as e:
+            if self.changes_only:
+                raise
+            # Snapshots are only kept for later; don't fail this report
+            self.logger.warning("Could not save snapshot: {0}".format(e))
+
+        if isdict:
+            return {col: result[col].tolist() for col in frame.columns}
+        return result
+
+    def _tee_sinks(self, rows, columns):
+        """Pass rows through, writing each one to every sink on the way,
+        except for the last summary_rows
+
+        :param list columns: Column names of the rows
+        Yields row lists
+        """
+        for sink in self.sinks:
+            sink.open(columns)
+        # A row is written once summary_rows more have come after it
+        held = deque()
+        try:
+            for row in rows:
+                held.append(row)
+                if len(held) > self.summary_rows:
+                    data = held.popleft()
+                    for sink in self.sinks:
+                        sink.writerow(data)
+                yield row
+        finally:
+            for sink in self.sinks:
+                self.logger.info("Wrote {0} rows to {1}".format(
+                    sink.close(), sink.path))
+
+    def _write_sinks(self, rows, columns):
+        """Write rows to every sink
+
+        :param list columns: Column names of the rows
+        """
+        for _ in self._tee_sinks(rows, columns):
+            pass
+
+    def send_report(self, title=None, successmessage=None):
+        """Send the report.  Without a row cap, this is
+        ReportUtils.Reporter.send_report().  With one, the table is rendered
+        row by row (see StreamingTable): the email shows the first row_cap
+        rows, and the full table is attached as a gzipped CSV.
+
+        :param str title: Title of report, overrides self.title
+        :param str successmessage: Message to log once the report is sent
+        """
+        if self.row_cap is None:
+            # Format once, so that sinks and snapshots see the content that
+            # gets emailed, and format_report() (and its queries) only runs
+            # once
+            content = self.format_report()
+            if self.unchanged:
+                self.logger.info("Nothing changed since the last snapshot.  "
+                                 "Not sending the report.")
+                return
+            if self.sinks:
+                columns = self.report_columns(content)
+                self._write_sinks(self._content_rows(content, columns),
+                                  columns)
+            self.run_metrics.count('rows', _count_rows(content))
+            # format_report may be wrapped on the instance (see RunMetrics)
+            own = vars(self).get('format_report')
+            self.format_report = lambda: content
+            try:
+                return super(OSGReporter, self).send_report(
+                    title=title, successmessage=successmessage)
+            finally:
+                if own is not None:
+                    self.format_report = own
+                else:
+                    del self.format_report
+
+        if title is not None: self.title = title
+        if self.title is None: self.title = "GRACC Report"
+
+        template_text = None
+        if self.template:
+            with open(self.template, 'r') as t:
+                template_text = t.read()
+
+        body = io.StringIO()
+        columns, rows = self.report_rows()
+        attachment = StreamingTable.CSVGzipWriter(columns)
+        if self.sinks:
+            rows = self._tee_sinks(rows, columns)
+        nrows, truncated = StreamingTable.render_html(
+            rows, columns, body,
+            template_text=template_text, title=self.title,
+            row_cap=self.row_cap, overflow=attachment)
+        csvgz = attachment.close()
+        self.run_metrics.count('rows', nrows)
+        self.logger.info("Rendered {0} rows, {1} left out of the email".format(
+            nrows, truncated))
+        if self.unchanged:
+            self.logger.info("Nothing changed since the last snapshot.  "
+                             "Not sending the report.")
+            return
+
+        if self.check_no_email(self.email_info['to']['email']):
+            return
+        if nrows == 0:
+            self.logger.error("There is no content being passed to generate "
+                              "a report file")
+            raise ValueError("No report content")
+
+        today = datetime.datetime.now().strftime('%Y_%m_%d')
+        msg = EmailMessage()
+        msg["Subject"] = self.title
+        msg["From"] = formataddr((self.email_info['from']['name'],
+                                  self.email_info['from']['email']))
+        msg["To"] = ", ".join(
+            formataddr(pair) for pair in zip(self.email_info['to']['name'],
+                                             self.email_info['to']['email']))
+        summary = "{0}\n\n{1:,} rows.".format(self.title, nrows)
+        if truncated:
+            summary += "  The first {0:,} are shown; the full table is in " \
+                       "the attached CSV.".format(self.row_cap)
+        msg.set_content(summary, 'plain')
+        msg.add_alternative(body.getvalue(), subtype='html')
+        msg.add_attachment(csvgz, maintype='application', subtype='gzip',
+                           filename="report_{0}.csv.gz".format(today))
+
+        server = Connections.SMTP(self.email_info['smtphost'])
+        server.sendmail(self.email_info['from']['email'],
+                        self.email_info['to']['email'], msg.as_string())
+        server.quit()
+        self.logger.info(successmessage if successmessage is not None
+                         else "Sent reports to {0}".format(
+                            ", ".join(self.email_info['to']['email'])))
@@ -0,0 +1,209 @@
+"""Write report tables to files, for programs that want the numbers rather
+than the email.
+
+Each sink takes the report header and an iterator of rows (in header order),
+and writes them out as it goes.  The format is picked from the file
+extension, or given explicitly as FORMAT:PATH:
+
+    report.csv                  CSV with a header line
+    report.jsonl                JSON Lines, one object per row
+    report.parquet              Parquet (needs pyarrow)
+    csv:/dev/stdout             Explicit format
+
+Empty cells ('' in the email table) are written as nulls in JSON Lines and
+Parquet.  The Total and other summary rows of the email table are left out
+(see OSGReporter.summary_rows).
+"""
+
+import csv
+import json
+import os
+
+PARQUET_BATCH_ROWS = 10000
+
+
+def _cell(value):
+    """JSON/Parquet value for a table cell"""
+    if value == '':
+        return None
+    if hasattr(value, 'item'):      # numpy scalar
+        return value.item()
+    return value
+
+
+class Sink(object):
+    """Base class for the output sinks.  Use open(), writerow() for each row,
+    then close(); or write() to do all three.
+
+    :param str path: File to write
+    """
+    extensions = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.rows = 0
+
+    def open(self, header):
+        """Start the file
+
+        :param list header: Column names
+        """
+        self.header = list(header)
+        self.rows = 0
+
+    def writerow(self, row):
+        """Write one row, in header order"""
+        self.rows += 1
+
+    def close(self):
+        """Finish the file
+
+        :return int: Number of rows written
+        """
+        return self.rows
+
+    def write(self, header, rows):
+        """Write a whole table
+
+        :param list header: Column names
+        :param rows: Iterable of rows, in header order
+        :return int: Number of rows written
+        """
+        self.open(header)
+        try:
+            for row in rows:
+                self.writerow(row)
+        finally:
+            n = self.close()
+        return n
+
+    def __repr__(self):
+        return "{0}({1!r})".format(self.__class__.__name__, self.path)
+
+
+class CSVSink(Sink):
+    """CSV file with a header line"""
+    extensions = ('.csv',)
+
+    def open(self, header):
+        super(CSVSink, self).open(header)
+        self._file = open(self.path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.header)
+
+    def writerow(self, row):
+        super(CSVSink, self).writerow(row)
+        self._writer.writerow(['' if cell is None else cell for cell in row])
+
+    def close(self):
+        self._file.close()
+        return super(CSVSink, self).close()
+
+
+class JSONLinesSink(Sink):
+    """JSON Lines file: one JSON object per row, keyed by column name"""
+    extensions = ('.jsonl', '.json')
+
+    def open(self, header):
+        super(JSONLinesSink, self).open(header)
+        self._file = open(self.path, 'w')
+
+    def writerow(self, row):
+        super(JSONLinesSink, self).writerow(row)
+        self._file.write(json.dumps(
+            dict(zip(self.header, (_cell(c) for c in row))), default=str))
+        self._file.write('\n')
+
+    def close(self):
+        self._file.close()
+        return super(JSONLinesSink, self).close()
+
+
+class ParquetSink(Sink):
+    """Parquet file, written in row groups of PARQUET_BATCH_ROWS rows.
+
+    The column types come from the rows.  Row groups are held back while a
+    column has only had nulls, and the schema is the union of the types of
+    the row groups held (nulls take the other type, integers and floats give
+    floats).  Later row groups are cast to that schema."""
+    extensions = ('.parquet', '.pq')
+
+    def open(self, header):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError("Parquet output needs pyarrow (pip install "
+                              "gracc-osg-reports[parquet]): {0}".format(e))
+        super(ParquetSink, self).open(header)
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._writer = None
+        self._batch = []
+        self._held = []
+
+    def writerow(self, row):
+        super(ParquetSink, self).writerow(row)
+        self._batch.append(dict(zip(self.header, (_cell(c) for c in row))))
+        if len(self._batch) >= PARQUET_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self, final=False):
+        """Write the rows of self._batch as a row group, or hold them back
+        until every column has a type
+
+        :param bool final: No more rows are coming; write whatever is held
+        """
+        pa = self._pa
+        if self._batch:
+            table = pa.Table.from_pylist(self._batch)
+        else:
+            table = pa.table({col: pa.array([], pa.null())
+                              for col in self.header})
+        self._batch = []
+        if self._writer is not None:
+            self._writer.write_table(table.cast(self._writer.schema))
+            return
+
+        if table.num_rows or not self._held:
+            self._held.append(table)
+        schema = pa.unify_schemas([t.schema for t in self._held],
+                                  promote_options='permissive')
+        if not final and any(pa.types.is_null(f.type) for f in schema):
+            return
+        self._writer = self._pq.ParquetWriter(self.path, schema)
+        for held in self._held:
+            self._writer.write_table(held.cast(schema))
+        self._held = []
+
+    def close(self):
+        try:
+            if self._batch or self._writer is None:
+                self._flush(final=True)
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+        return super(ParquetSink, self).close()
+
+
+SINKS = {'csv': CSVSink, 'jsonl': JSONLinesSink, 'parquet': ParquetSink}
+
+
+def get_sink(spec):
+    """Build a sink from a command-line spec: PATH or FORMAT:PATH
+
+    :param str spec: Sink specification
+    :return Sink: The sink
+    """
+    fmt, sep, path = spec.partition(':')
+    if sep and fmt.lower() in SINKS:
+        return SINKS[fmt.lower()](path)
+
+    ext = os.path.splitext(spec)[1].lower()
+    for cls in SINKS.values():
+        if ext in cls.extensions:
+            return cls(spec)
+    raise ValueError("Can't tell the output format of {0}.  Use a .csv, "
+                     ".jsonl or .parquet file, or FORMAT:PATH with FORMAT one "
+                     "of {1}".format(spec, ', '.join(sorted(SINKS))))
@@ -1,17 +1,11 @@
-import re
 import traceback
 import sys
 import copy
-from collections import defaultdict
 import argparse
-import pandas as pd
-import numpy as np
 import datetime
-import calendar
-import dateutil.parser
-import requests
-import yaml
 
+# pandas, numpy, requests and yaml are imported where they are used, so that
+# importing this module (e.g. for --help) stays cheap.
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -19,13 +13,16 @@ from elasticsearch_dsl import Search
 
 from gracc_reporting import ReportUtils
 
+from . import Backfill, Cache, ResponseFilter
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
+
 LOGFILE = 'osgpayloadandbatch.log'
 MAXINT = 2**31 - 1
 
 
 # Helper Functions
 def key_to_lower(bucket):
-    return bucket.key.lower()
+    return bucket['key'].lower()
 
 
 def parse_report_args():
@@ -33,11 +30,13 @@ def parse_report_args():
     Specific argument parser for this report.
     :return: Namespace of parsed arguments
     """
-    parser = argparse.ArgumentParser(parents=[ReportUtils.get_report_parser()])
-    return parser.parse_args()
+    parser = argparse.ArgumentParser(parents=[get_report_parser()])
+    args = parser.parse_args()
+    Backfill.check_args(parser, args)
+    return args
 
 
-class PayloadAndPilotHours(ReportUtils.Reporter):
+class PayloadAndPilotHours(OSGReporter):
     """Class to hold the information for and run the OSG Project Report
 
     :param str report_type: OSG, XD. or OSG-Connect
@@ -46,6 +45,8 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
     :param str end: End time for report range
     :param bool isSum: Show a total line at bottom of report, defaults to True
     """
+    response_fields = ResponseFilter.FIELDS + ['key_as_string']
+
     def __init__(self, config_file, start, end=None,
                  **kwargs):
 
@@ -78,7 +79,9 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
         from_date = from_date.replace(hour=0, minute=0, second=0, microsecond=0)
         to_date = datetime.datetime.now()
         s = Search(using=self.client, index=index)
-        s = s.filter('range', **{'EndTime': {'from': from_date, 'to': to_date }}) \
+        # As strings, so that the body can be logged as JSON by run_query
+        s = s.filter('range', **{'EndTime': {'from': from_date.isoformat(),
+                                             'to': to_date.isoformat()}}) \
              .filter('terms', OIM_Site=sites)
         s = s.query('match', ResourceType=record_type)
 
@@ -109,39 +112,59 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
         # Download the list of sites from github raw and parse it
         if self.sites is not None:
             return self.sites
-        self.sites = []
-        self.overrides = {}
         sites_url = self.config[self.report_type.lower()]['sites_url']
+        cached = Cache.get_cache('sites').get(
+            sites_url, lambda: self._fetch_sites(sites_url))
+        if cached is None:
+            self.sites, self.overrides = [], {}
+        else:
+            self.sites, self.overrides = list(cached[0]), dict(cached[1])
+        return self.sites
+
+    def _fetch_sites(self, sites_url):
+        """Download and parse the sites file.  Returns None on failure so
+        that nothing gets cached.
+
+        :return tuple: (list of sites, dict of name overrides)
+        """
+        import requests
+        import yaml
+
+        sites = []
+        overrides = {}
         response = requests.get(sites_url)
         if response.status_code == 200:
             # We got the sites config, parse it as yaml
             sites_config = yaml.safe_load(response.text)
 
             # sites is just a list of the keys
-            self.sites = list(sites_config.keys())
+            sites = list(sites_config.keys())
 
             # But, we have to loop through all the sites looking for name_overrides
             for site in sites_config.keys():
                 if sites_config[site] == None:
                     continue
                 if 'name_override' in sites_config[site]:
-                    self.overrides[site] = sites_config[site]['name_override']
+                    overrides[site] = sites_config[site]['name_override']
 
         else:
             self.logger.error("Unable to download sites from github.  Status code: {}".format(response.status_code))
-        return self.sites
+            return None
+        return sites, overrides
 
 
     def generate_report_file(self):
         """Takes data from query response and parses it to send to other
         functions for processing"""
-        
-        # These could probably be combined into one query, but I'm not sure how to do that
-        # Or these could be farmed out to separate threads or processes
+        import numpy as np
+        import pandas as pd
+
+        # The payload and pilot queries are independent, so they are executed
+        # together
         sites = self.download_sites()
         #sites = self.config[self.report_type.lower()]['sites']
-        response_payload = self.query("Payload", sites).execute()
-        response_pilot = self.query("Batch", sites).execute()
+        results_payload, results_pilot = self.run_queries(
+            [self.query("Payload", sites), self.query("Batch", sites)])
 
         unique_terms = ["EndTime", "OIM_Site"]
         metrics = ["CoreHours", "Njobs"]
@@ -173,7 +196,7 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
                     if index == (len(unique_terms) - 1):
                         # reached the end of the unique terms
                         for metric in metrics:
-                            nowData[metric] = bucket[metric].value
+                            nowData[metric] = bucket[metric]['value']
                             # Add the doc count
                         nowData["Count"] = bucket['doc_count']
                         data.append(nowData)
@@ -184,7 +207,7 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
         df_payload = pd.DataFrame()
 
         # Process the payload data
-        for day in response_payload.aggregations['EndTime']['buckets']:
+        for day in results_payload['EndTime']['buckets']:
             data = []
             recurseBucket({"EndTime": day['key_as_string']}, day, 1, data)
             temp_df = pd.DataFrame(data)
@@ -192,7 +215,7 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
         
         df_pilot = pd.DataFrame()
         # Process the pilot data
-        for day in response_pilot.aggregations['EndTime']['buckets']:
+        for day in results_pilot['EndTime']['buckets']:
             data = []
             recurseBucket({"EndTime": day['key_as_string']}, day, 1, data)
             temp_df = pd.DataFrame(data)
@@ -252,11 +275,15 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
 
         :return dict: Constructed dict of report information for
         Reporter.send_report to send report from"""
+        import numpy as np
+        import pandas as pd
 
         table = self.generate_report_file()
         
         # Truncate the decimals in the columns
-        table = table.applymap(lambda x: round(x) if isinstance(x, float) and not pd.isnull(x) else x)
+        # DataFrame.applymap was renamed to map in pandas 2.1, and removed in 3
+        elementwise = table.map if hasattr(table, 'map') else table.applymap
+        table = elementwise(lambda x: round(x) if isinstance(x, float) and not pd.isnull(x) else x)
 
         # Sort the table first by site, then by resource type
         # This will put the Batch rows after the Payload rows
@@ -273,7 +300,10 @@ class PayloadAndPilotHours(ReportUtils.Reporter):
         # Create a new dataframe with the new size
         table.reset_index(inplace=True)
         new_index = pd.RangeIndex(start=0, stop=new_size, step=1)
-        new_df = pd.DataFrame(np.nan, index=new_index, columns=table.columns)
+        # Object columns, since site names go into them (pandas 3 no longer
+        # upcasts a float column on assignment)
+        new_df = pd.DataFrame(np.nan, index=new_index, columns=table.columns,
+                              dtype=object)
 
         # A function to perform the following mapping to add a blank line between each site:
         # 0 -> 0
@@ -319,15 +349,16 @@ def main():
     args = parse_report_args()
     logfile_fname = args.logfile if args.logfile is not None else LOGFILE
 
+    if args.backfill:
+        sys.exit(Backfill.run('payloadbatchreport', args, logfile_fname))
+
     try:
         r = PayloadAndPilotHours(config_file=args.config,
                         start=args.start,
                         end=args.end,
-                        verbose=args.verbose,
-                        is_test=args.is_test,
-                        no_email=args.no_email,
                         logfile=logfile_fname,
-                        template=args.template)
+                        template=args.template,
+                        **report_kwargs(args))
         r.run_report()
         r.logger.info("OSG Payload and Batch Report executed successfully")
 
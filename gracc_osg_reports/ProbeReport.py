@@ -1,22 +1,24 @@
 import xml.etree.ElementTree as ET
 import urllib.request, urllib.error, urllib.parse
+import io
 import ast
 import os
 import re
-import smtplib
 import traceback
 import sys
 import logging
 import email.utils
 from email.mime.text import MIMEText
 import datetime
-import dateutil
 import argparse
 
 from elasticsearch_dsl import Search, Q
 
 from gracc_reporting import ReportUtils
 
+from . import Cache, Connections
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
+
 
 LOGFILE = 'probereport.log'
 TODAY = datetime.datetime.now()
@@ -27,7 +29,9 @@ def parse_report_args():
     Specific argument parser for this report.
     :return: Namespace of parsed arguments
     """
-    parser = argparse.ArgumentParser(parents=[ReportUtils.get_report_parser(no_time_options=True)])
+    parser = argparse.ArgumentParser(parents=[get_report_parser(no_time_options=True,
+                                                               no_row_cap=True,
+                                                               no_sinks=True)])
     parser.add_argument("-S", "--statefile", dest="statefile",
                         type=str, default=None, help="File where report state should be kept")
     return parser.parse_args()
@@ -39,15 +43,18 @@ class OIMInfo(object):
     :param bool verbose: Verbose flag
     :param str config: Configuration file
     :param str logfile: Path to logfile override
+    :param datetime.datetime now: Time to check downtimes against.  Default:
+        when this module was imported
     """
     # Default OIM URLs
     oim_url = {'rg': 'http://myosg.grid.iu.edu/rgsummary/xml?summary_attrs_showhierarchy=on&summary_attrs_showwlcg=on&summary_attrs_showservice=on&summary_attrs_showfqdn=on&gip_status_attrs_showtestresults=on&downtime_attrs_showpast=&account_type=cumulative_hours&ce_account_type=gip_vo&se_account_type=vo_transfer_volume&bdiitree_type=total_jobs&bdii_object=service&bdii_server=is-osg&all_resources=on&facility_sel%5B%5D=10009&gridtype=on&gridtype_1=on&service=on&service_sel%5B%5D=1&active=on&active_value=1&disable=on&disable_value=0&has_wlcg=on',
         'dt':'http://myosg.grid.iu.edu/rgdowntime/xml?summary_attrs_showservice=on&summary_attrs_showrsvstatus=on&summary_attrs_showfqdn=on&gip_status_attrs_showtestresults=on&downtime_attrs_showpast=&account_type=cumulative_hours&ce_account_type=gip_vo&se_account_type=vo_transfer_volume&bdiitree_type=total_jobs&bdii_object=service&bdii_server=is-osg&start_type=7daysago&start_date={0}%2F{1}%2F{2}&end_type=now&end_date={3}%2F{4}%2F{5}&all_resources=on&facility_sel%5B%5D=10009&gridtype=on&gridtype_1=on&service=on&service_sel%5B%5D=1&active=on&active_value=1&disable=on&disable_value=0&has_wlcg=on'}
     LOG_FILENAME = 'probe_OIM_access.log'
 
-    def __init__(self, verbose=False, config=None, logfile=None):
+    def __init__(self, verbose=False, config=None, logfile=None, now=None):
         self.config = ReportUtils.Reporter._parse_config(config)
         self.verbose = verbose
+        self.now = now if now is not None else TODAY
 
         self.logfile = logfile if logfile is not None\
             else self.get_logfile_path()
@@ -157,9 +164,9 @@ class OIMInfo(object):
 
     def dateslist_init(self):
         """Creates dates lists to get passed into OIM urls"""
-        startdate = TODAY - datetime.timedelta(days=7)
+        startdate = self.now - datetime.timedelta(days=7)
         rawdateslist = [startdate.month, startdate.day, startdate.year,
-                        TODAY.month, TODAY.day, TODAY.year]
+                        self.now.month, self.now.day, self.now.year]
         return ['0' + str(elt) if len(str(elt)) == 1 else str(elt)
                 for elt in rawdateslist]
 
@@ -189,7 +196,8 @@ class OIMInfo(object):
             self.logger.info(oim_url)
 
         try:
-            oim_xml = urllib.request.urlopen(oim_url)
+            oim_xml = io.BytesIO(Cache.get_cache('topology').get(
+                oim_url, lambda: urllib.request.urlopen(oim_url).read()))
             self.logger.info("Got OIM {0} file successfully".format(label))
         except (urllib.error.HTTPError, urllib.error.URLError) as e:
             self.logger.error("Couldn't get OIM {0} file".format(label))
@@ -319,7 +327,7 @@ class OIMInfo(object):
                                                 "%b %d, %Y %H:%M %p UTC")
             detime = datetime.datetime.strptime(dtelt.find('./EndTime').text,
                                                 "%b %d, %Y %H:%M %p UTC")
-            if dstime < TODAY < detime:
+            if dstime < self.now < detime:
                 self.logger.info("{0} in downtime".format(fqdn))
                 down_fqdns.append(fqdn)
 
@@ -340,16 +348,19 @@ class OIMInfo(object):
         return oim_probe_dict
 
 
-class ProbeReport(ReportUtils.Reporter):
+class ProbeReport(OSGReporter):
     """
     Class to hold information about and generate the probe report
 
     :param str config_file: Report Configuration file
     :param datetime.datetime start: Start time of report range
     :param datetime.datetime statefile: File where state should be kept
+    :param datetime.datetime now: Time the report is run at.  Default: when
+        this module was imported
     """
-    def __init__(self, config_file, start, statefile, **kwargs):
+    def __init__(self, config_file, start, statefile, now=None, **kwargs):
         report = "Probe"
+        self.now = now if now is not None else TODAY
 
         super(ProbeReport, self).__init__(config_file=config_file,
                                           start=start,
@@ -387,7 +398,7 @@ class ProbeReport(ReportUtils.Reporter):
 
         if self.verbose: self.logger.info(self.indexpattern)
 
-        s = Search(using=self.client, index=self.indexpattern)\
+        s = Search(using=self.client, index=self.indices(self.start_time, self.now))\
             .filter(Q({"range": {"@received": {"gte": "{0}".format(startdateq)}}}))\
             .filter("term", ResourceType="Batch")[0:0]
 
@@ -399,9 +410,9 @@ class ProbeReport(ReportUtils.Reporter):
     def lastreportinit(self):
         """Reset the start/end times for the ES query and generate a new
         index pattern based on those"""
-        self.start_time = TODAY.replace(
+        self.start_time = self.now.replace(
             day=1) - datetime.timedelta(days=1)
-        self.end_time = TODAY
+        self.end_time = self.now
 
         return
 
@@ -411,7 +422,10 @@ class ProbeReport(ReportUtils.Reporter):
 
         :return elasticsearch_dsl.Search: Search object containing ES query
         """
-        ls = Search(using=self.client, index=self.indexpattern)\
+        # now-1M is at most 31 days ago
+        ls = Search(using=self.client,
+                    index=self.indices(self.now - datetime.timedelta(days=31),
+                                       self.now))\
             .filter(Q({"range":{"@received":{"gte":"now-1M"}}}))\
             .filter("term", ResourceType="Batch")\
             .filter("wildcard", ProbeName="*:{0}".format(self.probe))[0:0]
@@ -427,7 +441,28 @@ class ProbeReport(ReportUtils.Reporter):
         :return str: String describing last report date of a probe
         """
         aggs = self.run_query(overridequery=self.lastreportquery)
+        return self._format_last_report_date(aggs)
+
+    def get_last_report_dates(self, probes):
+        """
+        Runs the last reported-date queries for several probes together
+
+        :param list probes: Probe FQDNs
+        :return dict: String describing last report date, keyed by probe
+        """
+        searches = []
+        for self.probe in probes:
+            searches.append(self.lastreportquery())
+        return {probe: self._format_last_report_date(aggs)
+                for probe, aggs in zip(probes, self.run_queries(searches))}
 
+    def _format_last_report_date(self, aggs):
+        """
+        Formats the result of a last reported-date query
+
+        :param aggs: Aggregations from the last reported-date query
+        :return str: String describing last report date of a probe
+        """
         try:
             rawdate = aggs.datemax.value_as_string
             return "{0} at {1} UTC".format(
@@ -475,9 +510,11 @@ class ProbeReport(ReportUtils.Reporter):
         reported file, as well as whether the previous report date was recent
         or not.  'Recent' is defined in the ::cutoff:: variable.
         """
+        import dateutil.parser
+
         # Cutoff is a week ago, probrepdate is last report date for
         # a probe
-        cutoff = TODAY - datetime.timedelta(days=7)
+        cutoff = self.now - datetime.timedelta(days=7)
         with open(self.historyfile, 'r') as h:
             for line in h:
                 proberepdate = dateutil.parser.parse(
@@ -521,11 +558,13 @@ class ProbeReport(ReportUtils.Reporter):
         assert prev_reported.issuperset(prev_reported_old)
 
         self.lastreportinit()
-        for elt in missingprobes.difference(prev_reported_recent):
-            # Only operate on probes that weren't reported in the last week
+        # Only operate on probes that weren't reported in the last week
+        toreport = list(missingprobes.difference(prev_reported_recent))
+        lastreport_dates = self.get_last_report_dates(toreport)
+        for elt in toreport:
             self.probe = elt
             self.resource = oimdict[elt]
-            self.lastreport_date = self.get_last_report_date()
+            self.lastreport_date = lastreport_dates[elt]
 
             if self.probe in prev_reported_old:
                 self.reminder = True    # Reminder flag
@@ -537,7 +576,7 @@ class ProbeReport(ReportUtils.Reporter):
                 f.write(self.emailtext())
 
             # Append line to new history
-            self.newhistory.append('{0}\t{1}\n'.format(elt, TODAY.date()))
+            self.newhistory.append('{0}\t{1}\n'.format(elt, self.now.date()))
             yield
 
         return
@@ -546,7 +585,7 @@ class ProbeReport(ReportUtils.Reporter):
         """Format the subject for our emails"""
         remindertext = 'REMINDER: ' if self.reminder else ''
         return "{0}{1} Reporting Account Failure dated {2}"\
-            .format(remindertext, self.resource, TODAY.date())
+            .format(remindertext, self.resource, self.now.date())
 
     def emailtext(self):
         """Format the text for our emails"""
@@ -582,7 +621,7 @@ class ProbeReport(ReportUtils.Reporter):
         msg['Subject'] = self.emailsubject()
 
         try:
-            smtpObj = smtplib.SMTP(self.email_info["smtphost"])
+            smtpObj = Connections.SMTP(self.email_info["smtphost"])
             smtpObj.sendmail(self.email_info['from']['email'],
                              self.email_info['to']['email'],
                              msg.as_string())
@@ -637,10 +676,8 @@ def main():
         preport = ProbeReport(config_file=args.config,
                               start=startdate,
                               statefile=args.statefile,
-                              verbose=args.verbose,
-                              is_test=args.is_test,
-                              no_email=args.no_email,
-                              logfile=logfile_fname)
+                              logfile=logfile_fname,
+                              **report_kwargs(args))
 
         preport.run_report(oim_probe_fqdn_dict)
         print('Probe Report Execution finished')
@@ -0,0 +1,197 @@
+"""Profiles of a report run, for finding where the time goes.
+
+Every report takes --profile.  run_report() is then run under a profiler,
+and two files are written next to the report's log file:
+
+    <report>-<time>.pstats      Open with python -m pstats, snakeviz, ...
+    <report>-<time>.collapsed   One "frame;frame;frame count" line per stack,
+                                for flamegraph.pl, speedscope, ...
+
+--profile (or --profile cprofile) uses cProfile, which counts every call
+exactly but can slow a report down severalfold.  --profile sample instead
+looks at the report's stack every --profile-interval seconds from another
+thread, which costs little enough to leave on in production.  Its .pstats
+file is built from the samples: call counts are sample counts, and times
+are the time between samples.
+"""
+
+import collections
+import contextlib
+import cProfile
+import datetime
+import functools
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+MODES = ['cprofile', 'sample']
+DEFAULT_INTERVAL = 0.01     # seconds
+
+
+def add_profile_options(parser):
+    """Add --profile and --profile-interval to an argument parser"""
+    options = parser.add_argument_group('Profiling options')
+    options.add_argument("--profile", dest="profile", nargs='?',
+                         const='cprofile', default=None, choices=MODES,
+                         help="Profile the report, and write pstats and "
+                              "collapsed stacks next to the log file.  "
+                              "'sample' has much less overhead than the "
+                              "default, 'cprofile'.")
+    options.add_argument("--profile-interval", dest="profile_interval",
+                         type=float, default=DEFAULT_INTERVAL,
+                         help="Seconds between samples with --profile sample "
+                              "(default {0})".format(DEFAULT_INTERVAL))
+
+
+def _label(key):
+    """Collapsed stack label of a (filename, line, function) key"""
+    filename, line, name = key
+    return '{0} ({1}:{2})'.format(name, os.path.basename(filename), line)
+
+
+class StackSampler(object):
+    """Samples the stack of one thread at a fixed interval
+
+    :param int thread_id: Thread to sample (default: the current thread)
+    :param float interval: Seconds between samples
+    """
+    def __init__(self, thread_id=None, interval=DEFAULT_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None \
+            else threading.get_ident()
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.times = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        # Samples are often late while the sampled thread holds the GIL, so
+        # each one is weighed by the time since the last, not by interval
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno,
+                              code.co_name))
+                frame = frame.f_back
+            if stack:
+                stack = tuple(reversed(stack))
+                self.counts[stack] += 1
+                self.times[stack] += now - last
+            last = now
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path):
+        """Write the samples as collapsed stacks, root first"""
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write('{0} {1}\n'.format(';'.join(_label(key)
+                                                    for key in stack), count))
+
+    def create_stats(self):
+        """Build the pstats table (see pstats.Stats) from the samples.
+        Functions that are on the stack more than once in a sample are
+        only counted once for that sample."""
+        self.stats = {}
+        for stack, count in self.counts.items():
+            elapsed = self.times[stack]
+            seen = set()
+            for i, key in enumerate(stack):
+                leaf = i == len(stack) - 1
+                cc, nc, tt, ct, callers = self.stats.get(key,
+                                                        (0, 0, 0., 0., {}))
+                if key not in seen:
+                    cc, nc, ct = cc + count, nc + count, ct + elapsed
+                if leaf:
+                    tt += elapsed
+                if i > 0:
+                    ccc, cnc, ctt, cct = callers.get(stack[i - 1],
+                                                     (0, 0, 0., 0.))
+                    callers[stack[i - 1]] = (ccc + count, cnc + count,
+                                             ctt + (elapsed if leaf else 0.),
+                                             cct + elapsed)
+                self.stats[key] = (cc, nc, tt, ct, callers)
+                seen.add(key)
+
+
+def output_prefix(report_type, logfile=None, now=None):
+    """Path, less the extension, of the profile files of a report run
+
+    :param str report_type: Report type, used in the file name
+    :param str logfile: The report's log file; the files go in the same
+        directory (default: the working directory)
+    :return str:
+    """
+    now = now or datetime.datetime.now()
+    directory = os.path.dirname(os.path.abspath(logfile)) if logfile \
+        else os.getcwd()
+    name = re.sub(r'[^a-z0-9]+', '_', report_type.lower()).strip('_')
+    return os.path.join(directory, '{0}-{1}'.format(
+        name, now.strftime('%Y%m%dT%H%M%S')))
+
+
+@contextlib.contextmanager
+def profile(prefix, mode='cprofile', interval=DEFAULT_INTERVAL):
+    """Profile the current thread while inside, then write prefix.pstats and
+    prefix.collapsed.  Stacks are always sampled, since cProfile only keeps
+    caller/callee pairs.  Yields the list of files written, filled in on
+    exit; a run too short to be sampled writes no files in 'sample' mode.
+
+    :param str prefix: Path of the output files, less the extension
+    :param str mode: 'cprofile' or 'sample'
+    :param float interval: Seconds between stack samples
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown profile mode {0}.  Use one of "
+                         "{1}".format(mode, ', '.join(MODES)))
+    sampler = StackSampler(interval=interval)
+    profiler = cProfile.Profile() if mode == 'cprofile' else None
+    written = []
+    sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield written
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+        if profiler is not None or sampler.counts:
+            pstats.Stats(profiler or sampler).dump_stats(prefix + '.pstats')
+            written.append(prefix + '.pstats')
+        if sampler.counts:
+            sampler.write_collapsed(prefix + '.collapsed')
+            written.append(prefix + '.collapsed')
+
+
+def profiled(func, report_type, logfile=None, mode='cprofile',
+             interval=DEFAULT_INTERVAL, logger=None):
+    """Wrap func (a report's run_report) so that each call is profiled
+
+    :return function: Wrapped function
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        written = []
+        try:
+            with profile(output_prefix(report_type, logfile), mode,
+                         interval) as written:
+                return func(*args, **kwargs)
+        finally:
+            if logger is not None:
+                logger.info("Wrote profile to {0}".format(
+                    ', '.join(written) or 'nothing: no samples taken'))
+    return wrapper
@@ -0,0 +1,138 @@
+"""Fused Elasticsearch queries for the project-family reports.
+
+The Project report and the Missing Project report both start from the same
+search: Payload records in the report's time window with WallDuration > 0,
+from the probes in the [project.<type>] probe_list of the config file.  Both
+build that search with base_search() below.  When several of these reports
+cover the same window (e.g. the daily OSG, XD and OSG-Connect runs of both
+reports), plan() replaces their searches with one search per window, over
+the union of their probe lists:
+
+    <consumer>      filters aggregation per report kind (fusion_consumer)
+      <type>        one bucket per report type, limited to that type's
+                    probe list and that report's extra filter
+                    (fusion_filter), with the report's own aggregations
+                    (add_aggs) underneath
+
+Each report's slice of the fused response is then handed to the report as
+the response to its own search, so the reports themselves parse their
+results exactly as they would have without fusion.
+"""
+
+from collections import OrderedDict
+
+from elasticsearch_dsl import Search, Q
+
+
+def probe_list(config, report_type):
+    """Probes whose records belong to a project report type
+
+    :param dict config: Parsed report config
+    :param str report_type: OSG, XD, or OSG-Connect
+    :return list: Probe names
+    """
+    return config['project'][report_type.lower()]['probe_list']
+
+
+def base_search(client, index, start_time, end_time, probes):
+    """The search shared by the project-family reports, without any
+    aggregations
+
+    :param client: elasticsearch.Elasticsearch client
+    :param index: Index pattern, or list of index names
+    :param datetime.datetime start_time: Start of the report window
+    :param datetime.datetime end_time: End of the report window
+    :param list probes: Probe names
+    :return elasticsearch_dsl.Search: Search, with size 0
+    """
+    return Search(using=client, index=index) \
+        .filter("range", EndTime={"gte": start_time.isoformat(),
+                                  "lt": end_time.isoformat()}) \
+        .filter("range", WallDuration={"gt": 0}) \
+        .filter("terms", ProbeName=probes) \
+        .filter("term", ResourceType="Payload")[0:0]
+
+
+class FusedQuery(object):
+    """One fused search, and the reports whose searches it replaces
+
+    :param list reports: Reports that share a time window and index
+    """
+    def __init__(self, reports):
+        self.reports = reports
+        first = reports[0]
+        self.client = first.client
+
+        consumers = OrderedDict()
+        allprobes = set()
+        for report in reports:
+            probes = probe_list(report.config, report.report_type)
+            allprobes.update(probes)
+            consumers.setdefault(report.fusion_consumer, OrderedDict())[
+                report.report_type] = \
+                Q('terms', ProbeName=probes) & report.fusion_filter()
+
+        self.search = base_search(first.client, first.indices(),
+                                  first.start_time, first.end_time,
+                                  sorted(allprobes))
+
+        for report in reports:
+            filters = consumers.pop(report.fusion_consumer, None)
+            if filters is not None:
+                report.add_aggs(self.search.aggs.bucket(
+                    report.fusion_consumer, 'filters', filters=filters))
+
+    def fan_out(self, response):
+        """Give each report the part of the fused response that answers its
+        own search
+
+        :param elasticsearch_dsl.response.Response response: Response to
+            self.search
+        """
+        raw = response.to_dict()
+        for report in self.reports:
+            part = dict(raw['aggregations'][report.fusion_consumer]['buckets']
+                        [report.report_type])
+            part.pop('doc_count', None)
+            own = report.query()
+            report.add_prefetched(own, own._response_class(own, {
+                'took': raw.get('took', 0),
+                'timed_out': raw['timed_out'],
+                '_shards': raw['_shards'],
+                'hits': {'total': raw['hits']['total'], 'hits': []},
+                'aggregations': part}))
+
+
+def _window(report):
+    """Reports with the same key can share one fused search"""
+    return (report.es_hostname(), report.configfile, str(report.indexpattern),
+            report.start_time, report.end_time)
+
+
+def plan(reports):
+    """Group the reports that can share a fused search
+
+    :param list reports: OSGReporter objects
+    :return tuple: (list of FusedQuery, list of the reports that aren't
+        covered by any of them)
+    """
+    groups = OrderedDict()
+    rest = []
+    for report in reports:
+        if getattr(report, 'fusion_consumer', None) is None:
+            rest.append(report)
+            continue
+        group = groups.setdefault(_window(report), [])
+        if any(r.report_type == report.report_type and
+               r.fusion_consumer == report.fusion_consumer for r in group):
+            rest.append(report)     # Same report twice; nothing to share
+        else:
+            group.append(report)
+
+    fused = []
+    for group in groups.values():
+        if len(group) > 1:
+            fused.append(FusedQuery(group))
+        else:
+            rest.extend(group)
+    return fused, rest
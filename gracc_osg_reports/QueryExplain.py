@@ -0,0 +1,127 @@
+"""Readable summaries of Elasticsearch search profiles, for --explain.
+
+With --explain, a report prints each search it sends, runs it with
+"profile": true, and prints what the profile says the search cost on the
+cluster, summed over the shards:
+
+    Aggregations  Time per aggregation, nested as in the search, split into
+                  collecting documents and building the buckets
+    Query         Time per query clause
+    Collectors    Time per collector (the top hits, aggregations, ...)
+
+Times are in milliseconds.  "max shard" is the most one shard spent, which
+shows whether the cost is spread out or comes from one large shard.
+"""
+
+import json
+
+NANOS_PER_MS = 1e6
+
+
+class _Node(object):
+    """Profile entries with the same path, summed over shards"""
+    def __init__(self, depth, kind, name):
+        self.depth = depth
+        self.kind = kind
+        self.name = name
+        self.shards = 0
+        self.total = 0
+        self.max_shard = 0
+        self.breakdown = {}
+
+    def add(self, entry):
+        nanos = entry.get('time_in_nanos', 0)
+        self.shards += 1
+        self.total += nanos
+        self.max_shard = max(self.max_shard, nanos)
+        for key, value in entry.get('breakdown', {}).items():
+            if not key.endswith('_count'):
+                self.breakdown[key] = self.breakdown.get(key, 0) + value
+
+
+def _walk(entries, nodes, kind_key, name_key, path=(), depth=0):
+    """Add profile entries and their children to nodes, keyed by path"""
+    for i, entry in enumerate(entries):
+        kind, name = entry.get(kind_key, ''), entry.get(name_key, '')
+        key = path + ((i, kind, name),)
+        if key not in nodes:
+            nodes[key] = _Node(depth, kind, name)
+        nodes[key].add(entry)
+        _walk(entry.get('children', []), nodes, kind_key, name_key, key,
+              depth + 1)
+
+
+def summarize(profile):
+    """Sum a search profile over its shards
+
+    :param dict profile: The "profile" part of a search response
+    :return dict: 'aggregations', 'query' and 'collectors', each a list of
+        _Node in search order
+    """
+    aggs, query, collectors = {}, {}, {}
+    for shard in profile.get('shards', []):
+        _walk(shard.get('aggregations', []), aggs, 'type', 'description')
+        for search in shard.get('searches', []):
+            _walk(search.get('query', []), query, 'type', 'description')
+            _walk(search.get('collector', []), collectors, 'reason', 'name')
+    return {'aggregations': list(aggs.values()),
+            'query': list(query.values()),
+            'collectors': list(collectors.values())}
+
+
+def _ms(nanos):
+    return '{0:.1f}'.format(nanos / NANOS_PER_MS)
+
+
+def _table(header, rows):
+    """:return list: Lines of a left-aligned text table"""
+    widths = [max(len(str(row[i])) for row in [header] + rows)
+              for i in range(len(header))]
+    fmt = '  '.join('{{{0}:<{1}}}'.format(i, w) for i, w in enumerate(widths))
+    return [fmt.format(*header).rstrip(),
+            fmt.format(*['-' * w for w in widths])] + \
+        [fmt.format(*row).rstrip() for row in rows]
+
+
+def _shorten(text, width=60):
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+
+def format_summary(response):
+    """Tables of the cost of a profiled search
+
+    :param dict response: Raw search response, with "profile"
+    :return str: Text to print
+    """
+    summary = summarize(response.get('profile', {}))
+    nshards = response.get('_shards', {}).get('total', '?')
+    lines = ['took {0} ms on {1} shards'.format(response.get('took', '?'),
+                                                nshards)]
+
+    if summary['aggregations']:
+        rows = [['  ' * n.depth + n.name, n.kind, _ms(n.total),
+                 _ms(n.max_shard), _ms(n.breakdown.get('collect', 0)),
+                 _ms(n.breakdown.get('build_aggregation', 0))]
+                for n in summary['aggregations']]
+        lines += ['', 'Aggregations'] + _table(
+            ['name', 'type', 'total ms', 'max shard', 'collect', 'build'],
+            rows)
+    if summary['query']:
+        rows = [['  ' * n.depth + n.kind, _shorten(n.name), _ms(n.total),
+                 _ms(n.max_shard)] for n in summary['query']]
+        lines += ['', 'Query'] + _table(
+            ['type', 'clause', 'total ms', 'max shard'], rows)
+    if summary['collectors']:
+        rows = [['  ' * n.depth + n.name, n.kind, _ms(n.total),
+                 _ms(n.max_shard)] for n in summary['collectors']]
+        lines += ['', 'Collectors'] + _table(
+            ['collector', 'reason', 'total ms', 'max shard'], rows)
+    return '\n'.join(lines)
+
+
+def format_request(index, body):
+    """:return str: The search as it is sent, for printing"""
+    if not isinstance(index, (str, type(None))):
+        index = ','.join(index)
+    return 'Search on {0}:\n{1}'.format(
+        index, json.dumps(body, sort_keys=True, indent=2, default=str))
@@ -0,0 +1,408 @@
+"""Long-running scheduler for the OSG reports.
+
+Instead of starting a fresh container for every report on every cron tick,
+the daemon reads the config file once, then runs each job configured under
+[daemon.jobs] on its own interval.  Elasticsearch and SMTP connections are
+kept open between runs (see Connections), and Topology, sites list and XD
+project lookups are held in TTL caches (see Cache).  After every run the
+daemon rewrites a JSON status file with the start time, duration and result
+of each job's last run.
+
+Example config:
+
+    [daemon]
+        status_file = '/var/log/gracc-reporting/osgreportdaemon.status.json'
+        [daemon.cache_ttl]
+            topology = 3600
+        [daemon.jobs.flocking-weekly]
+            report = 'osgflockingreport'
+            interval = '1w'
+            period = 'weekly'
+            start_at = '06:00'
+            template = '/tmp/html_templates/template_flocking.html'
+        [daemon.jobs.project-xd-daily]
+            report = 'osgprojectreport'
+            interval = '1d'
+            period = 'daily'
+            options = {report_type = 'XD'}
+"""
+
+import datetime
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+import traceback
+import argparse
+
+from dateutil.relativedelta import relativedelta
+
+from gracc_reporting import ReportUtils
+
+from . import Cache, Connections, ReportRegistry
+from .OSGReporter import prefetch
+
+LOGFILE = 'osgreportdaemon.log'
+STATUSFILE = 'osgreportdaemon.status.json'
+KEEPALIVE_INTERVAL = 300        # seconds between SMTP keepalives when idle
+
+# Same periods as the Docker wrapper scripts (Docker/*/*_run.sh)
+PERIODS = {'daily': relativedelta(days=1),
+           'weekly': relativedelta(weeks=1),
+           'monthly': relativedelta(months=1),
+           'bimonthly': relativedelta(months=2),
+           'yearly': relativedelta(years=1)}
+
+_interval_re = re.compile(r'^\s*(\d+)\s*([smhdw]?)\s*$')
+_interval_units = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400,
+                   'w': 604800}
+
+
+# Helper functions
+def parse_report_args():
+    """
+    Specific argument parser for the daemon.
+    :return: Namespace of parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        parents=[ReportUtils.get_report_parser(no_time_options=True)])
+    parser.add_argument("--status-file", dest="status_file", default=None,
+                        help="Where to write the JSON status file")
+    parser.add_argument("--once", dest="once", action="store_true",
+                        default=False,
+                        help="Run every configured job once, then exit")
+    return parser.parse_args()
+
+
+def parse_interval(interval):
+    """Convert an interval like 3600, '30m', '12h', '1d' or '1w' to seconds
+
+    :param interval: int (seconds) or str
+    :return int: Number of seconds
+    """
+    if isinstance(interval, int):
+        return interval
+    m = _interval_re.match(str(interval))
+    if not m:
+        raise ValueError("Invalid interval {0}.  Use a number of seconds, or "
+                         "a number followed by s, m, h, d or w".format(interval))
+    return int(m.group(1)) * _interval_units[m.group(2)]
+
+
+class Job(object):
+    """One scheduled report
+
+    :param str name: Name of the job (key under [daemon.jobs])
+    :param dict jobconfig: The job's config section
+    :param float now: Epoch time the daemon started
+    """
+    def __init__(self, name, jobconfig, now):
+        self.name = name
+        self.report = jobconfig['report']
+        self.spec = ReportRegistry.get_spec(self.report)
+        self.interval = parse_interval(jobconfig['interval'])
+        self.period = jobconfig.get('period')
+        if self.period is not None and self.period not in PERIODS:
+            raise ValueError("Job {0}: unknown period {1}.  Use one of {2}"
+                             .format(name, self.period, ', '.join(PERIODS)))
+        self.template = jobconfig.get('template')
+        self.options = jobconfig.get('options', {})
+        self.next_run = self._first_run(jobconfig.get('start_at'), now)
+
+        self.last_start = None
+        self.last_duration = None
+        self.last_status = None
+        self.last_error = None
+        self.runs = 0
+        self.failures = 0
+
+    def _first_run(self, start_at, now):
+        """Jobs with start_at ('HH:MM', local time) first run at the next
+        occurrence of that time.  Otherwise, the first run is one interval
+        after startup, so that restarting the daemon doesn't resend reports."""
+        if start_at is None:
+            return now + self.interval
+        hour, minute = (int(x) for x in start_at.split(':'))
+        nowdt = datetime.datetime.fromtimestamp(now)
+        first = nowdt.replace(hour=hour, minute=minute, second=0,
+                              microsecond=0)
+        if first <= nowdt:
+            first += datetime.timedelta(days=1)
+        return time.mktime(first.timetuple())
+
+    def time_range(self, now=None):
+        """Start and end of the report range for a run starting now, like
+        set_dates in the Docker wrapper scripts
+
+        :param datetime.datetime now: Time of the run.  Defaults to now.
+        :return tuple: (start, end) as datetime.datetime, or (None, None)
+        """
+        if self.period is None:
+            return None, None
+        if now is None:
+            now = datetime.datetime.now()
+        end = now.replace(microsecond=0)
+        return end - PERIODS[self.period], end
+
+    def status(self):
+        """:return dict: JSON-serializable status of this job"""
+        def _fmt(t):
+            return None if t is None else \
+                datetime.datetime.fromtimestamp(t).isoformat()
+
+        return {'report': self.report,
+                'interval': self.interval,
+                'last_start': _fmt(self.last_start),
+                'last_duration': self.last_duration,
+                'last_status': self.last_status,
+                'last_error': self.last_error,
+                'next_run': _fmt(self.next_run),
+                'runs': self.runs,
+                'failures': self.failures}
+
+
+class ReportDaemon(object):
+    """Runs the reports configured in the [daemon] section of the config file
+
+    :param str config_file: Configuration file
+    :param str status_file: Path of JSON status file, overrides config
+    :param bool is_test: Dry-run or real run, for every job
+    :param bool no_email: If true, don't send any emails, for every job
+    :param bool verbose: Verbose flag
+    :param str logfile: Filename of log file for the daemon and its reports
+    """
+    def __init__(self, config_file, status_file=None, is_test=False,
+                 no_email=False, verbose=False, logfile=None):
+        self.config_file = config_file
+        self.config = ReportUtils.Reporter._parse_config(config_file)
+        try:
+            self.daemon_config = self.config['daemon']
+        except KeyError:
+            raise KeyError("No [daemon] section in config file {0}".format(
+                config_file))
+
+        self.is_test = is_test
+        self.no_email = no_email
+        self.verbose = verbose
+        self.logfile = logfile if logfile is not None else LOGFILE
+        self.logger = self._setup_logger()
+
+        self.status_file = status_file if status_file is not None \
+            else self.daemon_config.get(
+                'status_file',
+                os.path.join(os.path.dirname(os.path.abspath(self.logfile)),
+                             STATUSFILE))
+
+        Cache.configure(self.daemon_config.get('cache_ttl', {}))
+
+        now = time.time()
+        self.started = now
+        self.jobs = [Job(name, jobconfig, now) for name, jobconfig in
+                     sorted(self.daemon_config.get('jobs', {}).items())]
+        if not self.jobs:
+            raise ValueError("No jobs configured under [daemon.jobs]")
+        for job in self.jobs:
+            self.logger.info("Scheduled {0} ({1}) every {2}s".format(
+                job.name, job.report, job.interval))
+
+    def _setup_logger(self):
+        logger = logging.getLogger('ReportDaemon')
+        logger.setLevel(logging.DEBUG)
+        fh = logging.FileHandler(self.logfile)
+        fh.setFormatter(logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        logger.addHandler(fh)
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.INFO if self.verbose else logging.WARNING)
+        logger.addHandler(ch)
+        return logger
+
+    def run_forever(self):
+        """Main loop.  Runs whichever job is due next, then sleeps until the
+        one after that is due"""
+        Connections.install()
+        try:
+            self.write_status()
+            while True:
+                now = time.time()
+                due = [job for job in self.jobs if job.next_run <= now]
+                if not due:
+                    delay = min(job.next_run for job in self.jobs) - now
+                    time.sleep(min(delay, KEEPALIVE_INTERVAL))
+                    Connections.keepalive()
+                    continue
+                self.run_jobs(due)
+        finally:
+            Connections.uninstall()
+
+    def run_once(self):
+        """Run every job once, in order, and return the number of failures"""
+        Connections.install()
+        try:
+            self.run_jobs(self.jobs)
+        finally:
+            Connections.uninstall()
+        return sum(1 for job in self.jobs if job.last_status != 'success')
+
+    def run_jobs(self, jobs):
+        """Run several jobs that are due at the same time.  All of their
+        reports are created first, so that the searches the reports list in
+        pending_searches() go to Elasticsearch together (see
+        OSGReporter.prefetch), then the jobs are run in order.
+
+        :param list jobs: Jobs to run
+        """
+        if len(jobs) == 1:
+            self.run_job(jobs[0])
+            return
+
+        Cache.evict_expired()
+        handlers = _current_handlers()
+        # One time for all of them, so that jobs with the same period cover
+        # the same window and their searches can be fused
+        now = datetime.datetime.now()
+        try:
+            reports = []
+            for job in jobs:
+                try:
+                    reports.append(self._create_report(job, now))
+                except (Exception, SystemExit):
+                    # run_job creates it again, and records the failure
+                    reports.append(None)
+
+            try:
+                n = prefetch([r for r in reports if r is not None])
+                self.logger.info("Prefetched {0} searches for {1} jobs".format(
+                    n, len(jobs)))
+            except Exception:
+                self.logger.exception("Prefetching searches failed")
+
+            for job, report in zip(jobs, reports):
+                self.run_job(job, report)
+        finally:
+            _release_new_handlers(handlers)
+
+    def _create_report(self, job, now=None):
+        """Create the report object for one run of job"""
+        start, end = job.time_range(now)
+        self.logger.info("Creating {0} ({1}) for {2} - {3}".format(
+            job.name, job.report, start, end))
+        return job.spec.create(self.config_file, start, end,
+                               template=job.template,
+                               options=job.options,
+                               is_test=self.is_test,
+                               no_email=self.no_email,
+                               verbose=self.verbose,
+                               logfile=self.logfile)
+
+    def run_job(self, job, report=None):
+        """Run one job, record its outcome, and schedule its next run
+
+        :param Job job: Job to run
+        :param report: Report object already created for this run, if any
+        """
+        self.logger.info("Running {0} ({1})".format(job.name, job.report))
+        Cache.evict_expired()
+        handlers = _current_handlers()
+
+        job.last_start = time.time()
+        try:
+            if report is None:
+                report = self._create_report(job)
+            job.spec.run(report)
+        except (Exception, SystemExit) as e:
+            job.last_status = 'failure'
+            job.last_error = repr(e)
+            job.failures += 1
+            self.logger.exception("Job {0} failed".format(job.name))
+            try:
+                ReportUtils.runerror(self.config_file, e,
+                                     traceback.format_exc(), self.logfile)
+            except Exception:
+                self.logger.exception("Could not send error email for job "
+                                      "{0}".format(job.name))
+        else:
+            job.last_status = 'success'
+            job.last_error = None
+            self.logger.info("Job {0} executed successfully".format(job.name))
+        finally:
+            job.last_duration = round(time.time() - job.last_start, 3)
+            job.runs += 1
+            _release_new_handlers(handlers)
+
+        # Skip any runs we missed while this one was running
+        now = time.time()
+        while job.next_run <= now:
+            job.next_run += job.interval
+        self.write_status()
+
+    def status(self):
+        """:return dict: JSON-serializable status of the daemon"""
+        return {'pid': os.getpid(),
+                'started': datetime.datetime.fromtimestamp(
+                    self.started).isoformat(),
+                'updated': datetime.datetime.now().isoformat(),
+                'jobs': {job.name: job.status() for job in self.jobs},
+                'caches': Cache.stats()}
+
+    def write_status(self):
+        """Atomically rewrite the status file"""
+        dirname = os.path.dirname(os.path.abspath(self.status_file))
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.status(), f, indent=2, sort_keys=True)
+            os.replace(tmpname, self.status_file)
+        except (IOError, OSError) as e:
+            self.logger.error("Couldn't write status file {0}: {1}".format(
+                self.status_file, e))
+
+
+def _current_handlers():
+    """Snapshot of the handlers attached to every logger"""
+    loggers = [logging.getLogger()] + \
+        [l for l in logging.Logger.manager.loggerDict.values()
+         if isinstance(l, logging.Logger)]
+    return {l: set(l.handlers) for l in loggers}
+
+
+def _release_new_handlers(before):
+    """Detach and close handlers that reports attached during a run.  Every
+    report instance adds its own file handler to its logger, so without this
+    a long-lived process would write each log line once per past run."""
+    for l in [logging.getLogger()] + \
+            [l for l in logging.Logger.manager.loggerDict.values()
+             if isinstance(l, logging.Logger)]:
+        for handler in list(l.handlers):
+            if handler not in before.get(l, ()):
+                l.removeHandler(handler)
+                handler.close()
+
+
+def main():
+    args = parse_report_args()
+    logfile_fname = args.logfile if args.logfile is not None else LOGFILE
+
+    try:
+        d = ReportDaemon(config_file=args.config,
+                         status_file=args.status_file,
+                         is_test=args.is_test,
+                         no_email=args.no_email,
+                         verbose=args.verbose,
+                         logfile=logfile_fname)
+        if args.once:
+            sys.exit(1 if d.run_once() else 0)
+        d.run_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
+    except Exception as e:
+        ReportUtils.runerror(args.config, e, traceback.format_exc(),
+                             logfile_fname)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
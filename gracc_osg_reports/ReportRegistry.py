@@ -0,0 +1,136 @@
+"""Registry of the reports in this package, keyed by console script name.
+
+Each entry knows which module and class implement a report and how to build
+and run it from a config file and a time range, the same way the report's
+main() does.  Report modules are only imported when an entry is used, so
+a process that runs one report does not pay for importing the others.
+"""
+
+import datetime
+import importlib
+
+from gracc_reporting import TimeUtils
+
+
+class ReportSpec(object):
+    """How to build and run one report
+
+    :param str module: Module name inside gracc_osg_reports
+    :param str classname: Report class in that module
+    :param str logfile: Default logfile name (the module's LOGFILE)
+    :param bool template: Whether the report takes an HTML template
+    """
+    def __init__(self, module, classname, logfile, template=True):
+        self.module = module
+        self.classname = classname
+        self.logfile = logfile
+        self.template = template
+
+    def load_module(self):
+        """Import and return the report module"""
+        return importlib.import_module('gracc_osg_reports.' + self.module)
+
+    def load(self):
+        """Import and return the report class"""
+        return getattr(self.load_module(), self.classname)
+
+    def create(self, config_file, start=None, end=None, template=None,
+               options=None, **kwargs):
+        """Instantiate the report
+
+        :param str config_file: Report configuration file
+        :param start: Start of report range (str or datetime)
+        :param end: End of report range (str or datetime)
+        :param str template: HTML template file
+        :param dict options: Report-specific constructor arguments, e.g.
+            report_type for the project reports or numrank for the news report
+        :return ReportUtils.Reporter: The report object
+        """
+        kwargs.update(options or {})
+        if self.template:
+            kwargs['template'] = template
+        return self.load()(config_file=config_file, start=start, end=end,
+                           **kwargs)
+
+    def run(self, report):
+        """Run a report created by create()"""
+        report.run_report()
+
+
+class PerSiteSpec(ReportSpec):
+    """The Per Site report always runs over the calendar month of start, or
+    of today without a start (e.g. a daemon job without a period)"""
+    def create(self, config_file, start=None, end=None, template=None,
+               options=None, **kwargs):
+        monthrange = self.load_module().monthrange
+        start = TimeUtils.parse_datetime(start) if start is not None \
+            else datetime.datetime.now().replace(hour=0, minute=0, second=0,
+                                                 microsecond=0)
+        start, end = monthrange(start)
+        return super(PerSiteSpec, self).create(config_file, start, end,
+                                               template, options, **kwargs)
+
+
+class ProbeSpec(ReportSpec):
+    """The Probe report checks the last two days against Topology, and needs
+    the registered probe list at run time"""
+    def create(self, config_file, start=None, end=None, template=None,
+               options=None, **kwargs):
+        module = self.load_module()
+        # ProbeReport defaults to the time its module was imported.  Pass
+        # the current time, so that a long-lived process doesn't report
+        # stale dates.
+        now = datetime.datetime.now()
+        options = dict(options or {})
+        options.setdefault('statefile', None)
+        report = module.ProbeReport(
+            config_file=config_file,
+            start=now - datetime.timedelta(days=2),
+            now=now,
+            **dict(kwargs, **options))
+        report.oiminfo = module.OIMInfo(kwargs.get('verbose', False),
+                                        config=config_file,
+                                        logfile=kwargs.get('logfile'),
+                                        now=now)
+        return report
+
+    def run(self, report):
+        report.run_report(report.oiminfo.get_fqdns_for_probes())
+
+
+REPORTS = {
+    'osgflockingreport': ReportSpec('OSGFlockingReporter', 'FlockingReport',
+                                    'osgflockingreport.log'),
+    'osgprojectreport': ReportSpec('OSGProjectReporter', 'OSGProjectReporter',
+                                   'osgprojectreporter.log'),
+    'osgpersitereport': PerSiteSpec('OSGPerSiteReporter', 'OSGPerSiteReporter',
+                                    'osgpersitereport.log'),
+    'osgprobereport': ProbeSpec('ProbeReport', 'ProbeReport',
+                                'probereport.log', template=False),
+    'osgtopoppusagereport': ReportSpec('TopOppUsageByFacility',
+                                       'TopOppUsageByFacility',
+                                       'topoppusage.log'),
+    'osgmissingprojects': ReportSpec('MissingProject', 'MissingProjectReport',
+                                     'missingproject.log', template=False),
+    'osgmissingvo': ReportSpec('MissingVO', 'MissingVOReporter',
+                               'osgprojectreporter.log'),
+    'monthlysites': ReportSpec('MonthlySitesViewReporter',
+                               'OSGMonthlySitesViewReporter',
+                               'osgmonthlysites.log'),
+    'payloadbatchreport': ReportSpec('PayloadAndPilotHours',
+                                     'PayloadAndPilotHours',
+                                     'osgpayloadandbatch.log'),
+}
+
+
+def get_spec(name):
+    """Look up a report by console script name
+
+    :param str name: e.g. 'osgflockingreport'
+    :return ReportSpec: Spec for that report
+    """
+    try:
+        return REPORTS[name]
+    except KeyError:
+        raise KeyError("Unknown report {0}.  Known reports are {1}".format(
+            name, ', '.join(sorted(REPORTS))))
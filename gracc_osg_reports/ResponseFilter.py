@@ -0,0 +1,104 @@
+"""Trimmed search responses, parsed as plain dicts.
+
+A large aggregation response carries more than the reports read: every
+terms aggregation has its doc_count_error_upper_bound and
+sum_other_doc_count, date histogram buckets their key_as_string, and so on.
+It is then wrapped in elasticsearch_dsl's Response, whose AttrDict and
+AttrList wrap every bucket again as it is read.
+
+With --trim-responses (or trim_responses = true under [elasticsearch] in
+the config file), reports that set response_fields ask Elasticsearch for
+only those fields of their aggregations, with filter_path:
+
+    took,timed_out,_shards,hits.total,aggregations.**.key,
+    aggregations.**.doc_count,aggregations.**.value,aggregations.**.after_key
+
+and their parsers get the aggregations as plain dicts and lists.  filter_path
+leaves out the aggregations (and the bucket lists) that come back empty;
+restore() puts those back from the search, so that the parsers see the same
+structure either way.
+
+If orjson is installed, the client also decodes its responses with it
+(use_fast_decoder()).
+"""
+
+FIELDS = ['key', 'doc_count', 'value', 'after_key']
+TOP_LEVEL = ['took', 'timed_out', '_shards', 'hits.total']
+
+MULTI_BUCKET = {'adjacency_matrix', 'auto_date_histogram', 'composite',
+                'date_histogram', 'date_range', 'filters', 'histogram',
+                'ip_range', 'multi_terms', 'range', 'rare_terms',
+                'significant_terms', 'terms'}
+SINGLE_BUCKET = {'filter', 'global', 'missing', 'nested', 'reverse_nested',
+                 'sampler'}
+
+
+def enabled(config):
+    """:return bool: Whether the config file asks for trimmed responses"""
+    return bool(config.get('elasticsearch', {}).get('trim_responses', False))
+
+
+def filter_path(fields=FIELDS):
+    """:return str: filter_path that keeps the top-level status of a search
+    and these fields of its aggregations"""
+    return ','.join(TOP_LEVEL +
+                    ['aggregations.**.{0}'.format(f) for f in fields])
+
+
+def _agg_type(spec):
+    for key in spec:
+        if key not in ('aggs', 'aggregations', 'meta'):
+            return key
+    return None
+
+
+def restore(aggs, request):
+    """Put back the aggregations and bucket lists that filter_path left out
+    of a response, in place
+
+    :param dict aggs: "aggregations" of the response
+    :param dict request: "aggs" of the search
+    :return dict: aggs
+    """
+    for name, spec in request.items():
+        kind = _agg_type(spec)
+        sub = spec.get('aggs', spec.get('aggregations'))
+        result = aggs.setdefault(name, {})
+        if kind in MULTI_BUCKET:
+            keyed = spec[kind].get('keyed', False) or \
+                (kind == 'filters' and isinstance(spec[kind].get('filters'),
+                                                  dict))
+            buckets = result.setdefault('buckets', {} if keyed else [])
+            if sub:
+                for bucket in (buckets.values() if keyed else buckets):
+                    bucket.setdefault('doc_count', 0)
+                    restore(bucket, sub)
+        elif kind in SINGLE_BUCKET:
+            result.setdefault('doc_count', 0)
+            if sub:
+                restore(result, sub)
+        else:
+            result.setdefault('value', None)
+    return aggs
+
+
+def use_fast_decoder(client):
+    """Have an elasticsearch.Elasticsearch client encode and decode JSON
+    with orjson, if it is installed
+
+    :return bool: Whether the client now uses orjson
+    """
+    try:
+        from elasticsearch.serializer import OrjsonSerializer
+    except ImportError:
+        return False
+    serializers = getattr(getattr(client, 'transport', None), 'serializers',
+                          None)
+    if serializers is None:
+        return False
+
+    serializer = OrjsonSerializer()
+    for mimetype in ('application/json', 'application/vnd.elasticsearch+json'):
+        serializers.serializers[mimetype] = serializer
+    serializers.default_serializer = serializer
+    return True
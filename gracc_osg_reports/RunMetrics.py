@@ -0,0 +1,242 @@
+"""Timings and counts of each report run, for monitoring.
+
+Every OSGReporter keeps a RunMetrics, as run_metrics.  With a [metrics]
+section in the config file (see below), the time that run_report() takes is
+split into phases (see PhaseTimer; each phase counts only its own time):
+
+    lookup      Topology XML and the other Cache lookups
+    query       Elasticsearch searches
+    flatten     Turning the responses into rows (generate,
+                generate_report_file, ...)
+    format      format_report()
+    render      Text, CSV and HTML tables
+    send        Building the email (TextUtils.sendEmail)
+    smtp        Handing each email to the SMTP server
+    run         Everything else
+
+Each search is recorded too, with the time Elasticsearch reports for it
+("took"), the size of the response where the client reports it, the number
+of hits and the number of aggregation buckets.  The run also counts the
+rows and emails it sent.
+
+Each run is then written out as the [metrics] section says:
+
+    [metrics]
+    json = "/var/log/gracc-reporting/metrics.jsonl"
+    textfile = "/var/lib/node_exporter/textfile/gracc_{report_type}.prom"
+
+json gets one JSON record per run, appended.  textfile is overwritten with
+the last run's metrics in the Prometheus text format, for the node
+exporter's textfile collector; give each report its own file, e.g. with
+{report_type}.  A file that can't be written is logged, and doesn't fail the
+report.
+"""
+
+import datetime
+import functools
+import json
+import os
+import re
+import smtplib
+import time
+
+from gracc_reporting import TextUtils
+
+from . import Cache, StreamingTable
+from .Timing import PhaseTimer
+
+PARSERS = ['generate', 'generate_report_file', 'generate_report',
+           'generate_comparison']
+PROMETHEUS_PREFIX = 'gracc_report'
+
+
+def enabled(config):
+    """:return bool: Whether the config file asks for run metrics to be
+    written"""
+    return bool(config.get('metrics'))
+
+
+def count_buckets(agg):
+    """:return int: Number of aggregation buckets, at every level, in a raw
+    aggregations dict"""
+    n = 0
+    if isinstance(agg, dict):
+        for key, value in agg.items():
+            if key == 'buckets':
+                buckets = value.values() if isinstance(value, dict) else value
+                n += len(buckets)
+                n += sum(count_buckets(b) for b in buckets)
+            elif isinstance(value, dict):
+                n += count_buckets(value)
+    return n
+
+
+def content_length(raw):
+    """:return int: Size in bytes of a raw client response, or None if the
+    client didn't report it"""
+    try:
+        return int(raw.meta.headers['content-length'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _escape(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+class RunMetrics(PhaseTimer):
+    """Phase times, searches and counts of report runs
+
+    :param str report_type: Report type, used as the report label
+    """
+    def __init__(self, report_type):
+        super(RunMetrics, self).__init__()
+        self.report_type = report_type
+        self.searches = []
+        self.counts = {}
+        self.started = None
+        self.success = None
+
+    def reset(self):
+        super(RunMetrics, self).reset()
+        self.searches = []
+        self.counts = {}
+        self.started = None
+        self.success = None
+
+    def count(self, name, n=1):
+        """Add n to counter name"""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def record_search(self, index, body, seconds=None, nbytes=None):
+        """Record one search
+
+        :param index: Index name or list of names searched
+        :param dict body: Raw response
+        :param float seconds: Wall-clock time of the request, if known
+        :param int nbytes: Size of the response, if known
+        """
+        total = body.get('hits', {}).get('total')
+        if isinstance(total, dict):
+            total = total.get('value')
+        self.searches.append({
+            'index': index if isinstance(index, (str, type(None)))
+                     else ','.join(index),
+            'took_ms': body.get('took'),
+            'seconds': seconds,
+            'bytes': nbytes,
+            'hits': total,
+            'buckets': count_buckets(body.get('aggregations', {}))})
+
+    def measured(self, report):
+        """Wrap report.run_report so that each call resets and fills in
+        these metrics, and writes them out as configured
+
+        :param OSGReporter report: Report to measure
+        :return function: Wrapped run_report
+        """
+        func = report.run_report
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.reset()
+            self.started = datetime.datetime.now()
+            self.wrap(Cache.TTLCache, 'get', 'lookup')
+            self.wrap(TextUtils.TextUtils, 'printAsTextTable', 'render')
+            self.wrap(TextUtils, 'sendEmail', 'send')
+            self.wrap(smtplib.SMTP, 'sendmail', 'smtp')
+            self.wrap(StreamingTable, 'render_html', 'render')
+            self.wrap(report, 'format_report', 'format')
+            for method in PARSERS:
+                if hasattr(report, method):
+                    self.wrap(report, method, 'flatten')
+            self.success = False
+            try:
+                with self.phase('run'):
+                    result = func(*args, **kwargs)
+                self.success = True
+                return result
+            finally:
+                self.unwrap_all()
+                self.write(report.config, report.logger)
+        return wrapper
+
+    def record(self):
+        """:return dict: This run as a JSON-serializable record"""
+        counts = dict(self.counts)
+        counts['searches'] = len(self.searches)
+        counts['buckets'] = sum(s['buckets'] for s in self.searches)
+        counts['emails'] = self.calls.get('smtp', 0)
+        return {'report': self.report_type,
+                'started': self.started.isoformat() if self.started else None,
+                'success': self.success,
+                'seconds': sum(self.times.values()),
+                'phases': dict(self.times),
+                'counts': counts,
+                'searches': self.searches}
+
+    def prometheus(self, record=None):
+        """:return str: This run in the Prometheus text format"""
+        record = record or self.record()
+        label = 'report="{0}"'.format(_escape(self.report_type))
+        took = [s['took_ms'] for s in self.searches
+                if s['took_ms'] is not None]
+        nbytes = [s['bytes'] for s in self.searches if s['bytes'] is not None]
+        metrics = [
+            ('last_run_timestamp_seconds', 'gauge',
+             'Start time of the last run',
+             [(label, time.mktime(self.started.timetuple())
+               if self.started else 0)]),
+            ('success', 'gauge', 'Whether the last run succeeded',
+             [(label, int(bool(self.success)))]),
+            ('duration_seconds', 'gauge', 'Wall-clock time of the last run',
+             [(label, record['seconds'])]),
+            ('phase_seconds', 'gauge',
+             'Time spent in each phase of the last run',
+             [('{0},phase="{1}"'.format(label, _escape(phase)), seconds)
+              for phase, seconds in sorted(record['phases'].items())]),
+            ('search_took_seconds', 'gauge',
+             'Elasticsearch "took" time of the searches of the last run',
+             [(label, sum(took) / 1000.)]),
+            ('response_bytes', 'gauge',
+             'Size of the Elasticsearch responses of the last run',
+             [(label, sum(nbytes))]),
+            ('items', 'gauge',
+             'Searches, buckets, rows and emails of the last run',
+             [('{0},item="{1}"'.format(label, _escape(name)), n)
+              for name, n in sorted(record['counts'].items())]),
+        ]
+        lines = []
+        for name, kind, help, samples in metrics:
+            name = '{0}_{1}'.format(PROMETHEUS_PREFIX, name)
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{0}{{{1}}} {2}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, config, logger):
+        """Write this run to the files given in the [metrics] section of the
+        config file"""
+        if not enabled(config):
+            return
+        options = config['metrics']
+        name = re.sub(r'[^a-z0-9]+', '_', self.report_type.lower()).strip('_')
+        record = self.record()
+        try:
+            if options.get('json'):
+                path = options['json'].replace('{report_type}', name)
+                with open(path, 'a') as f:
+                    f.write(json.dumps(record, sort_keys=True) + '\n')
+            if options.get('textfile'):
+                # Written whole and renamed, so that the collector never
+                # reads half a file
+                path = options['textfile'].replace('{report_type}', name)
+                tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+                with open(tmp, 'w') as f:
+                    f.write(self.prometheus(record))
+                os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("Could not write run metrics: {0}".format(e))
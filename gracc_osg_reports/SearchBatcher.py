@@ -0,0 +1,157 @@
+"""Send several Elasticsearch searches as one _msearch request.
+
+Searches are queued with add(), which returns a PendingSearch.  flush() sends
+everything that is queued, in _msearch requests of at most max_batch_size
+searches each, and hands every response back to the PendingSearch it belongs
+to.  An error for one search (a bad query, a missing index) only fails that
+search: the rest of the batch is still returned, and the failed search's
+PendingSearch raises SearchItemError when its result is asked for.
+"""
+
+import json
+import logging
+
+DEFAULT_MAX_BATCH_SIZE = 20
+
+
+class SearchItemError(Exception):
+    """One search in an _msearch request failed
+
+    :param search: elasticsearch_dsl.Search that failed
+    :param dict error: The error returned by Elasticsearch for that search
+    :param int status: HTTP status for that search
+    """
+    def __init__(self, search, error, status=None):
+        self.search = search
+        self.error = error
+        self.status = status
+        reason = error.get('reason', error) if isinstance(error, dict) \
+            else error
+        super(SearchItemError, self).__init__(
+            "Search on {0} failed (status {1}): {2}".format(
+                search._index, status, reason))
+
+
+class PendingSearch(object):
+    """A search queued in a SearchBatcher, and later its response
+
+    :param search: elasticsearch_dsl.Search
+    """
+    def __init__(self, search):
+        self.search = search
+        self.response = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.response is not None or self.error is not None
+
+    def result(self):
+        """:return elasticsearch_dsl.response.Response: Response for the
+        search.  Raises SearchItemError if the search failed, and
+        RuntimeError if it hasn't been sent yet."""
+        if self.error is not None:
+            raise self.error
+        if self.response is None:
+            raise RuntimeError("Search has not been sent yet.  Call "
+                               "SearchBatcher.flush() first")
+        return self.response
+
+
+def search_key(search):
+    """Key that identifies a search by its index and request body, so that
+    two Search objects built the same way get the same key
+
+    :param search: elasticsearch_dsl.Search
+    :return str: Key
+    """
+    return json.dumps({'index': search._index, 'body': search.to_dict()},
+                      sort_keys=True, default=str)
+
+
+class SearchBatcher(object):
+    """Collects searches and sends them through _msearch
+
+    :param client: elasticsearch.Elasticsearch to send the requests with
+    :param int max_batch_size: Most searches to put in one _msearch request
+    :param logging.Logger logger: Logger.  Defaults to this module's logger.
+    """
+    def __init__(self, client, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 logger=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1, not "
+                             "{0}".format(max_batch_size))
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.logger = logger if logger is not None else \
+            logging.getLogger('gracc_osg_reports.SearchBatcher')
+        self._pending = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, search):
+        """Queue a search
+
+        :param search: elasticsearch_dsl.Search
+        :return PendingSearch: Holds the response once flush() is called
+        """
+        pending = PendingSearch(search)
+        self._pending.append(pending)
+        return pending
+
+    def flush(self):
+        """Send all queued searches and fill in their PendingSearch objects.
+        Errors for individual searches are stored on their PendingSearch.  An
+        error for a whole request (connection failure, etc.) marks that
+        request's searches and any unsent ones failed, and is then raised.
+
+        :return int: Number of _msearch requests sent
+        """
+        pending, self._pending = self._pending, []
+        requests = 0
+        for i in range(0, len(pending), self.max_batch_size):
+            batch = pending[i:i + self.max_batch_size]
+            requests += 1
+            try:
+                self._send(batch)
+            except Exception as e:
+                for p in pending[i:]:
+                    if not p.done:
+                        p.error = e
+                raise
+        return requests
+
+    def execute(self, searches):
+        """Queue searches, send them, and return their PendingSearch objects
+        in the same order
+
+        :param list searches: elasticsearch_dsl.Search objects
+        :return list: PendingSearch for each search
+        """
+        pendings = [self.add(s) for s in searches]
+        self.flush()
+        return pendings
+
+    def _send(self, batch):
+        body = []
+        for p in batch:
+            body.append({'index': p.search._index} if p.search._index
+                        else {})
+            body.append(p.search.to_dict())
+
+        self.logger.debug("Sending _msearch with {0} searches".format(
+            len(batch)))
+        raw = self.client.msearch(body=body)
+        responses = raw['responses']
+        if len(responses) != len(batch):
+            raise Exception("_msearch returned {0} responses for {1} searches"
+                            .format(len(responses), len(batch)))
+
+        for p, r in zip(batch, responses):
+            if r.get('error'):
+                p.error = SearchItemError(p.search, r['error'],
+                                          r.get('status'))
+                self.logger.warning(str(p.error))
+            else:
+                p.response = p.search._response_class(p.search, r)
@@ -0,0 +1,239 @@
+"""Keep each run's report table, so that a report can send only what changed.
+
+Snapshots are kept under a directory given in the [snapshots] section of the
+config file, one subdirectory per report, one file per report period:
+
+    <directory>/<report>/<start>_<end>.parquet
+
+Parquet (compressed with zstd) needs pyarrow, installed with the parquet
+extra.  Without it, snapshots are written as gzipped CSV instead; both are
+read back either way.  After every save, the oldest snapshots are deleted
+until the store fits in max_mb, but the latest snapshot of each report is
+always kept.
+
+changed_rows() compares a table with the previous snapshot with one merge on
+the key columns, rather than row by row.  By default only rows with new keys
+count as changed; with an rtol, so do rows whose values moved by more than
+that.
+"""
+
+import logging
+import os
+
+DEFAULT_DIRNAME = 'gracc-osg-reports-snapshots'
+PERIOD_FMT = '%Y%m%dT%H%M%S'
+EXTENSIONS = ('.parquet', '.csv.gz')
+
+
+def have_parquet():
+    """:return bool: Whether pyarrow is available to write Parquet"""
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def period_key(start, end):
+    """File name stem for a report period
+
+    :param datetime.datetime start: Start of the report range
+    :param datetime.datetime end: End of the report range
+    :return str: Stem that sorts in time order
+    """
+    return '{0}_{1}'.format(start.strftime(PERIOD_FMT),
+                            end.strftime(PERIOD_FMT))
+
+
+def _strip_ext(fname):
+    for ext in EXTENSIONS:
+        if fname.endswith(ext):
+            return fname[:-len(ext)]
+    return None
+
+
+def _key_frame(frame, keys):
+    """Key columns as strings, so that a table and its CSV round trip
+    compare equal"""
+    return frame[keys].fillna('').astype(str)
+
+
+def changed_rows(current, previous, keys, rtol=None):
+    """Rows of current whose keys are not in previous, or, with an rtol,
+    whose values differ
+
+    :param pandas.DataFrame current: This run's table
+    :param pandas.DataFrame previous: The previous snapshot, or None
+    :param list keys: Columns that identify a row
+    :param float rtol: Relative tolerance for numeric values.  None to
+        compare the keys only
+    :return pandas.DataFrame: The new or changed rows of current, in their
+        original order
+    """
+    import numpy as np
+    import pandas as pd
+
+    if previous is None or previous.empty:
+        return current
+    if current.empty:
+        return current
+
+    values = [] if rtol is None else \
+        [col for col in current.columns
+         if col not in keys and col in previous.columns]
+    left = _key_frame(current, keys)
+    right = _key_frame(previous, keys)
+    for col in values:
+        left[col] = current[col].values
+        right[col] = previous[col].values
+    right = right.drop_duplicates(subset=keys, keep='last')
+
+    merged = left.merge(right, on=keys, how='left', suffixes=('', '_prev'),
+                        indicator=True)
+    changed = (merged['_merge'] == 'left_only').to_numpy(copy=True)
+    for col in values:
+        new, old = merged[col], merged[col + '_prev']
+        if pd.api.types.is_numeric_dtype(new) and \
+                pd.api.types.is_numeric_dtype(old):
+            same = np.isclose(new.values.astype(float),
+                              old.values.astype(float),
+                              rtol=rtol, atol=0., equal_nan=True)
+        else:
+            same = (new.isna() & old.isna()).values | \
+                   (new.astype(str) == old.astype(str)).values
+        changed |= ~same
+    return current[changed]
+
+
+class SnapshotStore(object):
+    """Directory of report table snapshots
+
+    :param str directory: Where to keep the snapshots
+    :param float max_mb: Size budget for the whole store.  None for no limit.
+    :param logging.Logger logger: Logger
+    """
+    def __init__(self, directory, max_mb=None, logger=None):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 2**20) if max_mb is not None else None
+        self.logger = logger if logger is not None \
+            else logging.getLogger(__name__)
+
+    @classmethod
+    def from_config(cls, config, logger=None):
+        """Store configured by the [snapshots] section of config.  The
+        directory defaults to one under default_logdir.
+
+        :param dict config: Parsed report config
+        :return SnapshotStore:
+        """
+        section = config.get('snapshots', {})
+        directory = section.get('directory', os.path.join(
+            config.get('default_logdir', '/var/log'), DEFAULT_DIRNAME))
+        return cls(directory, max_mb=section.get('max_mb'), logger=logger)
+
+    def _reportdir(self, name):
+        return os.path.join(self.directory, name.replace(os.sep, '_'))
+
+    def snapshots(self, name):
+        """Snapshots of a report, oldest period first
+
+        :param str name: Report name
+        :return list: (period key, path) tuples
+        """
+        reportdir = self._reportdir(name)
+        if not os.path.isdir(reportdir):
+            return []
+        found = {}
+        for fname in os.listdir(reportdir):
+            stem = _strip_ext(fname)
+            if stem is not None:
+                # Prefer Parquet if a period has both
+                if stem not in found or fname.endswith('.parquet'):
+                    found[stem] = os.path.join(reportdir, fname)
+        return sorted(found.items())
+
+    def previous(self, name, period):
+        """Load the latest snapshot of a report from before period
+
+        :param str name: Report name
+        :param str period: Period key (see period_key)
+        :return pandas.DataFrame: The snapshot, or None if there is none
+        """
+        older = [path for key, path in self.snapshots(name) if key < period]
+        if not older:
+            return None
+        self.logger.info("Comparing with snapshot {0}".format(older[-1]))
+        return self.load(older[-1])
+
+    @staticmethod
+    def load(path):
+        """Read a snapshot file
+
+        :param str path: Snapshot file
+        :return pandas.DataFrame: Table
+        """
+        import pandas as pd
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        return pd.read_csv(path, compression='gzip', keep_default_na=False,
+                           na_values=[''])
+
+    def save(self, name, period, frame):
+        """Write a snapshot, replacing any earlier one of the same period,
+        then trim the store to its size budget
+
+        :param str name: Report name
+        :param str period: Period key (see period_key)
+        :param pandas.DataFrame frame: Table to keep
+        :return str: Path of the snapshot
+        """
+        reportdir = self._reportdir(name)
+        os.makedirs(reportdir, exist_ok=True)
+        ext = '.parquet' if have_parquet() else '.csv.gz'
+        path = os.path.join(reportdir, period + ext)
+        tmpname = path + '.tmp'
+        if ext == '.parquet':
+            frame.to_parquet(tmpname, index=False, compression='zstd')
+        else:
+            frame.to_csv(tmpname, index=False, compression='gzip')
+        os.replace(tmpname, path)
+        for other in EXTENSIONS:
+            stale = os.path.join(reportdir, period + other)
+            if other != ext and os.path.exists(stale):
+                os.unlink(stale)
+        self.logger.info("Saved snapshot {0}".format(path))
+        self.prune()
+        return path
+
+    def prune(self):
+        """Delete the oldest snapshots until the store fits in its budget.
+        The latest snapshot of each report is never deleted.
+
+        :return list: Paths deleted
+        """
+        if self.max_bytes is None or not os.path.isdir(self.directory):
+            return []
+        keep = set()
+        candidates = []
+        total = 0
+        for name in os.listdir(self.directory):
+            snaps = self.snapshots(name)
+            for i, (_, path) in enumerate(snaps):
+                stat = os.stat(path)
+                total += stat.st_size
+                if i == len(snaps) - 1:
+                    keep.add(path)
+                else:
+                    candidates.append((stat.st_mtime, stat.st_size, path))
+
+        deleted = []
+        for _, size, path in sorted(candidates):
+            if total <= self.max_bytes:
+                break
+            os.unlink(path)
+            total -= size
+            deleted.append(path)
+        if deleted:
+            self.logger.info("Deleted {0} old snapshots to stay under {1} "
+                             "bytes".format(len(deleted), self.max_bytes))
+        return deleted
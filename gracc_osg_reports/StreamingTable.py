@@ -0,0 +1,144 @@
+"""Render report tables row by row.
+
+ReportUtils.Reporter.send_report builds the whole table as a dict of columns,
+converts it to a DataFrame and renders the text, CSV and HTML versions in
+memory.  For tables with tens of thousands of rows, the functions here take
+a row iterator instead and write the HTML table to a file-like sink a chunk
+of rows at a time.  With a row cap, only the first rows go into the HTML
+(the email body), and every row is written to a gzipped CSV that can be sent
+as an attachment.
+"""
+
+import csv
+import gzip
+import html
+import io
+
+CHUNK_ROWS = 500        # Rows rendered per write to the sink
+
+
+def format_cell(value):
+    """Format one table cell like the rest of the reports do (tabulate with
+    floatfmt ',.0f')
+
+    :param value: Cell value
+    :return str: Formatted cell
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:      # NaN
+            return ''
+        return '{0:,.0f}'.format(value)
+    return str(value)
+
+
+def html_row(cells, tag='td'):
+    """One HTML table row.  The last column is right-aligned, as in
+    TextUtils.printAsTextTable.
+
+    :param list cells: Cell values
+    :param str tag: 'td' or 'th'
+    :return str: <tr> element
+    """
+    last = len(cells) - 1
+    return '<tr>{0}</tr>\n'.format(''.join(
+        '<{0}{1}>{2}</{0}>'.format(
+            tag, ' style="text-align: right;"' if i == last else '',
+            html.escape(format_cell(cell)))
+        for i, cell in enumerate(cells)))
+
+
+def split_template(template_text, **fields):
+    """Split an HTML report template around its {table} field, and fill in
+    the other fields (title, header)
+
+    :param str template_text: Contents of html_templates/template_*.html
+    :return tuple: (text before the table, text after the table)
+    """
+    before, sep, after = template_text.partition('{table}')
+    if not sep:
+        raise ValueError("HTML template has no {table} field")
+    return before.format(table='', **fields), after.format(table='', **fields)
+
+
+class CSVGzipWriter(object):
+    """Write rows to a gzipped CSV in memory
+
+    :param list header: Column names
+    :param int compresslevel: gzip compression level
+    """
+    def __init__(self, header, compresslevel=6):
+        self.buffer = io.BytesIO()
+        self._gz = gzip.GzipFile(fileobj=self.buffer, mode='wb',
+                                 compresslevel=compresslevel)
+        self._text = io.TextIOWrapper(self._gz, encoding='utf-8', newline='')
+        self._csv = csv.writer(self._text)
+        self._csv.writerow(header)
+
+    def writerow(self, row):
+        self._csv.writerow(['' if cell is None else cell for cell in row])
+
+    def close(self):
+        """Finish the gzip stream
+
+        :return bytes: The compressed CSV
+        """
+        if not self._text.closed:
+            self._text.close()      # Closes the GzipFile, not self.buffer
+        return self.buffer.getvalue()
+
+
+def render_html(rows, header, sink, template_text=None, title='',
+                row_cap=None, overflow=None, chunk_rows=CHUNK_ROWS):
+    """Write an HTML report table from a row iterator to sink
+
+    :param rows: Iterable of row sequences, in header order
+    :param list header: Column names
+    :param sink: File-like object with a write(str) method
+    :param str template_text: HTML template with {title}, {header} and
+        {table} fields.  If None, a bare page is written.
+    :param str title: Report title
+    :param int row_cap: Most rows to put in the HTML table.  None for all.
+    :param overflow: Object with a writerow(row) method (e.g. CSVGzipWriter)
+        that gets every row, including the ones past row_cap
+    :param int chunk_rows: Rows per write to sink
+    :return tuple: (number of rows, number of rows left out of the HTML)
+    """
+    htmlheader = '\n'.join('<th>{0}</th>'.format(html.escape(str(col)))
+                           for col in header)
+    if template_text is not None:
+        before, after = split_template(template_text, title=title,
+                                       header=htmlheader)
+    else:
+        before = '<html><body><h2>{0}</h2>'.format(html.escape(title))
+        after = '</body></html>'
+
+    sink.write(before)
+    sink.write('<table border=1>\n<thead>\n' if template_text is None
+               else '<table>\n<thead>\n')
+    sink.write(html_row(header, tag='th'))
+    sink.write('</thead>\n<tbody>\n')
+
+    nrows = 0
+    chunk = []
+    for row in rows:
+        nrows += 1
+        if overflow is not None:
+            overflow.writerow(row)
+        if row_cap is not None and nrows > row_cap:
+            continue        # Keep counting (and feeding overflow)
+        chunk.append(html_row(row))
+        if len(chunk) >= chunk_rows:
+            sink.write(''.join(chunk))
+            chunk = []
+    sink.write(''.join(chunk))
+
+    truncated = max(0, nrows - row_cap) if row_cap is not None else 0
+    if truncated:
+        sink.write('<tr><td colspan="{0}"><i>{1:,} more rows not shown.  '
+                   'The full table is attached.</i></td></tr>\n'.format(
+                       len(header), truncated))
+    sink.write('</tbody>\n</table>')
+    sink.write(after)
+    return nrows, truncated
@@ -0,0 +1,114 @@
+"""Wall-clock time spent in each phase of a report run.
+
+A PhaseTimer keeps one running total per phase name.  Phases nest, and time
+is only counted for the innermost phase: while a 'format' phase runs inside
+a 'run' phase, the clock runs for 'format' only.  So the totals add up to
+the time spent in the outermost phases.
+
+    timer = PhaseTimer()
+    with timer.phase('query'):
+        response = search.execute()
+    timer.wrap(TextUtils.TextUtils, 'printAsTextTable', 'render')
+    ...
+    timer.unwrap_all()
+    timer.totals()              # {'query': 1.2, 'render': 0.3}
+
+wrap() times every call of a method or function.  For generator functions,
+the time spent producing each item is counted, not just the call.
+"""
+
+import contextlib
+import functools
+import inspect
+import time
+
+
+class PhaseTimer(object):
+    """Accumulates exclusive wall-clock time per phase
+
+    :param function clock: Returns the current time in seconds
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.times = {}
+        self.calls = {}
+        self._stack = []
+        self._patches = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Context manager that counts the time spent inside it (less the
+        time spent in phases nested inside it) for phase name"""
+        frame = [name, self.clock(), 0.]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = self.clock() - frame[1]
+            self.times[name] = self.times.get(name, 0.) + elapsed - frame[2]
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def timed(self, func, name):
+        """Wrap func so that every call (or, for a generator function, every
+        item it produces) is timed as phase name
+
+        :return function: Wrapped function
+        """
+        timer = self
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                gen = func(*args, **kwargs)
+                while True:
+                    with timer.phase(name):
+                        try:
+                            item = next(gen)
+                        except StopIteration as stop:
+                            return stop.value
+                    yield item
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with timer.phase(name):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    def wrap(self, obj, attr, name):
+        """Time every call of obj.attr as phase name, until unwrap_all().
+        obj can be a module, a class or an instance.
+
+        :param obj: Object that has the function as an attribute
+        :param str attr: Attribute name
+        :param str name: Phase name
+        """
+        raw = inspect.getattr_static(obj, attr)
+        if isinstance(raw, (staticmethod, classmethod)):
+            wrapped = type(raw)(self.timed(raw.__func__, name))
+        elif inspect.ismodule(obj) or inspect.isclass(obj):
+            wrapped = self.timed(raw, name)
+        else:
+            # Instance: wrap the bound method, so the wrapper needs no self
+            wrapped = self.timed(getattr(obj, attr), name)
+        self._patches.append((obj, attr, attr in vars(obj), raw))
+        setattr(obj, attr, wrapped)
+
+    def unwrap_all(self):
+        """Undo every wrap(), most recent first"""
+        while self._patches:
+            obj, attr, had_own, raw = self._patches.pop()
+            if had_own:
+                setattr(obj, attr, raw)
+            else:
+                delattr(obj, attr)
+
+    def totals(self):
+        """:return dict: Seconds spent in each phase"""
+        return dict(self.times)
+
+    def reset(self):
+        """Clear the totals"""
+        self.times = {}
+        self.calls = {}
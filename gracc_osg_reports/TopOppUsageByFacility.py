@@ -13,11 +13,19 @@ from elasticsearch_dsl import Search
 
 from gracc_reporting import ReportUtils, TimeUtils
 from gracc_reporting.NiceNum import niceNum
+from . import Backfill
+from .OSGReporter import OSGReporter, get_report_parser, report_kwargs
 #from .NameCorrection import NameCorrection
 
 
 LOGFILE = 'topoppusage.log'
 MAXINT = 2**31-1
+OTHERS = 'All other facilities'
+# Each shard returns at least this many facilities (or SHARD_SIZE_FACTOR
+# times numrank), which covers every facility in practice, so that the top
+# numrank are ranked exactly without asking every shard for MAXINT buckets
+MIN_SHARD_SIZE = 500
+SHARD_SIZE_FACTOR = 10
 facilities = {}
 
 
@@ -58,29 +66,38 @@ def parse_report_args():
     Specific argument parser for this report.
     :return: Namespace of parsed arguments
     """
-    parser = argparse.ArgumentParser(parents=[ReportUtils.get_report_parser()])
+    parser = argparse.ArgumentParser(parents=[get_report_parser()])
     parser.add_argument("-m", "--months", dest="months",
                         help="Number of months to run report for",
                         default=None, type=int)
     parser.add_argument("-N", "--numrank", dest="numrank",
                         help="Number of Facilities to rank",
                         default=None, type=int)
-    return parser.parse_args()
+    parser.add_argument("--compare", dest="compare", action="store_true",
+                        default=False,
+                        help="Compare with the prior period of the same "
+                             "length (rank and percent change)")
+    args = parser.parse_args()
+    Backfill.check_args(parser, args)
+    return args
 
 
-class TopOppUsageByFacility(ReportUtils.Reporter):
+class TopOppUsageByFacility(OSGReporter):
     """
     Class to hold information and generate Top Opp Usage by Facility report
 
     :param str config: Report Configuration file
     :param str start: Start time of report range
     :param str end: End time of report range
-    :param int numrank: Number of Facilities to rank.  Default 10.
+    :param int numrank: Number of Facilities to rank.  Default 10.  If None,
+    list all facilities.
     :param int months: Number of months prior to today to set start of report
     range
+    :param bool compare: Also query the prior period, in the same request, and
+    add rank and percent change columns
     """
     def __init__(self, config_file, start=None, end=None, numrank=10, 
-                 months=None, **kwargs):
+                 months=None, compare=False, **kwargs):
         report = 'news'
 
 
@@ -91,15 +108,21 @@ class TopOppUsageByFacility(ReportUtils.Reporter):
                                                     **kwargs)
 
         self.numrank = numrank
+        self.compare = compare
         self.text = ''
         self.table = ''
         self.daterange = get_time_range(self.start_time, self.end_time, months)
 
         dates_formatted = (x.strftime("%Y-%m-%d %H:%M") for x in self.daterange.current)
-        self.title = "Opportunistic Resources provided by the top {0} OSG " \
+        ranked = "the top {0} ".format(self.numrank) if self.numrank else ""
+        self.title = "Opportunistic Resources provided by {0}OSG " \
                      "Sites for the OSG Open Facility ({1} - {2})".format(
-                        self.numrank, *dates_formatted)
+                        ranked, *dates_formatted)
         self.header = ["Facility", "Core Hours"]
+        if self.compare:
+            self.title += ", compared with the prior period"
+            self.header.extend(["Prior Core Hours", "Rank Change",
+                                "% Change"])
 
     def run_report(self):
         """Handles the data flow throughout the report generation.  Generates
@@ -117,8 +140,7 @@ class TopOppUsageByFacility(ReportUtils.Reporter):
         :return elasticsearch_dsl.Search: Search object containing ES query
         """
         # Gather parameters, format them for the query
-        starttimeq = self.start_time.isoformat()
-        endtimeq = self.end_time.isoformat()
+        start, end = self.start_time, self.end_time
 
         probelist = self.config[self.report_type.lower()]['OSG_flocking_probe_list']
 
@@ -126,21 +148,94 @@ class TopOppUsageByFacility(ReportUtils.Reporter):
             self.logger.info(self.indexpattern)
             self.logger.info(probelist)
 
+        if self.compare:
+            # Both periods in one request, split by a date_range aggregation
+            start = self.daterange.prior.start
+            end = self.daterange.current.end
+
         # Elasticsearch query and aggregations
-        s = Search(using=self.client, index=self.indexpattern) \
-                .filter("range", EndTime={"gte": starttimeq, "lt": endtimeq}) \
+        s = Search(using=self.client, index=self.indices(start, end)) \
+                .filter("range", EndTime={"gte": start.isoformat(),
+                                          "lt": end.isoformat()}) \
                 .filter("terms", ProbeName=probelist) \
                 .filter("term", ResourceType="Payload")[0:0]
 
         # Size 0 to return only aggregations
+        if self.compare:
+            Period = s.aggs.bucket(
+                'period', 'date_range', field='EndTime', keyed=True,
+                ranges=[{'key': key,
+                         'from': getattr(self.daterange, key).start.isoformat(),
+                         'to': getattr(self.daterange, key).end.isoformat()}
+                        for key in ('prior', 'current')])
+            self.add_aggs(Period)
+        else:
+            self.add_aggs(s.aggs)
+
+        print(s.to_dict())
+        return s
 
-        Bucket = s.aggs.bucket('OIM_Facility', 'terms', field='OIM_Facility',
-                                   size=MAXINT, order={'CoreHours': 'desc'})
+    def shard_size(self):
+        """Number of facilities each shard returns when only the top
+        numrank are asked for.  Can be set with shard_size in the [news]
+        section of the config file.
+
+        :return int: shard_size for the OIM_Facility terms aggregation
+        """
+        configured = self.config[self.report_type.lower()].get('shard_size')
+        if configured is not None:
+            return configured
+        return max(self.numrank * SHARD_SIZE_FACTOR, MIN_SHARD_SIZE)
+
+    def add_aggs(self, aggs):
+        """Add the facility ranking aggregations: the top numrank facilities
+        by CoreHours (all of them if numrank is None), plus the total
+        CoreHours and the number of facilities, so that the rest can be
+        summed up in one row and the ranking can be checked for accuracy
+
+        :param aggs: Search.aggs, or the bucket to add them under
+        :return None
+        """
+        if self.numrank:
+            Bucket = aggs.bucket('OIM_Facility', 'terms', field='OIM_Facility',
+                                 size=self.numrank,
+                                 shard_size=self.shard_size(),
+                                 order={'CoreHours': 'desc'})
+            aggs.metric('TotalCoreHours', 'sum', field='CoreHours')
+            aggs.metric('NumFacilities', 'cardinality', field='OIM_Facility')
+        else:
+            Bucket = aggs.bucket('OIM_Facility', 'terms', field='OIM_Facility',
+                                 size=MAXINT, order={'CoreHours': 'desc'})
 
         Bucket.metric('CoreHours', 'sum', field='CoreHours')
 
-        print(s.to_dict())
-        return s
+    def ranking_note(self, results):
+        """Check whether the top numrank facilities are ranked exactly.
+        Elasticsearch doesn't compute doc_count_error_upper_bound when the
+        buckets are ordered by a metric (it returns -1), so the ranking is
+        also known to be exact when no shard can have more facilities than
+        it returned (NumFacilities <= shard_size).
+
+        :param results: Aggregations from the query
+        :return str: Note for the report title if the ranking may be
+            inexact, else None
+        """
+        if not self.numrank:
+            return None
+
+        error = results.OIM_Facility.doc_count_error_upper_bound
+        nfacilities = results.NumFacilities.value
+        shard_size = self.shard_size()
+        self.logger.info("Facility ranking: doc_count_error_upper_bound {0}, "
+                         "{1} facilities, shard_size {2}".format(
+                            error, nfacilities, shard_size))
+
+        if error == 0 or nfacilities <= shard_size:
+            return None
+        if error > 0:
+            return "ranking may be off by up to {0} records".format(error)
+        return "ranking may be approximate: {0} facilities, shard_size " \
+               "{1}".format(nfacilities, shard_size)
 
     def generate_report(self):
         """
@@ -192,9 +287,76 @@ class TopOppUsageByFacility(ReportUtils.Reporter):
         allterms = copy.copy(unique_terms)
         allterms.extend(metrics)
 
+        note = self.ranking_note(results)
+        if note is not None:
+            self.logger.warning(note)
+            self.title = "{0} ({1})".format(self.title, note)
+
         for entry in data:
             yield [entry[field] for field in allterms]
 
+        # Everything outside of the top numrank, in one row
+        if self.numrank and results.OIM_Facility.sum_other_doc_count:
+            top = sum(entry['CoreHours'] for entry in data if entry)
+            yield [OTHERS, results.TotalCoreHours.value - top]
+
+
+    def period_frame(self, results):
+        """Facilities of one period, with their rank
+
+        :param results: Aggregations (or date_range bucket) for the period
+        :return pandas.DataFrame: Facility, Core Hours and Rank columns, and
+            the CoreHours outside of the top numrank
+        """
+        import pandas as pd
+
+        df = pd.DataFrame([(b.key, b.CoreHours.value)
+                           for b in results.OIM_Facility.buckets],
+                          columns=['Facility', 'Core Hours'])
+        df['Rank'] = df['Core Hours'].rank(ascending=False, method='min')
+
+        others = None
+        if self.numrank and results.OIM_Facility.sum_other_doc_count:
+            others = results.TotalCoreHours.value - df['Core Hours'].sum()
+        return df, others
+
+    def generate_comparison(self):
+        """Runs the query for both periods and computes each facility's rank
+        and percent change from the prior period
+
+        :return pandas.DataFrame: One row per facility in the current top
+            numrank (plus the other facilities), columns as in self.header
+        """
+        import numpy as np
+        import pandas as pd
+
+        results = self.run_query()
+        periods = results.period.buckets
+
+        note = self.ranking_note(periods.current)
+        if note is not None:
+            self.logger.warning(note)
+            self.title = "{0} ({1})".format(self.title, note)
+
+        current, cur_others = self.period_frame(periods.current)
+        prior, pri_others = self.period_frame(periods.prior)
+
+        df = current.merge(prior, on='Facility', how='left',
+                           suffixes=('', ' Prior'))
+        # Facilities that weren't in the prior top numrank get no change
+        df['Rank Change'] = df['Rank Prior'] - df['Rank']
+        df['% Change'] = (df['Core Hours'] / df['Core Hours Prior'] - 1) * 100
+        df = df.rename(columns={'Core Hours Prior': 'Prior Core Hours'})
+
+        if cur_others is not None:
+            df = pd.concat([df, pd.DataFrame(
+                [{'Facility': OTHERS,
+                  'Core Hours': cur_others,
+                  'Prior Core Hours': pri_others if pri_others is not None
+                  else np.nan}])], ignore_index=True)
+
+        df = df[self.header].replace([np.inf, -np.inf], np.nan)
+        return df.astype(object).where(df.notna(), '')
 
     def format_report(self):
         """Report formatter.  Returns a dictionary called report containing the
@@ -202,6 +364,9 @@ class TopOppUsageByFacility(ReportUtils.Reporter):
 
         :return dict: Constructed dict of report information for
         Reporter.send_report to send report from"""
+        if self.compare:
+            return self.generate_comparison()
+
         report = defaultdict(list)
 
         for result_list in self.generate_report():
@@ -216,6 +381,10 @@ def main():
     args = parse_report_args()
     logfile_fname = args.logfile if args.logfile is not None else LOGFILE
 
+    if args.backfill:
+        sys.exit(Backfill.run('osgtopoppusagereport', args, logfile_fname,
+                              options={'numrank': args.numrank,
+                                       'compare': args.compare}))
 
     try:
         r = TopOppUsageByFacility(config_file=args.config,
@@ -223,11 +392,10 @@ def main():
                                   end=args.end,
                                   template=args.template,
                                   months=args.months,
-                                  is_test=args.is_test,
-                                  no_email=args.no_email,
-                                  verbose=args.verbose,
                                   numrank=args.numrank,
-                                  logfile=logfile_fname)
+                                  compare=args.compare,
+                                  logfile=logfile_fname,
+                                  **report_kwargs(args))
         r.run_report()
         print("Top Opportunistic Usage per Facility Report execution successful")
 
@@ -5,9 +5,8 @@ import sys
 import optparse
 from copy import deepcopy
 
-import psycopg2
-
 from .ProjectName import ProjectName
+from . import Cache
 
 
 __author__ = "Tanya Levshina"
@@ -66,9 +65,35 @@ class XDProject(ProjectName):
 
 
         try:
-            print("Trying to run query to XD DB")
-            connection = psycopg2.connect(**self.get_connection_string())
-            print("Connected to DB")
+            row = Cache.get_cache('xd_projects').get(self.name.strip(),
+                                                     self._lookup)
+            if row:
+                self.set_first_name(row[1])
+                self.set_last_name(row[2])
+                self.set_pi("%s %s" % (row[1], row[2]))
+                self.set_email(row[3])
+                self.set_institution(row[4])
+                self.set_department(row[5])
+                self.set_fos(row[6])
+                self.set_abstract(row[7])
+                return True
+        except:
+            print("Failed to extract information from XD database",traceback.print_stack(), file=sys.stderr)
+            return False
+
+    def _lookup(self):
+        """Run the project query against the XD database.  The result is
+        kept in the 'xd_projects' cache.
+
+        :return tuple: First matching row, or an empty tuple if the project
+            isn't in the XD database
+        """
+        import psycopg2
+
+        print("Trying to run query to XD DB")
+        connection = psycopg2.connect(**self.get_connection_string())
+        print("Connected to DB")
+        try:
             cursor = connection.cursor()
             abstract = "n/a"
             cursor.execute("""select distinct p.person_id,first_name,last_name,email_address,organization_name,
@@ -83,19 +108,9 @@ class XDProject(ProjectName):
             ab.abstract_body not like %s""" ,(self.name.strip(),abstract))
 
             rows = cursor.fetchall()
-            if len(rows):
-                self.set_first_name(rows[0][1])
-                self.set_last_name(rows[0][2])
-                self.set_pi("%s %s" % (rows[0][1], rows[0][2]))
-                self.set_email(rows[0][3])
-                self.set_institution(rows[0][4])
-                self.set_department(rows[0][5])
-                self.set_fos(rows[0][6])
-                self.set_abstract(rows[0][7])
-                return True
-        except:
-            print("Failed to extract information from XD database",traceback.print_stack(), file=sys.stderr)
-            return False
+        finally:
+            connection.close()
+        return tuple(rows[0]) if len(rows) else ()
 
 def parse_opts():
         """Parses command line options"""
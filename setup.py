@@ -10,6 +10,9 @@ setup(name='gracc-osg-reports',
       url='https://github.com/opensciencegrid/gracc-reporting',
       packages=['gracc_osg_reports'],
       install_requires=['gracc_reporting', 'elasticsearch_dsl', 'requests', 'pandas'],
+      extras_require={'async': ['elasticsearch[async]'],
+                      'parquet': ['pyarrow>=14'],
+                      'orjson': ['orjson']},
       entry_points={
           'console_scripts': [
               'osgflockingreport = gracc_osg_reports.OSGFlockingReporter:main',
@@ -21,6 +24,7 @@ setup(name='gracc-osg-reports',
               'osgmissingvo = gracc_osg_reports.MissingVO:main',
               'monthlysites = gracc_osg_reports.MonthlySitesViewReporter:main',
               'payloadbatchreport = gracc_osg_reports.PayloadAndPilotHours:main',
+              'osgreportdaemon = gracc_osg_reports.ReportDaemon:main',
               ]
           }
      )